@@ -0,0 +1,29 @@
+"""
+Rolling-window statistics over a series of weekly office counts. Every
+function makes a single pass over the series with running sums, so adding
+another window does not add another pass or another query.
+"""
+from typing import Iterable
+from typing import Sequence
+
+
+def rolling_averages(counts: Sequence[int], windows: Iterable[int]) -> dict[int, float]:
+    """
+    Averages the most recent weeks of a series for several window sizes at
+    once. If the series is shorter than a window, the average is over the
+    weeks that are available.
+    :param counts: Weekly office counts, newest week first.
+    :param windows: Window sizes in weeks, e.g. (4, 52).
+    :return: Dict of window size to average. The average is None if the
+    series is empty.
+    """
+    averages = {}
+    running_sum = 0
+    weeks_seen = 0
+    for window in sorted(set(windows)):
+        while weeks_seen < min(window, len(counts)):
+            running_sum += counts[weeks_seen]
+            weeks_seen += 1
+        averages[window] = running_sum / weeks_seen if weeks_seen else None
+    return averages
+
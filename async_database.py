@@ -0,0 +1,218 @@
+"""
+Runs Database queries off the Tk main loop. sqlite3 connections can only be
+used by the thread that opened them, so AsyncDatabase owns a worker thread
+that opens its own Database and runs every request there. Each request
+returns a concurrent.futures.Future; asyncio code can await it with
+asyncio.wrap_future(). Callbacks are delivered on the Tk thread by polling
+with after(), since Tk must only be touched from the thread that runs its
+main loop.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+from typing import Iterator
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Requests for these Database methods do not write, so a repeat of one that
+# is still pending can share its result
+READ_PREFIXES = ('get_', 'data_version')
+
+
+class AsyncDatabase:
+    """
+    A facade that runs Database calls on a dedicated worker thread. A request
+    that is identical to one still queued or running is coalesced with it:
+    it gets the same Future and its callback is added to the first one's, so
+    clicking refresh several times while a slow query runs costs one query.
+    """
+    def __init__(self, opener: Callable[[], Database] = Database,
+                 widget=None, poll_ms: int = 20) -> None:
+        """
+        Starts the worker thread. The database is opened on the worker.
+        :param opener: Called on the worker thread to open the database, e.g.
+        Database or a lambda calling columnar_store.open_database().
+        :param widget: A Tk widget used to deliver callbacks on the Tk thread
+        with after(). Without one, callbacks run on the worker thread.
+        :param poll_ms: How often the Tk thread checks for finished requests
+        while any are pending, in milliseconds.
+        """
+        self.opener = opener
+        self.widget = widget
+        self.poll_ms = poll_ms
+        self._requests = queue.Queue()
+        self._finished = queue.SimpleQueue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._polling = False
+        # Callbacks waiting to be delivered on the Tk thread
+        self._undelivered = 0
+        self._thread = threading.Thread(target=self._run, name="async-database", daemon=True)
+        self._thread.start()
+
+    def submit(self, func: Callable, *args, callback: Callable = None,
+               errback: Callable = None, coalesce: bool = True, **kwargs) -> Future:
+        """
+        Runs func(db, *args, **kwargs) on the worker thread, where db is the
+        worker's Database. A result that is an iterator is read into a list
+        on the worker, since its rows come from a worker connection.
+        :param func: The function to run, e.g. Database.get_recent_days.
+        :param callback: Called with the result once func returns.
+        :param errback: Called with the exception if func raises. By default
+        the exception is logged.
+        :param coalesce: Share the result of an identical request that is
+        still pending. Requests with unhashable arguments are never coalesced.
+        :return: A Future for the result.
+        """
+        key = None
+        if coalesce:
+            try:
+                key = (func, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                key = None
+
+        with self._lock:
+            future = self._pending.get(key) if key is not None else None
+            if future is None:
+                future = Future()
+                if key is not None:
+                    self._pending[key] = future
+                self._requests.put((key, func, args, kwargs, future))
+        if callback is not None or errback is not None:
+            self._add_callback(future, callback, errback)
+        return future
+
+    def call(self, method: str, *args, callback: Callable = None,
+             errback: Callable = None, **kwargs) -> Future:
+        """
+        Calls a Database method by name on the worker thread. Reads are
+        coalesced; writes always run.
+        :param method: The name of the method, e.g. 'get_weekly_summary'.
+        :param callback: Called with the result once the method returns.
+        :param errback: Called with the exception if the method raises.
+        :return: A Future for the result.
+        """
+        return self.submit(_method_caller(method), *args, callback=callback, errback=errback,
+                           coalesce=method.startswith(READ_PREFIXES), **kwargs)
+
+    def close(self, timeout: float = None) -> None:
+        """
+        Finishes the queued requests, closes the worker's database and stops
+        the worker thread.
+        :param timeout: The most seconds to wait, or None to wait until done.
+        """
+        self._requests.put(None)
+        self._thread.join(timeout)
+
+    def _add_callback(self, future: Future, callback: Callable, errback: Callable) -> None:
+        """
+        Arranges for callback or errback to be called when future is done, on
+        the Tk thread if there is a widget.
+        """
+        def deliver(done: Future) -> None:
+            if done.cancelled():
+                return
+            err = done.exception()
+            if err is None:
+                if callback is not None:
+                    callback(done.result())
+            elif errback is not None:
+                errback(err)
+            else:
+                logger.error(f"Database request failed: {err!r}")
+
+        if self.widget is None:
+            future.add_done_callback(deliver)
+            return
+        self._undelivered += 1
+        future.add_done_callback(lambda done: self._finished.put((deliver, done)))
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_ms, self._poll)
+
+    def _poll(self) -> None:
+        """
+        Runs on the Tk thread. Delivers the callbacks of finished requests and
+        polls again while requests with callbacks are still pending.
+        """
+        while True:
+            try:
+                deliver, done = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            self._undelivered -= 1
+            try:
+                deliver(done)
+            except Exception:
+                logger.exception("Database callback failed")
+        if self._undelivered:
+            self.widget.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+
+    def _run(self) -> None:
+        """
+        Worker loop. Opens the database, runs requests in order until close()
+        and then closes the database.
+        """
+        db = None
+        try:
+            db = self.opener()
+        except Exception as err:
+            logger.error(f"Could not open the database: {err!r}")
+            open_error = err
+        else:
+            open_error = None
+
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            key, func, args, kwargs, future = request
+            if not future.set_running_or_notify_cancel():
+                self._forget(key)
+                continue
+            try:
+                if open_error is not None:
+                    raise open_error
+                result = func(db, *args, **kwargs)
+                if isinstance(result, Iterator):
+                    result = list(result)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+            self._forget(key)
+
+        if db is not None:
+            db.close()
+
+    def _forget(self, key) -> None:
+        """
+        Ends coalescing for a finished request, so a later identical request
+        runs again and sees fresh data.
+        """
+        if key is not None:
+            with self._lock:
+                self._pending.pop(key, None)
+
+
+def _method_caller(method: str) -> Callable:
+    """
+    Returns a function that calls a Database method by name. The functions
+    are cached, so repeated reads of the same method coalesce.
+    """
+    caller = _method_callers.get(method)
+    if caller is None:
+        def caller(db, *args, **kwargs):
+            return getattr(db, method)(*args, **kwargs)
+        _method_callers[method] = caller
+    return caller
+
+
+_method_callers = {}
@@ -0,0 +1,252 @@
+"""
+The log of changes to the database. Database writes log one record per
+changed work day, with the change in extra=audit.fields(...): the operation,
+person, work date and old and new location. configure() puts a QueueHandler
+on the root logger, so logging a record only puts it on a queue. A listener
+thread formats the records into the text log and, given audit_db, inserts
+the changes into the AuditLog table in batches, one transaction for all the
+changes of up to flush_interval seconds.
+
+    audit.configure(audit_db=Path('Data/worklocation.db'))
+
+Database.get_location_history() reads the history of a work date back. Until
+configure() is called, e.g. in tests, INFO records are dropped as usual.
+"""
+import atexit
+import logging
+import queue
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from pathlib import Path
+from typing import NamedTuple
+
+DEFAULT_LOG_PATH = Path('Data/work_location_log.txt')
+LOG_FORMAT = '%(asctime)s | %(levelname)s | %(name)s.%(funcName)s | %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class AuditRecord(NamedTuple):
+    """
+    One change to a work day.
+    """
+    operation: str
+    person_id: int
+    work_date: str = None
+    old_location: str = None
+    new_location: str = None
+    detail: str = None
+
+
+def fields(operation: str, person_id: int, work_date: str = None,
+           old_location: str = None, new_location: str = None, **detail) -> dict:
+    """
+    Builds the extra argument of a logging call that records a change, e.g.
+    logger.info("Set location", extra=audit.fields('set_location', 1, ...)).
+    :param operation: What was done, e.g. 'new_work_day' or 'set_location'.
+    :param person_id: The person whose work day changed.
+    :param work_date: The work date, yyyy-mm-dd.
+    :param old_location: The location before the change, None if the work
+    day is new.
+    :param new_location: The location after the change.
+    :param detail: Other fields, kept as key=value text.
+    :return: The dict to pass as extra.
+    """
+    text = " ".join(f"{key}={value}" for key, value in detail.items()) or None
+    return {'audit': AuditRecord(operation, person_id, work_date, old_location, new_location, text)}
+
+
+class AuditFormatter(logging.Formatter):
+    """
+    Formats a record as text, followed by the fields of its change as
+    key=value pairs.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        change = getattr(record, 'audit', None)
+        if change is None:
+            return text
+        pairs = " ".join(f"{key}={value}" for key, value in change._asdict().items()
+                         if value is not None and key not in ('operation', 'detail'))
+        return " ".join(part for part in (text, pairs, change.detail) if part)
+
+
+class AuditTableHandler(logging.Handler):
+    """
+    Inserts the changes of audit records into the AuditLog table. Records
+    without a change are ignored. Rows are buffered and inserted in one
+    transaction when capacity is reached or when the handler is flushed,
+    which AuditListener does at an interval.
+    """
+    def __init__(self, db_path: Path, capacity: int = 500) -> None:
+        """
+        Creates the handler. The connection is opened on the first insert.
+        :param db_path: Path of the database holding the AuditLog table.
+        :param capacity: The most rows buffered before they are inserted.
+        """
+        super().__init__()
+        self.db_path = db_path
+        self.capacity = capacity
+        self.buffer = []
+        self.con = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        change = getattr(record, 'audit', None)
+        if change is None:
+            return
+        logged_at = datetime.fromtimestamp(record.created).isoformat(sep=' ', timespec='milliseconds')
+        self.buffer.append((logged_at, *change))
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Inserts the buffered rows. If the insert fails the rows are dropped
+        with a message on stderr; they are still in the text log.
+        """
+        with self.lock:
+            if not self.buffer:
+                return
+            rows, self.buffer = self.buffer, []
+            try:
+                if self.con is None:
+                    # Flushed by the listener thread, or by shutdown() once it has stopped
+                    self.con = sqlite3.connect(str(self.db_path), check_same_thread=False)
+                with self.con:
+                    # noinspection SqlNoDataSourceInspection
+                    self.con.executemany(
+                        """
+                        INSERT INTO AuditLog (logged_at, operation, person_id, work_date,
+                                              old_location, new_location, detail)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """, rows
+                    )
+            except sqlite3.Error as err:
+                print(f"Could not write {len(rows)} rows to AuditLog: {err!r}", file=sys.stderr)
+
+    def close(self) -> None:
+        self.flush()
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+        super().close()
+
+
+class AuditListener(QueueListener):
+    """
+    A QueueListener that handles records in batches. After the first record
+    of a batch it waits flush_interval seconds, handles everything queued by
+    then and flushes its handlers. The records of a burst of writes are
+    written together, and the listener does not wake up and compete with the
+    writing thread for the GIL after every record.
+    """
+    def __init__(self, log_queue, *handlers, respect_handler_level: bool = False,
+                 flush_interval: float = 0.5) -> None:
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+        self._wake = threading.Event()
+
+    def dequeue(self, block: bool):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            if not block:
+                raise
+        self.flush()
+        record = self.queue.get()
+        # stop() sets _wake, so it does not wait out the interval
+        self._wake.wait(self.flush_interval)
+        return record
+
+    def flush(self) -> None:
+        """
+        Writes what the handlers have buffered.
+        """
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self) -> None:
+        self._wake.set()
+        super().stop()
+        self._wake.clear()
+
+
+_listener: AuditListener = None
+_queue_handler: QueueHandler = None
+_previous_level: int = None
+_exit_hook_registered = False
+
+
+def configure(log_path: Path = DEFAULT_LOG_PATH, audit_db: Path = None,
+              level: int = logging.INFO, capacity: int = 500,
+              flush_interval: float = 0.5) -> AuditListener:
+    """
+    Routes all logging through a queue to a background listener thread.
+    Calling it again replaces the previous configuration.
+    :param log_path: The text log to append to, or None for no text log.
+    :param audit_db: Path of a database with the AuditLog table to insert
+    the changes into, or None to keep only the text log.
+    :param level: The level of the root logger.
+    :param capacity: The most rows inserted into AuditLog in one batch.
+    :param flush_interval: The most seconds a record waits before it is
+    written.
+    :return: The started listener.
+    """
+    global _listener, _queue_handler, _previous_level, _exit_hook_registered
+    shutdown()
+    handlers = []
+    if log_path is not None:
+        file_handler = logging.FileHandler(log_path, mode='a', encoding='utf-8', delay=True)
+        file_handler.setFormatter(AuditFormatter(LOG_FORMAT, DATE_FORMAT))
+        handlers.append(file_handler)
+    if audit_db is not None:
+        handlers.append(AuditTableHandler(audit_db, capacity))
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    _previous_level = root.level
+    root.setLevel(level)
+    _listener = AuditListener(log_queue, *handlers, respect_handler_level=True,
+                              flush_interval=flush_interval)
+    _listener.start()
+    if not _exit_hook_registered:
+        atexit.register(shutdown)
+        _exit_hook_registered = True
+    return _listener
+
+
+def flush() -> None:
+    """
+    Waits until every record logged so far is written, e.g. before reading
+    the AuditLog table.
+    """
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener.flush()
+    _listener.start()
+
+
+def shutdown() -> None:
+    """
+    Writes the queued records, stops the listener thread, removes the queue
+    handler from the root logger and restores its level. Registered with
+    atexit by configure().
+    """
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        root = logging.getLogger()
+        root.removeHandler(_queue_handler)
+        root.setLevel(_previous_level)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,272 @@
+"""
+Compressed backups of the database. The copy is made with SQLite's online
+backup API a few pages at a time, sleeping between steps, so the app and the
+daily input widget can keep writing while a backup runs. If they write during
+the copy, SQLite restarts it from the changed pages, so the backup is never
+torn. A backup that keeps being restarted by writes copies the rest in one
+step instead. The copy is then compressed into Data/backups and checked with
+PRAGMA integrity_check on a background thread, so the caller does not wait
+for the check. Older backups are rotated out only once the new one has
+passed it.
+
+    python backup.py --db Data/worklocation.db --compression lzma --keep 14
+"""
+import functools
+import gzip
+import logging
+import lzma
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKUP_DIR = Path('Data/backups')
+
+# Compression name to (file suffix, open function). gzip level 6 is as small
+# as the default level 9 on a database file and several times faster.
+COMPRESSORS = {
+    'gzip': ('.db.gz', functools.partial(gzip.open, compresslevel=6)),
+    'lzma': ('.db.xz', lzma.open),
+}
+
+
+class Backup(NamedTuple):
+    """
+    A backup made by create_backup().
+    """
+    path: Path
+    # The result of verify_in_background(), None if the backup is not checked
+    verified: Future | None
+
+
+class _BackupRestarted(Exception):
+    """
+    Raised from the progress callback to stop a backup that writes keep
+    restarting.
+    """
+
+
+def copy_database(source: sqlite3.Connection, target: sqlite3.Connection,
+                  pages_per_step: int = 256, sleep: float = 0.05,
+                  max_restarts: int = 3) -> None:
+    """
+    Copies source into target with the online backup API, pages_per_step
+    pages at a time. A write to source from another connection restarts the
+    copy, so after max_restarts restarts the copy is finished in one step,
+    which holds the read lock until it is done.
+    :param source: The connection to copy from.
+    :param target: The connection to copy into.
+    :param pages_per_step: The pages copied per step, or -1 for all at once.
+    :param sleep: The seconds to sleep between steps, with the read lock
+    released.
+    :param max_restarts: The restarts allowed before copying in one step.
+    """
+    last_remaining = None
+    restarts = 0
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal last_remaining, restarts
+        # remaining drops with every step, unless the copy started over
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _BackupRestarted()
+        last_remaining = remaining
+        # Connection.backup itself only sleeps when a step finds the source busy
+        if remaining > 0 and sleep > 0:
+            time.sleep(sleep)
+
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress, sleep=sleep)
+    except _BackupRestarted:
+        logger.warning(f"Backup restarted {restarts} times by writes, copying the rest in one step")
+        source.backup(target)
+
+
+def list_backups(db_path: Path, backup_dir: Path = DEFAULT_BACKUP_DIR) -> list[Path]:
+    """
+    Lists the backups of a database, oldest first.
+    :param db_path: Path of the live database.
+    :param backup_dir: The folder holding the backups.
+    :return: List of backup paths.
+    """
+    backup_dir = Path(backup_dir)
+    if not backup_dir.is_dir():
+        return []
+    suffixes = tuple(suffix for suffix, _ in COMPRESSORS.values())
+    # The timestamp in the name sorts in the order the backups were made
+    return sorted(path for path in backup_dir.glob(f"{Path(db_path).stem}-*")
+                  if path.name.endswith(suffixes))
+
+
+def create_backup(db_path: Path, backup_dir: Path = DEFAULT_BACKUP_DIR,
+                  compression: str = 'gzip', keep: int = 7,
+                  pages_per_step: int = 256, sleep: float = 0.05,
+                  max_restarts: int = 3, verify: bool = True) -> Backup:
+    """
+    Backs up the database into a compressed file. The copy takes the read lock
+    for pages_per_step pages at a time and releases it for sleep seconds
+    between steps.
+    :param db_path: Path of the live database.
+    :param backup_dir: The folder to write the backup to. Created if needed.
+    :param compression: A key of COMPRESSORS.
+    :param keep: The number of backups to keep, including the new one.
+    :param pages_per_step: The pages copied per step of the backup.
+    :param sleep: The seconds to sleep between steps.
+    :param max_restarts: The restarts by writes allowed before the rest is
+    copied in one step. See copy_database().
+    :param verify: Check the backup with PRAGMA integrity_check on a
+    background thread and, if it passes, rotate out the backups beyond keep.
+    Without it nothing is rotated; see verify_in_background().
+    :return: A Backup with the path of the new backup and the Future of its
+    check. A backup that fails the check is renamed with a .corrupt suffix
+    and the older backups are kept.
+    :raises ValueError: If compression is not one of COMPRESSORS.
+    """
+    if compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {tuple(COMPRESSORS)}")
+    suffix, open_compressed = COMPRESSORS[compression]
+    backup_dir = Path(backup_dir)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    backup_path = backup_dir / f"{Path(db_path).stem}-{stamp}{suffix}"
+
+    start = time.perf_counter()
+    fd, copy_name = tempfile.mkstemp(dir=backup_dir, suffix='.db.tmp')
+    os.close(fd)
+    compressed_name = f"{backup_path}.tmp"
+    try:
+        source = sqlite3.connect(str(db_path))
+        target = sqlite3.connect(copy_name)
+        try:
+            copy_database(source, target, pages_per_step, sleep, max_restarts)
+            # The backup is a single file, whatever the journal mode of the source
+            target.execute('PRAGMA journal_mode = delete')
+        finally:
+            target.close()
+            source.close()
+        with open(copy_name, 'rb') as copy, open_compressed(compressed_name, 'wb') as compressed:
+            shutil.copyfileobj(copy, compressed, 1024 * 1024)
+        os.replace(compressed_name, backup_path)
+    except BaseException:
+        Path(compressed_name).unlink(missing_ok=True)
+        raise
+    finally:
+        Path(copy_name).unlink(missing_ok=True)
+    logger.info(f"backup={backup_path} bytes={backup_path.stat().st_size} "
+                f"seconds={time.perf_counter() - start:.3f}")
+
+    verified = verify_in_background(backup_path, db_path, backup_dir, keep) if verify else None
+    return Backup(backup_path, verified)
+
+
+def rotate_backups(db_path: Path, backup_dir: Path = DEFAULT_BACKUP_DIR, keep: int = 7) -> None:
+    """
+    Deletes the oldest backups of a database beyond keep. Only call it once
+    the newest backup has been verified.
+    :param db_path: Path of the live database.
+    :param backup_dir: The folder holding the backups.
+    :param keep: The number of backups to keep.
+    """
+    for old in list_backups(db_path, backup_dir)[:-keep]:
+        old.unlink()
+        logger.info(f"Removed old backup {old}")
+
+
+def verify_backup(backup_path: Path) -> bool:
+    """
+    Decompresses a backup to a temporary file and runs PRAGMA integrity_check
+    on it. A backup that fails is renamed with a .corrupt suffix, so it is no
+    longer counted by list_backups().
+    :param backup_path: Path of a backup made by create_backup().
+    :return: True if the backup is sound.
+    """
+    open_compressed = next(opener for suffix, opener in COMPRESSORS.values()
+                           if backup_path.name.endswith(suffix))
+    fd, copy_name = tempfile.mkstemp(dir=backup_path.parent, suffix='.db.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as copy, open_compressed(backup_path, 'rb') as compressed:
+            shutil.copyfileobj(compressed, copy, 1024 * 1024)
+        con = sqlite3.connect(f"{Path(copy_name).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            result = [row[0] for row in con.execute('PRAGMA integrity_check')]
+        finally:
+            con.close()
+    except (OSError, EOFError, lzma.LZMAError, sqlite3.DatabaseError) as err:
+        result = [repr(err)]
+    finally:
+        Path(copy_name).unlink(missing_ok=True)
+
+    if result == ['ok']:
+        logger.info(f"Verified backup {backup_path}")
+        return True
+    logger.error(f"Backup {backup_path} failed the integrity check: {'; '.join(result)}")
+    backup_path.replace(backup_path.with_name(backup_path.name + '.corrupt'))
+    return False
+
+
+def verify_in_background(backup_path: Path, db_path: Path,
+                         backup_dir: Path = DEFAULT_BACKUP_DIR, keep: int = 7) -> Future:
+    """
+    Runs verify_backup() on a background thread and, if the backup passes,
+    rotate_backups(). The thread is not a daemon, so the program does not
+    exit in the middle of a check.
+    :param backup_path: Path of a backup made by create_backup().
+    :param db_path: Path of the live database.
+    :param backup_dir: The folder holding the backups.
+    :param keep: The number of backups to keep, including the new one.
+    :return: A Future for the result of verify_backup().
+    """
+    future = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = verify_backup(backup_path)
+            if result:
+                rotate_backups(db_path, backup_dir, keep)
+        except BaseException as err:
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=run, name="backup-verify").start()
+    return future
+
+
+def main() -> None:
+    """
+    Command line entry point. Makes one backup and waits for it to be
+    verified and the old ones rotated out, e.g. from a scheduled task.
+    """
+    # Imported here, so importing this module from the app does not load it
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Make a compressed backup of the database.")
+    parser.add_argument('--db', default='Data/worklocation.db', help="Path to the database file.")
+    parser.add_argument('--dir', default=str(DEFAULT_BACKUP_DIR), help="The folder for the backups.")
+    parser.add_argument('--compression', choices=sorted(COMPRESSORS), default='gzip')
+    parser.add_argument('--keep', type=int, default=7, help="The number of backups to keep.")
+    parser.add_argument('--pages-per-step', type=int, default=256,
+                        help="The pages copied before the lock is released.")
+    parser.add_argument('--sleep', type=float, default=0.05, help="Seconds to sleep between steps.")
+    args = parser.parse_args()
+
+    new_backup = create_backup(Path(args.db), Path(args.dir), args.compression, args.keep,
+                               args.pages_per_step, args.sleep)
+    print(new_backup.path)
+    if not new_backup.verified.result():
+        raise SystemExit(f"{new_backup.path} failed the integrity check")
+
+
+if __name__ == '__main__':
+    main()
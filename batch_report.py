@@ -0,0 +1,164 @@
+"""
+Renders the YTD attendance report for many people and years in one run, for
+a nightly job. Reports are rendered across a pool of processes. Each worker
+process opens its own query-only connections to every database it reports
+on and reuses them for all of its reports. Every report is written to a
+temporary file that replaces the output file once it is complete.
+
+    python batch_report.py --db Data/worklocation.db --year 2023 2024 --out reports
+
+With no --person, every person in each database gets a report. With
+--snapshot, a snapshot of each database is made first and the reports read
+from it, so the run neither waits on nor blocks the app's writes.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from datetime import date
+from pathlib import Path
+from typing import NamedTuple
+
+from connection_pool import READ_ONLY_PROFILE
+from database import Database
+import snapshot
+import work_calendar
+import ytd_html_report
+
+
+class ReportJob(NamedTuple):
+    """
+    One report to render.
+    """
+    db_path: str
+    person_id: int
+    year: int
+    filename: str
+    snapshot_dir: str = None
+
+
+# The Database of each file opened by this worker process
+_databases: dict[tuple[str, str], Database] = {}
+
+
+def _worker_database(db_path: str, snapshot_dir: str = None) -> Database:
+    """
+    Returns the query-only Database for db_path in this process, opening it
+    on first use.
+    """
+    db = _databases.get((db_path, snapshot_dir))
+    if db is None:
+        db = _databases[(db_path, snapshot_dir)] = Database(
+            Path(db_path), writer_profile=READ_ONLY_PROFILE, reader_profile=READ_ONLY_PROFILE,
+            snapshot_dir=None if snapshot_dir is None else Path(snapshot_dir))
+    return db
+
+
+def render(job: ReportJob, today: date = None) -> float:
+    """
+    Renders one report. Runs in a worker process.
+    :param job: The report to render.
+    :param today: The date to treat as today. Defaults to date.today().
+    :return: The time taken, in seconds.
+    """
+    start = time.perf_counter()
+    ytd_html_report.generate_report(db=_worker_database(job.db_path, job.snapshot_dir), year=job.year,
+                                    person_id=job.person_id, filename=job.filename,
+                                    today=today)
+    return time.perf_counter() - start
+
+
+def plan_jobs(db_paths: list[str], years: list[int], out_dir: Path,
+              person_ids: list[int] = None, snapshot_dir: Path = None) -> list[ReportJob]:
+    """
+    Lists the reports to render. Opening each database here also migrates
+    an older one to the current schema before the query-only workers use it.
+    :param db_paths: The database files.
+    :param years: The ISO years to report on.
+    :param out_dir: The folder the reports are written to.
+    :param person_ids: The people to report on. Defaults to everyone in each
+    database.
+    :param snapshot_dir: Make a snapshot of each database in this folder,
+    for the reports to read from.
+    :return: One job for each database, person and year.
+    """
+    jobs = []
+    for db_path in db_paths:
+        db = Database(Path(db_path))
+        persons = person_ids if person_ids else [person_id for person_id, _ in db.get_persons()]
+        db.close()
+        if snapshot_dir is not None:
+            snapshot.create_snapshot(Path(db_path), snapshot_dir)
+        for person_id in persons:
+            for year in years:
+                filename = out_dir / f"{Path(db_path).stem}_person{person_id}_{year}.html"
+                jobs.append(ReportJob(str(db_path), person_id, year, str(filename),
+                                      None if snapshot_dir is None else str(snapshot_dir)))
+    return jobs
+
+
+def run(jobs: list[ReportJob], workers: int = None, today: date = None) -> int:
+    """
+    Renders the reports across a pool of processes and prints the time of
+    each report and the total throughput. The workers are spawned rather
+    than forked, so they do not inherit the open SQLite connections in this
+    process's connection pools.
+    :param jobs: The reports to render.
+    :param workers: The number of worker processes. Defaults to the number of
+    CPUs.
+    :param today: The date to treat as today. Defaults to date.today().
+    :return: The number of reports that failed.
+    """
+    failed = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(render, job, today): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as err:
+                failed += 1
+                print(f"FAILED {job.filename}: {err!r}", file=sys.stderr)
+            else:
+                print(f"{seconds * 1000:>9.1f} ms  {job.filename}")
+    elapsed = time.perf_counter() - start
+    done = len(jobs) - failed
+    print(f"{done} reports in {elapsed:.2f}s, {done / elapsed if elapsed else 0:.1f} reports/s"
+          + (f", {failed} failed" if failed else ""))
+    return failed
+
+
+def main() -> None:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Render attendance reports for many people and years.")
+    parser.add_argument('--db', nargs='+', default=['Data/worklocation.db'],
+                        help="Paths to the database files.")
+    parser.add_argument('--person', nargs='+', type=int,
+                        help="The person_ids to report on. Defaults to everyone.")
+    parser.add_argument('--year', nargs='+', type=int,
+                        default=[work_calendar.iso_year(date.today())],
+                        help="The ISO years to report on. Defaults to the current year.")
+    parser.add_argument('--out', default='reports', help="The folder to write the reports to.")
+    parser.add_argument('--snapshot', nargs='?', const=str(snapshot.DEFAULT_SNAPSHOT_DIR),
+                        help="Read from a fresh snapshot of each database, made in this folder. "
+                             f"Defaults to {snapshot.DEFAULT_SNAPSHOT_DIR}.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="The number of worker processes.")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    snapshot_dir = None if args.snapshot is None else Path(args.snapshot)
+    jobs = plan_jobs(args.db, args.year, out_dir, args.person, snapshot_dir)
+    sys.exit(1 if run(jobs, args.workers) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,907 @@
+"""
+Benchmarks for the database layer. Every benchmark builds a synthetic database
+in a temporary folder, so the real database is never touched.
+Run a benchmark with `python benchmarks.py <name>`. Run with no name to list
+the available benchmarks.
+"""
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
+
+from columnar_store import ColumnarStore
+import audit
+import backup
+import db_setup
+import instrumentation
+import snapshot
+from connection_pool import OpenProfile
+from connection_pool import READER_PROFILE
+from connection_pool import WRITER_PROFILE
+from database import Database
+import work_calendar
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    """Registers a benchmark function under its own name."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def time_call(func, repeat: int = 50) -> float:
+    """
+    Calls func repeatedly and returns the median wall time of one call.
+    :param func: A callable with no arguments.
+    :param repeat: The number of timed calls.
+    :return: Median time of one call, in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def build_synthetic_db(db_path: Path, start_year: int = 2015, end_year: int = 2025,
+                       seed: int = 1, persons: int = 1) -> int:
+    """
+    Creates a database with a random office/remote location for every weekday
+    from the first ISO week of start_year up to, but not including, end_year.
+    :param db_path: Path of the database file to create.
+    :param start_year: First ISO year with data.
+    :param end_year: The ISO year to stop at. Not inclusive.
+    :param seed: Seed for the random locations, so runs are repeatable.
+    :param persons: The number of people. The first is the default person.
+    :return: The number of work days inserted.
+    """
+    rng = random.Random(seed)
+    db_setup.create_tables(str(db_path))
+    db_setup.fill_week_table(start_year=start_year, end_year=end_year + 1, db_path=str(db_path))
+    db_setup.fill_location_table(str(db_path))
+
+    days = []
+    working_date = date.fromisocalendar(start_year, 1, 1)
+    while working_date.isocalendar().year < end_year:
+        if working_date.weekday() < 5:
+            days.append((work_calendar.day_number(working_date),
+                         work_calendar.week_id(work_calendar.week_number(working_date))))
+        working_date += timedelta(days=1)
+
+    con = sqlite3.connect(str(db_path))
+    # noinspection SqlNoDataSourceInspection
+    locations = dict(con.execute("SELECT name, location_id FROM Location"))
+    # Load without the WeekSummary and change log triggers, then rebuild the
+    # rollup once and start the change log with a baseline checkpoint
+    # noinspection SqlNoDataSourceInspection
+    con.executescript(
+        """
+        DROP TRIGGER WorkDay_summary_insert;
+        DROP TRIGGER WorkDay_summary_delete;
+        DROP TRIGGER WorkDay_summary_update;
+        DROP TRIGGER WorkDay_event_insert;
+        DROP TRIGGER WorkDay_event_delete;
+        DROP TRIGGER WorkDay_event_update;
+        DROP TRIGGER WorkDay_event_move;
+        """)
+    with con:
+        # noinspection SqlNoDataSourceInspection
+        con.executemany("INSERT OR IGNORE INTO Person (person_id, name) VALUES (?, ?)",
+                        [(person_id, f"person {person_id}") for person_id in range(2, persons + 1)])
+        for person_id in range(1, persons + 1):
+            # Each person has their own habit, so the averages differ
+            office_rate = rng.random()
+            # noinspection SqlNoDataSourceInspection
+            con.executemany(
+                "INSERT INTO WorkDay (person_id, day, week_id, location_id) VALUES (?, ?, ?, ?)",
+                [(person_id, day, week_id,
+                  locations['office'] if rng.random() < office_rate else locations['remote'])
+                 for day, week_id in days])
+    db_setup.create_week_summary(con)
+    db_setup.rebuild_week_summary(con)
+    with con:
+        db_setup.create_change_log(con)
+    con.close()
+    return len(days) * persons
+
+@benchmark
+def week_summary(args) -> None:
+    """
+    Compares the weekly read queries that aggregate WorkDay on every call
+    with the same queries reading the WeekSummary rollup.
+    """
+    year_start, year_end = (args.end_year - 1) * 100 + 1, (args.end_year - 1) * 100 + 52
+    # The office is location 1 in the synthetic database
+    # noinspection SqlNoDataSourceInspection
+    legacy = {
+        'get_weekly_summary': (
+            """
+            SELECT w.week_number, date(w.week_start), date(w.week_end),
+                COUNT(CASE WHEN wd.location_id = 1 THEN 1 ELSE NULL END)
+            FROM Week AS w LEFT OUTER JOIN WorkDay AS wd ON w.week_id = wd.week_id
+            WHERE w.week_id >= ? AND w.week_id <= ?
+            GROUP BY w.week_id
+            """, (year_start, year_end)),
+        'get_ytd_average': (
+            """
+            SELECT AVG(office_count) FROM (
+                SELECT w.week_id,
+                    COUNT(CASE WHEN wd.location_id = 1 THEN 1 ELSE NULL END) AS office_count
+                FROM Week AS w LEFT OUTER JOIN WorkDay AS wd ON w.week_id = wd.week_id
+                WHERE w.week_id BETWEEN ? AND ?
+                GROUP BY w.week_id)
+            """, (year_start, year_end)),
+        'get_weekly_count': (
+            """
+            SELECT COUNT(day) FROM WorkDay
+            WHERE week_id = ? AND location_id = 1
+            """, ((args.end_year - 1) * 100 + 30,)),
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        row_count = build_synthetic_db(db_path, args.start_year, args.end_year)
+        db = Database(db_path)
+        year = args.end_year - 1
+        current = {
+            'get_weekly_summary': lambda: db.get_weekly_summary(f"{year}-01", f"{year}-52"),
+            'get_ytd_average': lambda: db.get_ytd_average(year, f"{year}-52"),
+            'get_weekly_count': lambda: db.get_weekly_count(f"{year}-30"),
+        }
+
+        print(f"{row_count} work days, {args.start_year}-{args.end_year - 1}")
+        print(f"{'query':<20}{'WorkDay (ms)':>14}{'WeekSummary (ms)':>18}")
+        for name, (sql, params) in legacy.items():
+            before = time_call(lambda: db.con.execute(sql, params).fetchall(), args.repeat)
+            after = time_call(current[name], args.repeat)
+            print(f"{name:<20}{before:>14.3f}{after:>18.3f}")
+        db.close()
+
+def percentile(timings: list[float], fraction: float) -> float:
+    """
+    Returns the value at the given fraction of the sorted timings.
+    :param timings: Timings in seconds.
+    :param fraction: Between 0 and 1, e.g. 0.95 for the 95th percentile.
+    :return: The timing in milliseconds, or 0 if there are no timings.
+    """
+    if not timings:
+        return 0.0
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+@benchmark
+def open_profile(args) -> None:
+    """
+    Measures read and write latency while a writer and two readers use the
+    same database at once, with the default rollback journal and with WAL.
+    """
+    rollback_journal = OpenProfile(journal_mode='delete', synchronous='full',
+                                   cache_size=-2000, mmap_size=0, busy_timeout=5000)
+    profiles = {
+        'rollback journal': (rollback_journal, rollback_journal._replace(journal_mode='')),
+        'WAL': (WRITER_PROFILE, READER_PROFILE),
+    }
+    year = args.end_year - 1
+    writes = args.repeat * 4
+
+    for name, (writer_profile, reader_profile) in profiles.items():
+        with tempfile.TemporaryDirectory() as folder:
+            db_path = Path(folder) / 'bench.db'
+            build_synthetic_db(db_path, args.start_year, args.end_year)
+            write_times, read_times, errors = [], [], []
+            done = threading.Event()
+
+            def write() -> None:
+                db = Database(db_path, writer_profile=writer_profile, reader_profile=reader_profile)
+                days = [day for day, _ in db.get_recent_days(writes)]
+                for work_date in days:
+                    start = time.perf_counter()
+                    try:
+                        db.set_location(work_date, 'office')
+                    except sqlite3.OperationalError as err:
+                        errors.append(err)
+                    write_times.append(time.perf_counter() - start)
+                done.set()
+                db.close()
+
+            def read() -> None:
+                db = Database(db_path, writer_profile=writer_profile, reader_profile=reader_profile)
+                while not done.is_set():
+                    start = time.perf_counter()
+                    try:
+                        db.get_weekly_summary(f"{year}-01", f"{year}-52")
+                    except sqlite3.OperationalError as err:
+                        errors.append(err)
+                    read_times.append(time.perf_counter() - start)
+                db.close()
+
+            threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(2)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            print(f"{name}: {writes} writes and {len(read_times)} reads in {elapsed:.2f}s, "
+                  f"{len(errors)} lock errors")
+            print(f"    write p50 {percentile(write_times, 0.5):.3f} ms, "
+                  f"p95 {percentile(write_times, 0.95):.3f} ms")
+            print(f"    read  p50 {percentile(read_times, 0.5):.3f} ms, "
+                  f"p95 {percentile(read_times, 0.95):.3f} ms")
+
+@benchmark
+def week_numbers(args) -> None:
+    """
+    Compares converting every day from start_year to end_year to a week
+    number with isocalendar(), the cached week_number() and week_numbers().
+    """
+    start = date(args.start_year, 1, 1)
+    days = [start + timedelta(days=offset)
+            for offset in range((date(args.end_year, 1, 1) - start).days)]
+
+    def isocalendar() -> None:
+        for day in days:
+            iso_year, iso_week, _ = day.isocalendar()
+            f"{iso_year}-{iso_week:02}"
+
+    def cached() -> None:
+        for day in days:
+            work_calendar.week_number(day)
+
+    print(f"{len(days)} dates")
+    print(f"isocalendar()   {time_call(isocalendar, args.repeat):9.3f} ms")
+    print(f"week_number()   {time_call(cached, args.repeat):9.3f} ms")
+    print(f"week_numbers()  {time_call(lambda: work_calendar.week_numbers(days), args.repeat):9.3f} ms")
+
+@benchmark
+def bulk_writes(args) -> None:
+    """
+    Compares commits and wall time of the per-row write methods with
+    bulk_new_work_days and bulk_set_locations for a year of work days.
+    """
+    # synchronous=full makes every commit an fsync, as on the rollback journal
+    profile = WRITER_PROFILE._replace(synchronous='full')
+    start = date.fromisocalendar(args.end_year, 1, 1)
+    days = [day for day in (start + timedelta(days=offset) for offset in range(364))
+            if day.weekday() < 5]
+    rows = [(day.isoformat(), work_calendar.week_number(day), 'remote') for day in days]
+    changes = [(day.isoformat(), 'office') for day in days]
+
+    def per_row(db: Database) -> None:
+        for work_date, week_number, location in rows:
+            db.new_work_day(work_date, week_number, location)
+        for work_date, location in changes:
+            db.set_location(work_date, location)
+
+    def bulk(db: Database) -> None:
+        db.bulk_new_work_days(rows)
+        db.bulk_set_locations(changes)
+
+    print(f"{len(rows)} inserts and {len(changes)} updates, synchronous=full")
+    for name, write in (('per-row', per_row), ('bulk', bulk)):
+        with tempfile.TemporaryDirectory() as folder:
+            db_path = Path(folder) / 'bench.db'
+            build_synthetic_db(db_path, args.start_year, args.end_year)
+            db = Database(db_path, writer_profile=profile)
+            db.ensure_week(f"{args.end_year + 1}-01")
+            commits = []
+            db.con.set_trace_callback(lambda sql: commits.append(sql) if sql == 'COMMIT' else None)
+            elapsed = time_call(lambda: write(db), repeat=1)
+            db.con.set_trace_callback(None)
+            db.close()
+        print(f"{name:<8}{len(commits):>6} commits (fsyncs){elapsed:>12.1f} ms")
+
+@benchmark
+def add_work_day(args) -> None:
+    """
+    Compares the statements and wall time of the submit path of the Add Work
+    Day view: get_locations, get_work_day and new_work_day against
+    get_locations and add_work_day, for a year of new and repeated days.
+    """
+    start = date.fromisocalendar(args.end_year, 1, 1)
+    days = [day for day in (start + timedelta(days=offset) for offset in range(364))
+            if day.weekday() < 5]
+    # Every day is submitted twice; the second submit finds it recorded
+    rows = [(day.isoformat(), work_calendar.week_number(day), 'office') for day in days] * 2
+
+    def check_then_insert(db: Database) -> None:
+        for work_date, week_number, location in rows:
+            if location in db.get_locations() and not db.get_work_day(work_date):
+                db.new_work_day(work_date, week_number, location)
+
+    def upsert(db: Database) -> None:
+        for work_date, week_number, location in rows:
+            if location in db.get_locations():
+                db.add_work_day(work_date, week_number, location)
+
+    print(f"{len(rows)} submits of {len(days)} days")
+    for name, submit in (('check then insert', check_then_insert), ('add_work_day', upsert)):
+        results = []
+        # The statements are counted on a second, instrumented run
+        for counted in (False, True):
+            with tempfile.TemporaryDirectory() as folder:
+                db_path = Path(folder) / 'bench.db'
+                build_synthetic_db(db_path, args.start_year, args.end_year)
+                db = Database(db_path)
+                db.ensure_week(f"{args.end_year + 1}-01")
+                if counted:
+                    timings = instrumentation.enable(slow_ms=float('inf'))
+                    submit(db)
+                    instrumentation.disable()
+                    results.append(sum(timing.count for timing in timings.statements.values()))
+                else:
+                    results.append(time_call(lambda: submit(db), repeat=1))
+                db.close()
+        elapsed, queries = results
+        print(f"{name:<20}{queries:>7} statements{elapsed:>12.1f} ms")
+
+@benchmark
+def rolling_averages(args) -> None:
+    """
+    Compares the 4 and 52 week rolling averages of every person computed with
+    one aggregate query per person and window against one team query with
+    running sums, over --persons people from start_year to end_year.
+    """
+    windows = (4, 52)
+    end_week = f"{args.end_year - 1}-50"
+    # The office is location 1 in the synthetic database
+    # noinspection SqlNoDataSourceInspection
+    per_window_sql = """
+        SELECT AVG(office_count) FROM (
+            SELECT COUNT(CASE WHEN wd.location_id = 1 THEN 1 ELSE NULL END) AS office_count
+            FROM Week AS w LEFT OUTER JOIN WorkDay AS wd
+                ON wd.week_id = w.week_id AND wd.person_id = ?
+            WHERE w.week_id <= ?
+            GROUP BY w.week_id
+            ORDER BY w.week_id DESC
+            LIMIT ?)
+        """
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        start = time.perf_counter()
+        row_count = build_synthetic_db(db_path, args.start_year, args.end_year, persons=args.persons)
+        print(f"{row_count} work days for {args.persons} people built in {time.perf_counter() - start:.1f}s")
+
+        db = Database(db_path)
+        person_ids = [person_id for person_id, _ in db.get_persons()]
+
+        def per_window() -> None:
+            for person_id in person_ids:
+                for window in windows:
+                    db.con.execute(per_window_sql, (person_id, work_calendar.week_id(end_week), window)).fetchone()
+
+        def one_pass() -> None:
+            db._analytics_cache.clear()
+            db.get_team_rolling_averages(end_week, windows)
+
+        print(f"query per person and window {time_call(per_window, repeat=1):10.1f} ms")
+        print(f"one team query, running sums {time_call(one_pass, args.repeat):9.1f} ms")
+        print(f"cached, same data version    {time_call(lambda: db.get_team_rolling_averages(end_week, windows), args.repeat):9.3f} ms")
+        db.close()
+
+# The text schema used before dates, weeks and locations were integer encoded
+# noinspection SqlNoDataSourceInspection
+TEXT_SCHEMA = """
+    CREATE TABLE Week (
+        week_number TEXT NOT NULL PRIMARY KEY,
+        week_start TEXT NOT NULL,
+        week_end TEXT NOT NULL
+    );
+    CREATE TABLE Location (location TEXT NOT NULL PRIMARY KEY);
+    CREATE TABLE Person (person_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+    CREATE TABLE WorkDay (
+        person_id INTEGER NOT NULL DEFAULT 1,
+        work_date TEXT NOT NULL,
+        week_number TEXT NOT NULL,
+        location TEXT NOT NULL,
+        PRIMARY KEY (person_id, work_date)
+    );
+    CREATE INDEX WorkDay_person_week_location ON WorkDay (person_id, week_number, location);
+    CREATE TABLE WeekSummary (
+        person_id INTEGER NOT NULL,
+        week_number TEXT NOT NULL,
+        location TEXT NOT NULL,
+        day_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (person_id, week_number, location)
+    ) WITHOUT ROWID;
+    CREATE INDEX WeekSummary_week_location ON WeekSummary (week_number, location);
+    """
+
+@benchmark
+def integer_schema(args) -> None:
+    """
+    Measures the file size and query times of a database with the text
+    schema, then migrates it in place to the integer encoded schema with
+    db_setup.ensure_schema() and measures it again.
+    """
+    year = args.end_year - 1
+    # noinspection SqlNoDataSourceInspection
+    text_queries = {
+        'weekly summary': (
+            """
+            SELECT w.week_number, w.week_start, w.week_end, COALESCE(ws.day_count, 0)
+            FROM Week AS w LEFT OUTER JOIN WeekSummary AS ws
+                ON ws.person_id = 1 AND ws.week_number = w.week_number AND ws.location = 'office'
+            WHERE w.week_number BETWEEN ? AND ?
+            ORDER BY w.week_number
+            """, (f"{year}-01", f"{year}-52")),
+        'days page': (
+            """
+            SELECT work_date, location FROM WorkDay
+            WHERE person_id = 1 AND work_date < ?
+            ORDER BY work_date DESC LIMIT 15
+            """, (f"{year}-06-01",)),
+        'week count, no rollup': (
+            """
+            SELECT COUNT(*) FROM WorkDay
+            WHERE week_number = ? AND location = 'office'
+            """, (f"{year}-30",)),
+        'rollup rebuild': (
+            """
+            SELECT person_id, week_number, location, COUNT(*) FROM WorkDay
+            GROUP BY person_id, week_number, location
+            """, ()),
+    }
+    # The office is location 1 after the migration
+    # noinspection SqlNoDataSourceInspection
+    integer_queries = {
+        'weekly summary': (
+            """
+            SELECT w.week_number, date(w.week_start), date(w.week_end), COALESCE(ws.day_count, 0)
+            FROM Week AS w LEFT OUTER JOIN WeekSummary AS ws
+                ON ws.person_id = 1 AND ws.week_id = w.week_id AND ws.location_id = 1
+            WHERE w.week_id BETWEEN ? AND ?
+            ORDER BY w.week_id
+            """, (year * 100 + 1, year * 100 + 52)),
+        'days page': (
+            """
+            SELECT date(wd.day), l.name FROM WorkDay AS wd
+                JOIN Location AS l ON l.location_id = wd.location_id
+            WHERE wd.person_id = 1 AND wd.day < ?
+            ORDER BY wd.day DESC LIMIT 15
+            """, (work_calendar.day_number(f"{year}-06-01"),)),
+        'week count, no rollup': (
+            """
+            SELECT COUNT(*) FROM WorkDay
+            WHERE week_id = ? AND location_id = 1
+            """, (year * 100 + 30,)),
+        'rollup rebuild': (
+            """
+            SELECT person_id, week_id, location_id, COUNT(*) FROM WorkDay
+            GROUP BY person_id, week_id, location_id
+            """, ()),
+    }
+
+    def measure(con: sqlite3.Connection, queries: dict) -> dict:
+        con.execute('VACUUM')
+        page_count = con.execute('PRAGMA page_count').fetchone()[0]
+        page_size = con.execute('PRAGMA page_size').fetchone()[0]
+        results = {'file size (MB)': page_count * page_size / 2 ** 20}
+        for name, (sql, params) in queries.items():
+            repeat = max(1, args.repeat // 10) if name == 'rollup rebuild' else args.repeat
+            results[f"{name} (ms)"] = time_call(lambda: con.execute(sql, params).fetchall(), repeat)
+        return results
+
+    rng = random.Random(1)
+    days = []
+    working_date = date.fromisocalendar(args.start_year, 1, 1)
+    while working_date.isocalendar().year < args.end_year:
+        if working_date.weekday() < 5:
+            days.append((working_date.isoformat(), work_calendar.week_number(working_date)))
+        working_date += timedelta(days=1)
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        con = sqlite3.connect(str(db_path))
+        con.executescript(TEXT_SCHEMA)
+        with con:
+            # noinspection SqlNoDataSourceInspection
+            con.executemany("INSERT INTO Week VALUES (?, ?, ?)",
+                            work_calendar.week_rows(args.start_year, args.end_year + 1))
+            # noinspection SqlNoDataSourceInspection
+            con.executemany("INSERT INTO Location VALUES (?)", [('office',), ('remote',)])
+            # noinspection SqlNoDataSourceInspection
+            con.executemany("INSERT INTO Person VALUES (?, ?)",
+                            [(person_id, f"person {person_id}") for person_id in range(1, args.persons + 1)])
+            for person_id in range(1, args.persons + 1):
+                # noinspection SqlNoDataSourceInspection
+                con.executemany("INSERT INTO WorkDay VALUES (?, ?, ?, ?)",
+                                [(person_id, work_date, week_number, rng.choice(('office', 'remote')))
+                                 for work_date, week_number in days])
+            # noinspection SqlNoDataSourceInspection
+            con.execute(
+                """
+                INSERT INTO WeekSummary
+                SELECT person_id, week_number, location, COUNT(*) FROM WorkDay
+                GROUP BY person_id, week_number, location
+                """)
+        before = measure(con, text_queries)
+
+        start = time.perf_counter()
+        db_setup.ensure_schema(con)
+        migrate_seconds = time.perf_counter() - start
+        after = measure(con, integer_queries)
+        con.close()
+
+    print(f"{len(days) * args.persons} work days for {args.persons} people, "
+          f"migrated in {migrate_seconds:.2f}s")
+    print(f"{'':<28}{'text':>10}{'integer':>10}")
+    for name in before:
+        print(f"{name:<28}{before[name]:>10.3f}{after[name]:>10.3f}")
+
+@benchmark
+def columnar_store(args) -> None:
+    """
+    Compares the memory held by WorkDay loaded as a list of tuples and as the
+    ColumnarStore arrays, and the latency of the analytics queries on the SQL
+    backend and the columnar backend, for --persons people.
+    """
+    year = args.end_year - 1
+    end_week = f"{year}-50"
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        row_count = build_synthetic_db(db_path, args.start_year, args.end_year, persons=args.persons)
+        db = Database(db_path)
+        store = ColumnarStore(db)
+
+        tracemalloc.start()
+        # noinspection SqlNoDataSourceInspection
+        rows = db._fetchall("SELECT person_id, work_date, week_number, location FROM WorkDayText")
+        tuple_bytes = tracemalloc.get_traced_memory()[0]
+        del rows
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        store._load()
+        array_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        store._loaded_version = None
+        start = time.perf_counter()
+        store._load()
+        load_seconds = time.perf_counter() - start
+
+        print(f"{row_count} work days for {args.persons} people, "
+              f"columnar load {load_seconds:.2f}s")
+        print(f"{'memory':<22}{'tuples (MB)':>14}{'arrays (MB)':>14}")
+        print(f"{'WorkDay':<22}{tuple_bytes / 2 ** 20:>14.1f}{array_bytes / 2 ** 20:>14.1f}")
+
+        queries = {
+            'get_weekly_summary': lambda backend: backend.get_weekly_summary(f"{year}-01", f"{year}-52"),
+            'get_ytd_average': lambda backend: backend.get_ytd_average(year, end_week),
+            'get_weekly_count': lambda backend: backend.get_weekly_count(f"{year}-30"),
+            'get_rolling_averages': lambda backend: backend.get_rolling_averages(end_week, (4, 52)),
+        }
+        print(f"{'query':<22}{'SQL (ms)':>14}{'columnar (ms)':>14}")
+        for name, query in queries.items():
+            # Keep the per-version cache of the SQL backend out of the timing
+            sql = time_call(lambda: (db._analytics_cache.clear(), query(db)), args.repeat)
+            columnar = time_call(lambda: query(store), args.repeat)
+            print(f"{name:<22}{sql:>14.3f}{columnar:>14.3f}")
+        store.close()
+
+@benchmark
+def instrumentation_overhead(args) -> None:
+    """
+    Measures the cost of the query instrumentation: the latency of cheap
+    Database reads before enabling it, while it is enabled and after it has
+    been disabled again.
+    """
+    year = args.end_year - 1
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        build_synthetic_db(db_path, args.start_year, args.end_year)
+        db = Database(db_path)
+        queries = {
+            'get_work_day': lambda: db.get_work_day(f"{year}-03-04"),
+            'get_weekly_count': lambda: (db._analytics_cache.clear(), db.get_weekly_count(f"{year}-30")),
+            'get_recent_days': lambda: db.get_recent_days(15),
+        }
+        before = {name: time_call(query, args.repeat) for name, query in queries.items()}
+        instrumentation.enable(slow_ms=float('inf'))
+        enabled = {name: time_call(query, args.repeat) for name, query in queries.items()}
+        instrumentation.disable()
+        after = {name: time_call(query, args.repeat) for name, query in queries.items()}
+        db.close()
+
+    print(f"{'query (ms)':<22}{'off':>10}{'on':>10}{'off again':>12}")
+    for name in queries:
+        print(f"{name:<22}{before[name]:>10.4f}{enabled[name]:>10.4f}{after[name]:>12.4f}")
+
+@benchmark
+def backup_stepping(args) -> None:
+    """
+    Measures how long writers wait while a backup runs, copying the whole
+    database in one step against a few pages per step, on the rollback
+    journal, where the backup's read lock blocks writers. Also compares the
+    size and time of gzip and lzma backups, for --persons people.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        row_count = build_synthetic_db(db_path, args.start_year, args.end_year, persons=args.persons)
+        con = sqlite3.connect(str(db_path))
+        con.execute('PRAGMA journal_mode = delete')
+        con.close()
+        print(f"{row_count} work days for {args.persons} people, "
+              f"{db_path.stat().st_size / 2 ** 20:.1f} MB")
+
+        print(f"{'steps':<24}{'backup (s)':>11}{'writes':>8}{'max write wait (ms)':>21}")
+        for name, pages, sleep in (('one step', -1, 0), ('256 pages, 5 ms sleep', 256, 0.005)):
+            done = threading.Event()
+            waits = []
+
+            def write() -> None:
+                writer = sqlite3.connect(str(db_path), timeout=60)
+                day = 0
+                while not done.is_set():
+                    start = time.perf_counter()
+                    with writer:
+                        # noinspection SqlNoDataSourceInspection
+                        writer.execute("UPDATE Person SET name = ? WHERE person_id = 1", (f"writer {day}",))
+                    waits.append(time.perf_counter() - start)
+                    day += 1
+                    time.sleep(0.05)
+                writer.close()
+
+            thread = threading.Thread(target=write)
+            thread.start()
+            start = time.perf_counter()
+            backup.create_backup(db_path, Path(folder) / 'backups', pages_per_step=pages,
+                                 sleep=sleep, verify=False)
+            seconds = time.perf_counter() - start
+            done.set()
+            thread.join()
+            print(f"{name:<24}{seconds:>11.2f}{len(waits):>8}{max(waits) * 1000:>21.1f}")
+
+        print(f"{'compression':<24}{'backup (s)':>11}{'MB':>8}")
+        for compression in backup.COMPRESSORS:
+            start = time.perf_counter()
+            path = backup.create_backup(db_path, Path(folder) / 'backups', compression, verify=False).path
+            seconds = time.perf_counter() - start
+            print(f"{compression:<24}{seconds:>11.2f}{path.stat().st_size / 2 ** 20:>8.1f}")
+
+@benchmark
+def snapshot_reads(args) -> None:
+    """
+    Compares the report queries on the live database with the same queries
+    on an immutable snapshot, for --persons people, and reports the time and
+    size of the snapshot.
+    """
+    year = args.end_year - 1
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        row_count = build_synthetic_db(db_path, args.start_year, args.end_year, persons=args.persons)
+        # Churn, so the live file has free pages for VACUUM to drop
+        con = sqlite3.connect(str(db_path))
+        with con:
+            # noinspection SqlNoDataSourceInspection
+            con.execute("DELETE FROM WorkDay WHERE person_id % 4 = 0")
+        con.close()
+
+        start = time.perf_counter()
+        snapshot_path = snapshot.create_snapshot(db_path, Path(folder) / 'snapshots')
+        snapshot_seconds = time.perf_counter() - start
+        live = Database(db_path)
+        snap = Database(db_path, snapshot_dir=Path(folder) / 'snapshots')
+
+        print(f"{row_count} work days for {args.persons} people, snapshot in {snapshot_seconds:.2f}s, "
+              f"{db_path.stat().st_size / 2 ** 20:.1f} MB live, "
+              f"{snapshot_path.stat().st_size / 2 ** 20:.1f} MB snapshot")
+        person_ids = range(1, args.persons + 1, max(1, args.persons // 50))
+        queries = {
+            'iter_weekly_summary': lambda db: [list(db.iter_weekly_summary(f"{year}-01", f"{year}-52", person_id))
+                                               for person_id in person_ids],
+            'get_days_before': lambda db: [db.get_days_before(f"{year}-06-30", 15, person_id)
+                                           for person_id in person_ids],
+            'get_team_weekly_counts': lambda db: db.get_team_weekly_counts(f"{year}-30"),
+        }
+        print(f"{'query':<24}{'live (ms)':>12}{'snapshot (ms)':>15}")
+        for name, query in queries.items():
+            live_ms = time_call(lambda: query(live), args.repeat)
+            snap_ms = time_call(lambda: query(snap), args.repeat)
+            print(f"{name:<24}{live_ms:>12.3f}{snap_ms:>15.3f}")
+        snap.close()
+        live.close()
+
+@benchmark
+def audit_log(args) -> None:
+    """
+    Compares write latency with no log, a synchronous text log and the queued
+    audit log. Times set_location and bulk_set_locations, with a synchronous
+    text log like the old logging.basicConfig, and with the queued audit log
+    with and without the AuditLog table.
+    """
+    def synchronous(log_path: Path, db_path: Path) -> None:
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(audit.AuditFormatter(audit.LOG_FORMAT, audit.DATE_FORMAT))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+
+    def unconfigure() -> None:
+        audit.shutdown()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+            handler.close()
+        root.setLevel(logging.WARNING)
+
+    setups = {
+        'no log': lambda log_path, db_path: None,
+        'synchronous text': synchronous,
+        'queued text': lambda log_path, db_path: audit.configure(log_path),
+        'queued text + table': lambda log_path, db_path: audit.configure(log_path, db_path),
+    }
+    year = args.end_year - 1
+    start = date.fromisocalendar(year, 1, 1)
+    days = [day.isoformat() for day in (start + timedelta(days=offset) for offset in range(364))
+            if day.weekday() < 5]
+    print(f"set_location on {len(days)} days, one call each, then bulk_set_locations on all of them")
+    print(f"{'log':<22}{'median (ms)':>12}{'p99 (ms)':>10}{'bulk (ms)':>11}")
+    for name, setup in setups.items():
+        with tempfile.TemporaryDirectory() as folder:
+            db_path = Path(folder) / 'bench.db'
+            build_synthetic_db(db_path, args.start_year, args.end_year)
+            db = Database(db_path)
+            setup(Path(folder) / 'log.txt', db_path)
+            try:
+                timings = []
+                for index, work_date in enumerate(days):
+                    call_start = time.perf_counter()
+                    db.set_location(work_date, ('office', 'remote')[index % 2])
+                    timings.append(time.perf_counter() - call_start)
+                changes = [(work_date, 'office') for work_date in days]
+                bulk_ms = time_call(lambda: db.bulk_set_locations(changes), repeat=1)
+            finally:
+                unconfigure()
+                db.close()
+        print(f"{name:<22}{statistics.median(timings) * 1000:>12.3f}"
+              f"{percentile(timings, 0.99):>10.3f}{bulk_ms:>11.1f}")
+
+@benchmark
+def point_in_time(args) -> None:
+    """
+    Times get_weekly_summary_as_of and get_ytd_average_as_of as the change
+    log grows, against the live get_weekly_summary. Each stage sets 5000
+    random days to a random location, one transaction per 100 changes, and
+    the queries look back to the middle of the last stage.
+    """
+    year = args.end_year - 1
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = Path(folder) / 'bench.db'
+        build_synthetic_db(db_path, args.start_year, args.end_year)
+        db = Database(db_path)
+        work_dates = [row[0] for row in db.get_days_before(f"{args.end_year}-01-01", 100000)]
+        print(f"{len(work_dates)} work days, checkpoint every {db_setup.CHECKPOINT_INTERVAL} events")
+        print(f"{'events':>8}{'checkpoints':>13}{'live (ms)':>11}{'as of (ms)':>12}{'ytd as of (ms)':>16}")
+        for stage in range(1, 6):
+            for batch in range(50):
+                db.bulk_set_locations([(rng.choice(work_dates), rng.choice(('office', 'remote')))
+                                       for _ in range(100)])
+                if batch == 25:
+                    as_of = datetime.now()
+            # noinspection SqlNoDataSourceInspection
+            events, checkpoints = db._fetchone(
+                """
+                SELECT (SELECT COUNT(*) FROM WorkDayEvent), (SELECT COUNT(*) FROM SummaryCheckpoint)
+                """)
+            live_ms = time_call(lambda: db.get_weekly_summary(f"{year}-01", f"{year}-52"), args.repeat)
+            as_of_ms = time_call(lambda: db.get_weekly_summary_as_of(f"{year}-01", f"{year}-52", as_of),
+                                 args.repeat)
+            ytd_ms = time_call(lambda: db.get_ytd_average_as_of(year, f"{year}-52", as_of), args.repeat)
+            print(f"{events:>8}{checkpoints:>13}{live_ms:>11.3f}{as_of_ms:>12.3f}{ytd_ms:>16.3f}")
+        db.close()
+
+# Opens the app and prints the seconds until its first window is drawn. Run
+# in a folder holding Data/worklocation.db, so the real database is untouched.
+FIRST_PAINT = {
+    'daily_input': """
+import time
+start = time.perf_counter()
+import daily_input
+window = daily_input.DailyInput()
+window.update()
+print(time.perf_counter() - start)
+window.db.close()
+window.destroy()
+""",
+    'work_location': """
+import time
+start = time.perf_counter()
+import tkinter as tk
+import work_location
+root = tk.Tk()
+app = work_location.WorkLocation(root)
+root.update()
+print(time.perf_counter() - start)
+app.on_close()
+""",
+}
+
+def import_time(module: str, cwd: Path) -> tuple[float, int]:
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+    :param module: The module to import.
+    :param cwd: The folder to run in.
+    :return: The cumulative import time of the module in milliseconds, and
+    the number of modules it imported.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=cwd, capture_output=True, text=True,
+                            env={'PYTHONPATH': str(Path(__file__).resolve().parent)})
+    lines = [line for line in result.stderr.splitlines() if line.startswith('import time:')]
+    # The last line is the module itself; the lines before it are what it
+    # imported, apart from the interpreter's own startup imports
+    total = next(int(line.split('|')[1]) for line in reversed(lines)
+                 if line.split('|')[2].strip() == module)
+    return total / 1000, len(lines)
+
+def first_paint(app: str, cwd: Path) -> float:
+    """
+    Starts an app in a fresh interpreter and times it until its first window
+    is drawn.
+    :param app: A key of FIRST_PAINT.
+    :param cwd: The folder to run in.
+    :return: The time in milliseconds, or None if there is no display.
+    """
+    result = subprocess.run([sys.executable, '-c', FIRST_PAINT[app]],
+                            cwd=cwd, capture_output=True, text=True,
+                            env={'PYTHONPATH': str(Path(__file__).resolve().parent),
+                                 'DISPLAY': os.environ.get('DISPLAY', '')})
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip()) * 1000
+
+@benchmark
+def startup(args) -> None:
+    """
+    Measures the cold start of the app and the daily input widget: the
+    import time of each module, as reported by python -X importtime, and the
+    time to first paint of the window. Time to first paint needs a display.
+    """
+    repeat = min(args.repeat, 10)
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        (folder / 'Data').mkdir()
+        build_synthetic_db(folder / 'Data' / 'worklocation.db', args.start_year, args.end_year)
+
+        print(f"median of {repeat} runs")
+        print(f"{'':<16}{'import (ms)':>12}{'modules':>9}{'first paint (ms)':>18}")
+        for app in FIRST_PAINT:
+            imports = [import_time(app, folder) for _ in range(repeat)]
+            paints = [first_paint(app, folder) for _ in range(repeat)]
+            paint = "no display" if None in paints else f"{statistics.median(paints):.1f}"
+            print(f"{app:<16}{statistics.median(ms for ms, _ in imports):>12.1f}"
+                  f"{imports[0][1]:>9}{paint:>18}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a database benchmark.")
+    parser.add_argument('name', nargs='?', choices=sorted(BENCHMARKS))
+    parser.add_argument('--start-year', type=int, default=2015)
+    parser.add_argument('--end-year', type=int, default=2025)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--persons', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.name is None:
+        for name, func in sorted(BENCHMARKS.items()):
+            print(f"{name:<20}{func.__doc__.strip().splitlines()[0]}")
+        return
+    BENCHMARKS[args.name](args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+An in-memory, column-oriented copy of the WorkDay table for analytics over
+long histories. Each column is a compact array instead of a list of tuples of
+strings: the day as a date ordinal, the location as a small integer code and
+the week as an index into the Week table. The weekly counts, YTD averages and
+rolling windows are computed with tight loops over slices of those arrays.
+
+ColumnarStore has the same read method signatures as Database and passes
+every other attribute through to the Database it wraps, so it can be used in
+place of a Database. Use open_database() to pick the backend.
+"""
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from datetime import date
+from pathlib import Path
+from typing import Iterable
+from typing import Iterator
+
+import analytics
+from database import Database
+from db_setup import DEFAULT_PERSON_ID
+import work_calendar
+
+BACKENDS = ('sql', 'columnar')
+
+
+def open_database(backend: str = 'sql', file_path: Path = Path('Data/worklocation.db')):
+    """
+    Opens the database with the chosen backend for the read queries.
+    :param backend: 'sql' to run every query in SQLite, or 'columnar' to
+    answer the analytics queries from a ColumnarStore.
+    :param file_path: A path to the database file.
+    :return: A Database or a ColumnarStore. Both must be closed with close().
+    :raises ValueError: If backend is not one of BACKENDS.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    db = Database(file_path)
+    if backend == 'columnar':
+        return ColumnarStore(db)
+    return db
+
+
+class ColumnarStore:
+    """
+    Answers the analytics queries of a Database from arrays held in memory.
+    The arrays are loaded on the first query and reloaded whenever the data
+    version of the database changes, so writes made through the Database
+    are seen by the next query.
+    """
+    def __init__(self, db: Database) -> None:
+        """
+        :param db: The Database to load from. Writes and any method the store
+        does not implement go to this Database.
+        """
+        self.db = db
+        self._loaded_version = None
+        # Week table, ordered by week number
+        self.weeks = []
+        self.week_numbers = []
+        # Location names, indexed by location code
+        self.location_names = []
+        self.office_code = -1
+        # WorkDay columns, ordered by person and work date
+        self.day_ordinals = array('i')
+        self.location_codes = array('b')
+        self.week_indexes = array('i')
+        # person_id to the (start, stop) slice of that person's rows
+        self.person_slices = {}
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def _load(self) -> None:
+        """
+        Loads the Week, Location and WorkDay tables into the arrays, unless
+        they already hold the current data version.
+        """
+        version = self.db.data_version()
+        if version == self._loaded_version:
+            return
+
+        # noinspection SqlNoDataSourceInspection
+        week_rows = self.db._fetchall(
+            """
+            SELECT week_id, week_number, date(week_start), date(week_end)
+            FROM Week
+            ORDER BY week_id
+            """
+        )
+        self.weeks = [week[1:] for week in week_rows]
+        self.week_numbers = [week[1] for week in week_rows]
+        week_index = {week[0]: index for index, week in enumerate(week_rows)}
+        # noinspection SqlNoDataSourceInspection
+        locations = self.db._fetchall("SELECT location_id, name FROM Location ORDER BY location_id")
+        self.location_names = [name for _, name in locations]
+        location_code = {location_id: code for code, (location_id, _) in enumerate(locations)}
+        self.office_code = self.location_names.index('office') if 'office' in self.location_names else -1
+
+        day_ordinals = array('i')
+        location_codes = array('b')
+        week_indexes = array('i')
+        person_slices = {}
+        start = 0
+        current_person = None
+        # noinspection SqlNoDataSourceInspection
+        for person_id, day, week_id, location_id in self.db._iterate(
+                """
+                SELECT person_id, day, week_id, location_id
+                FROM WorkDay
+                ORDER BY person_id, day
+                """):
+            if person_id != current_person:
+                if current_person is not None:
+                    person_slices[current_person] = (start, len(day_ordinals))
+                current_person = person_id
+                start = len(day_ordinals)
+            day_ordinals.append(day - work_calendar.JULIAN_DAY_OFFSET)
+            location_codes.append(location_code[location_id])
+            week_indexes.append(week_index[week_id])
+        if current_person is not None:
+            person_slices[current_person] = (start, len(day_ordinals))
+
+        self.day_ordinals = day_ordinals
+        self.location_codes = location_codes
+        self.week_indexes = week_indexes
+        self.person_slices = person_slices
+        self._loaded_version = version
+
+    def _week_range(self, start_week: str, end_week: str) -> tuple[int, int]:
+        """
+        Returns the indexes of the first and last week of the Week table
+        between start_week and end_week, inclusive. The first is greater than
+        the last if there are no such weeks.
+        """
+        return bisect_left(self.week_numbers, start_week), bisect_right(self.week_numbers, end_week) - 1
+
+    def _office_counts(self, person_id: int, first: int, last: int) -> list[int]:
+        """
+        Counts the office days of a person in each week from index first to
+        index last, inclusive.
+        :return: List of counts, one per week, oldest first.
+        """
+        counts = [0] * max(0, last - first + 1)
+        if not counts or person_id not in self.person_slices:
+            return counts
+        lo, hi = self.person_slices[person_id]
+        # A person's rows are ordered by date, so their week indexes are too
+        start = bisect_left(self.week_indexes, first, lo, hi)
+        stop = bisect_right(self.week_indexes, last, start, hi)
+        office = self.office_code
+        for week, location in zip(self.week_indexes[start:stop], self.location_codes[start:stop]):
+            if location == office:
+                counts[week - first] += 1
+        return counts
+
+    def get_weekly_summary(self, start_week: str, end_week: str,
+                           person_id: int = DEFAULT_PERSON_ID) -> list[tuple]:
+        """
+        See Database.get_weekly_summary.
+        :return: List of tuples of the form (week number, week start date,
+        week end date, office count)
+        """
+        return list(self.iter_weekly_summary(start_week, end_week, person_id))
+
+    def iter_weekly_summary(self, start_week: str, end_week: str,
+                            person_id: int = DEFAULT_PERSON_ID) -> Iterator[tuple]:
+        """
+        See Database.iter_weekly_summary.
+        :return: Iterator of tuples of the form (week number, week start date,
+        week end date, office count)
+        """
+        self._load()
+        first, last = self._week_range(start_week, end_week)
+        counts = self._office_counts(person_id, first, last)
+        return (week + (count,) for week, count in zip(self.weeks[first:last + 1], counts))
+
+    def get_weekly_count(self, week_number: str,
+                         person_id: int = DEFAULT_PERSON_ID) -> int:
+        """
+        See Database.get_weekly_count.
+        :return: The count of office days for the given week
+        """
+        self._load()
+        first, last = self._week_range(week_number, week_number)
+        counts = self._office_counts(person_id, first, last)
+        return counts[0] if counts else 0
+
+    def get_ytd_average(self, year: int, end_week: str,
+                        person_id: int = DEFAULT_PERSON_ID) -> float:
+        """
+        See Database.get_ytd_average.
+        :return: The weekly average for the given year, or None if there are
+        no weeks between the start of the year and end_week.
+        """
+        self._load()
+        first, last = self._week_range(work_calendar.first_week(year), end_week)
+        counts = self._office_counts(person_id, first, last)
+        return sum(counts) / len(counts) if counts else None
+
+    def get_rolling_averages(self, end_week: str, windows: Iterable[int] = (4, 52),
+                             person_id: int = DEFAULT_PERSON_ID) -> dict[int, float]:
+        """
+        See Database.get_rolling_averages.
+        :return: Dict of window size to average.
+        """
+        windows = tuple(sorted(set(windows)))
+        self._load()
+        last = bisect_right(self.week_numbers, end_week) - 1
+        counts = self._office_counts(person_id, max(0, last - windows[-1] + 1), last)
+        return analytics.rolling_averages(counts[::-1], windows)
+
+    def get_recent_days(self, num_of_days: int = 15,
+                        person_id: int = DEFAULT_PERSON_ID) -> list[tuple[str, str]]:
+        """
+        See Database.get_recent_days.
+        :return: A list of tuples, where tuple is of the form (work_date, location).
+        """
+        self._load()
+        if person_id not in self.person_slices:
+            return []
+        lo, hi = self.person_slices[person_id]
+        start = max(lo, hi - num_of_days)
+        return [(date.fromordinal(ordinal).isoformat(), self.location_names[code])
+                for ordinal, code in zip(self.day_ordinals[start:hi][::-1], self.location_codes[start:hi][::-1])]
+
+    def memory_size(self) -> int:
+        """
+        Returns the number of bytes held by the WorkDay column arrays.
+        """
+        return sum(column.itemsize * len(column)
+                   for column in (self.day_ordinals, self.location_codes, self.week_indexes))
+
+    def close(self) -> None:
+        """
+        Drops the arrays and closes the Database.
+        """
+        self._loaded_version = None
+        self.day_ordinals = array('i')
+        self.location_codes = array('b')
+        self.week_indexes = array('i')
+        self.person_slices = {}
+        self.db.close()
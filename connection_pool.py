@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+from typing import NamedTuple
+
+
+class OpenProfile(NamedTuple):
+    """
+    The PRAGMA settings applied to a connection when it is opened. WAL lets
+    readers and the writer work at the same time, so the daily widget and the
+    main app no longer wait on each other's locks. WAL does not work on
+    network file systems; use journal_mode='delete' for a database stored on
+    a network share.
+    """
+    journal_mode: str = 'wal'
+    synchronous: str = 'normal'
+    cache_size: int = -8000
+    mmap_size: int = 0
+    busy_timeout: int = 5000
+    query_only: bool = False
+
+    def apply(self, con: sqlite3.Connection) -> None:
+        """
+        Applies the profile to an open connection.
+        :param con: The connection to configure.
+        """
+        con.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        if self.journal_mode:
+            con.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        con.execute(f'PRAGMA synchronous = {self.synchronous}')
+        con.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        con.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        if self.query_only:
+            con.execute('PRAGMA query_only = ON')
+
+
+# The writer sets the journal mode, which is stored in the database file. With
+# WAL, synchronous=normal is safe against corruption and only risks the last
+# commits on power loss. Readers leave the journal mode alone and get a larger
+# cache and memory-mapped reads.
+WRITER_PROFILE = OpenProfile()
+READER_PROFILE = OpenProfile(journal_mode='', cache_size=-16000, mmap_size=64 * 1024 * 1024)
+# For a process that only reads, such as a report worker: the writer
+# connection is query only too, and the journal mode is left alone
+READ_ONLY_PROFILE = READER_PROFILE._replace(query_only=True)
+
+
+class ConnectionPool:
+    """
+    Share the connections to one database file. A pool holds a single writer
+    connection and a small set of reader connections that are reused instead
+    of reconnecting for every query. sqlite3 connections can only be used by
+    the thread that created them, so pools are per thread; use get_pool() to
+    find the pool for the current thread.
+    """
+    def __init__(self, file_path: Path, max_readers: int = 4,
+                 writer_profile: OpenProfile = WRITER_PROFILE,
+                 reader_profile: OpenProfile = READER_PROFILE,
+                 immutable: bool = False) -> None:
+        """
+        Creates an empty pool. Connections are opened the first time they are
+        needed.
+        :param file_path: Path to the database file.
+        :param max_readers: The most idle reader connections kept open.
+        :param writer_profile: PRAGMA settings for the writer connection.
+        :param reader_profile: PRAGMA settings for the reader connections.
+        :param immutable: The file is a snapshot that never changes (see
+        snapshot.py). The pool has no writer, and readers are opened with
+        mode=ro&immutable=1, so SQLite does no locking at all.
+        """
+        self.file_path = Path(file_path)
+        self.max_readers = max_readers
+        self.immutable = immutable
+        self.writer_profile = writer_profile
+        self.reader_profile = reader_profile
+        self.users = 0
+        # Bumped by Database after each write, see Database.data_version()
+        self.write_version = 0
+        self._writer = None
+        self._idle_readers = []
+
+    def writer(self) -> sqlite3.Connection:
+        """
+        Gets the writer connection, opening it if needed.
+        :return: The pool's single writer connection.
+        """
+        if self.immutable:
+            raise sqlite3.OperationalError(f"{self.file_path} is an immutable snapshot")
+        if self._writer is None:
+            con = sqlite3.connect(str(self.file_path))
+            self.writer_profile.apply(con)
+            con.execute('PRAGMA foreign_keys = ON')
+            self._writer = con
+        return self._writer
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        """
+        Gets an idle reader connection, or opens a new one. Reader connections
+        are query only. Return the connection with release_reader().
+        :return: A reader connection.
+        """
+        if self._idle_readers:
+            return self._idle_readers.pop()
+        if self.immutable:
+            con = sqlite3.connect(f"{self.file_path.resolve().as_uri()}?mode=ro&immutable=1", uri=True)
+        else:
+            self.writer()
+            con = sqlite3.connect(str(self.file_path))
+        self.reader_profile.apply(con)
+        con.execute('PRAGMA query_only = ON')
+        return con
+
+    def release_reader(self, con: sqlite3.Connection) -> None:
+        """
+        Returns a reader connection to the pool. The connection is closed if
+        the pool already holds max_readers idle connections.
+        :param con: A connection from acquire_reader().
+        """
+        is_open = self.users > 0 if self.immutable else self._writer is not None
+        if is_open and len(self._idle_readers) < self.max_readers:
+            self._idle_readers.append(con)
+        else:
+            con.close()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Context manager that acquires a reader connection and releases it
+        when the block exits.
+        """
+        con = self.acquire_reader()
+        try:
+            yield con
+        finally:
+            self.release_reader(con)
+
+    def attach(self) -> None:
+        """
+        Registers a user of the pool, such as a Database instance.
+        """
+        self.users += 1
+
+    def detach(self) -> None:
+        """
+        Unregisters a user of the pool. The pool is closed when its last user
+        detaches.
+        """
+        self.users -= 1
+        if self.users <= 0:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Closes every connection in the pool and removes it from the registry
+        used by get_pool().
+        """
+        for con in self._idle_readers:
+            con.close()
+        self._idle_readers.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self.users = 0
+        for key, pool in list(_pools.items()):
+            if pool is self:
+                del _pools[key]
+
+
+_pools: dict[tuple[Path, int], ConnectionPool] = {}
+
+
+def get_pool(file_path: Path,
+             writer_profile: OpenProfile = WRITER_PROFILE,
+             reader_profile: OpenProfile = READER_PROFILE) -> ConnectionPool:
+    """
+    Gets the shared pool for a database file on the current thread, creating
+    it if needed.
+    :param file_path: Path to the database file.
+    :param writer_profile: PRAGMA settings for the writer connection. Only
+    used when the pool is created.
+    :param reader_profile: PRAGMA settings for the reader connections. Only
+    used when the pool is created.
+    :return: The shared ConnectionPool.
+    """
+    key = (Path(file_path).resolve(), threading.get_ident())
+    if key not in _pools:
+        _pools[key] = ConnectionPool(file_path, writer_profile=writer_profile,
+                                     reader_profile=reader_profile)
+    return _pools[key]
+
+
+def close_all() -> None:
+    """
+    Closes every pool on the current thread. Call when the application exits.
+    """
+    thread_id = threading.get_ident()
+    for (_, pool_thread), pool in list(_pools.items()):
+        if pool_thread == thread_id:
+            pool.close()
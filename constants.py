@@ -1,4 +1,14 @@
 title_size = 20
 label_size = 16
 treeview_size = 12
-text_size = 14
\ No newline at end of file
+text_size = 14
+
+# Target weekly in-office average shown on the dashboard
+target_average = 3.0
+
+# Backend for the dashboard queries: 'sql' or 'columnar' (see columnar_store.py)
+analytics_backend = 'sql'
+
+# Statements slower than this are logged when WORK_LOCATION_PROFILE is set
+# (see instrumentation.py), in milliseconds
+slow_query_ms = 100.0
@@ -2,9 +2,12 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from datetime import date
+from pathlib import Path
 
+import audit
 from database import Database
-import ytd_html_report
+import report_scheduler
+import work_calendar
 
 class DailyInput(tk.Tk):
     """
@@ -54,17 +57,14 @@ class DailyInput(tk.Tk):
         :param location: The work location for the current work day.
         """
         work_date = self.today.isoformat()
-        iso_year = str(self.today.isocalendar().year)
-        iso_week = self.today.isocalendar().week
-        week_number = f'{iso_year}-{iso_week:>02}'
-        if not self.db.get_work_day(work_date=work_date):
-            self.db.new_work_day(work_date=work_date,
-                                 week_number=week_number,
-                                 location=location)
-        else:
+        week_number = work_calendar.week_number(self.today)
+        if not self.db.add_work_day(work_date=work_date,
+                                    week_number=week_number,
+                                    location=location):
             messagebox.showinfo(message=f"A location for {work_date} was already recorded.")
 
-        ytd_html_report.generate_report()
+        report_scheduler.request_report()
+        report_scheduler.stop()
 
         self.db.close()
         self.destroy()
@@ -75,6 +75,7 @@ class DailyInput(tk.Tk):
 
 
 if __name__ == "__main__":
+    audit.configure(audit_db=Path('Data/worklocation.db'))
     root = DailyInput()
     root.protocol("WM_DELETE_WINDOW", root.on_close)
     root.mainloop()
\ No newline at end of file
@@ -1,177 +1,766 @@
 import logging
 import sqlite3
+from datetime import datetime
+from datetime import timezone
 from pathlib import Path
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
 
+from connection_pool import ConnectionPool
+from connection_pool import OpenProfile
+from connection_pool import READER_PROFILE
+from connection_pool import WRITER_PROFILE
+from connection_pool import get_pool
+import analytics
+import audit
+from db_setup import CHECKPOINT_INTERVAL
+from db_setup import DEFAULT_PERSON_ID
+from db_setup import ensure_schema
+from db_setup import weeks_to_add
+from snapshot import latest_snapshot
+import work_calendar
+
+# Writes log one INFO record per changed work day, see audit.py. Where they
+# go is set up by the entry points with audit.configure().
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    filename='./Data/work_location_log.txt',
-    filemode='a',
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(name)s.%(funcName)s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    )
 
 class Database:
     """
     Manage all queries to the database.
     """
-    def __init__(self, file_path: Path = Path('Data/worklocation.db')) -> None:
+    def __init__(self, file_path: Path = Path('Data/worklocation.db'),
+                 pool: ConnectionPool = None,
+                 writer_profile: OpenProfile = WRITER_PROFILE,
+                 reader_profile: OpenProfile = READER_PROFILE,
+                 snapshot_dir: Path = None) -> None:
         """
-        Creates a connection to the database. The connection should be closed
-        it is no longer needed by using the close() method.
+        Connects to the database through a connection pool, so every Database
+        for the same file on the same thread shares one writer connection and
+        a set of reader connections. The Database should be closed when it is
+        no longer needed by using the close() method; the pool's connections
+        are closed when the last Database using it is closed. An older
+        database is migrated to the current schema first; for a current one
+        the check is a single PRAGMA read.
         :param file_path: A path the database file. A default path of
         'Data/worklocation.db' is used if no parameter is passed.
+        :param pool: The connection pool to use. Defaults to the shared pool
+        for file_path.
+        :param writer_profile: PRAGMA settings for the writer connection, such
+        as the journal mode and busy timeout. Only used when the shared pool
+        is first created.
+        :param reader_profile: PRAGMA settings for the reader connections.
+        Only used when the shared pool is first created.
+        :param snapshot_dir: Route the read-only queries to the latest
+        snapshot of the database in this folder (see snapshot.py), so heavy
+        reports never wait on or block the writers. Writes still go to the
+        database, and reads do not see them until the next snapshot. Reads go
+        to the database while there is no snapshot.
         """
 
-        self.con = sqlite3.connect(str(file_path))
-        self.con.execute('PRAGMA foreign_keys = ON')
+        if pool is None:
+            pool = get_pool(file_path, writer_profile=writer_profile,
+                            reader_profile=reader_profile)
+        self.pool = pool
+        self.pool.attach()
+        self.con = self.pool.writer()
+        ensure_schema(self.con)
         self.cur = self.con.cursor()
+        self.snapshot_dir = snapshot_dir
+        self.read_pool = self.pool
+        self.refresh_snapshot()
+        self._week_range = None
+        self._week_ids = None
+        self._location_ids = None
+        self._analytics_cache = {}
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """
+        Runs a read-only query on a reader connection from the pool.
+        :param sql: The query to run.
+        :param params: The query parameters.
+        :return: All the rows of the result.
+        """
+        with self.read_pool.reader() as con:
+            return con.execute(sql, params).fetchall()
+
+    def _fetchone(self, sql: str, params: tuple = ()) -> tuple:
+        """
+        Runs a read-only query on a reader connection from the pool.
+        :param sql: The query to run.
+        :param params: The query parameters.
+        :return: The first row of the result, or None if there are no rows.
+        """
+        with self.read_pool.reader() as con:
+            return con.execute(sql, params).fetchone()
+
+    def _iterate(self, sql: str, params: tuple = ()) -> Iterator[tuple]:
+        """
+        Runs a read-only query on a reader connection from the pool and yields
+        the rows one at a time. The reader connection is held until the
+        iterator is exhausted or closed.
+        :param sql: The query to run.
+        :param params: The query parameters.
+        :return: Iterator over the rows of the result.
+        """
+        with self.read_pool.reader() as con:
+            yield from con.execute(sql, params)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """
+        Runs a statement on the writer connection.
+        :param sql: The statement to run.
+        :param params: The statement parameters.
+        :return: The writer cursor, for rowcount, lastrowid or the result rows.
+        """
+        return self.cur.execute(sql, params)
+
+    def _executemany(self, sql: str, rows: Iterable[tuple]) -> sqlite3.Cursor:
+        """
+        Runs a statement on the writer connection once for each row of
+        parameters.
+        :param sql: The statement to run.
+        :param rows: The parameters for each run.
+        :return: The writer cursor.
+        """
+        return self.cur.executemany(sql, rows)
+
+    def refresh_snapshot(self) -> Path:
+        """
+        Switches the read-only queries to the latest snapshot, if a newer one
+        has been made. Called by data_version(), so views move to a new
+        snapshot on their next refresh. Does nothing without snapshot_dir.
+        :return: The path of the snapshot being read, or None if the reads go
+        to the database.
+        """
+        if self.snapshot_dir is None:
+            return None
+        latest = latest_snapshot(self.pool.file_path, self.snapshot_dir)
+        if latest is not None and latest != self.read_pool.file_path:
+            if self.read_pool is not self.pool:
+                self.read_pool.detach()
+            self.read_pool = ConnectionPool(latest, reader_profile=self.pool.reader_profile,
+                                            immutable=True)
+            self.read_pool.attach()
+        return None if self.read_pool is self.pool else self.read_pool.file_path
+
+    def data_version(self) -> tuple:
+        """
+        Returns a value that changes whenever the data in the database may
+        have changed. It combines a counter bumped by every write made through
+        this process's connection pool with SQLite's PRAGMA data_version,
+        which changes when another connection or process commits. Views keep
+        the version they last rendered and skip refreshing while it is the
+        same. The check costs one PRAGMA and touches no tables. With
+        snapshot_dir, it also looks for a newer snapshot.
+        :return: A tuple to compare with the previously returned value.
+        """
+        version = (self.pool.write_version, self.con.execute('PRAGMA data_version').fetchone()[0])
+        if self.snapshot_dir is not None:
+            # The reads come from the snapshot, so a new snapshot is a new version
+            version += (self.refresh_snapshot(),)
+        return version
+
+    def ensure_week(self, week_number: str) -> None:
+        """
+        Makes sure the Week table covers the year of week_number. If it does
+        not, whole years of weeks are added in one transaction, from the edge
+        of the current range up to the needed year, so the table never has
+        gaps. The covered range is cached, so for a week inside it this costs
+        an integer comparison.
+        :param week_number: Week number string in the format yyyy-ww
+        :raises ValueError: If week_number is not a week of an ISO year, or
+        its year is more than MAX_WEEK_EXTENSION_YEARS years from both the
+        current year and the years already in the Week table.
+        """
+        if self._week_range is None:
+            # noinspection SqlNoDataSourceInspection
+            self._week_range = self._execute(
+                """
+                SELECT MIN(week_id), MAX(week_id)
+                FROM Week
+                """).fetchone()
+        weeks = weeks_to_add(week_number, *self._week_range)
+        if not weeks:
+            return
+
+        with self.con:
+            # noinspection SqlNoDataSourceInspection
+            self._executemany(
+                """
+                INSERT OR IGNORE INTO
+                    Week(week_id, week_number, week_start, week_end)
+                    VALUES (?, ?, ?, ?)
+                """, weeks
+            )
+        self.clear_lookup_cache()
+        self.pool.write_version += 1
+        logger.info(f"Added weeks {weeks[0][1]} to {weeks[-1][1]} to the Week table")
 
-    def get_weekly_summary(self, start_week: str, end_week: str) -> list[tuple]:
+    def get_weekly_summary(self, start_week: str, end_week: str,
+                           person_id: int = DEFAULT_PERSON_ID) -> list[tuple]:
         """
         Returns a list of tuples, where each tuple has the first date of the
         week, the last date of the week, and the number of days in the office
-        for that week.
+        for that week. See iter_weekly_summary.
         :param start_week: First week to collect data, in 'yyyy-ww' format
         :param end_week: Last week to collect data, in 'yyyy-ww' format.
-        :return: List of tuples, where each tuple has the first date of the
+        :param person_id: The person to summarize. Defaults to the single user
+        of a one-person database.
+        :return: List of tuples of the form (week number, week start date,
+        week end date, office count)
+        """
+        return list(self.iter_weekly_summary(start_week, end_week, person_id))
+
+    def iter_weekly_summary(self, start_week: str, end_week: str,
+                            person_id: int = DEFAULT_PERSON_ID) -> Iterator[tuple]:
+        """
+        Streams the weekly summary one week at a time, for reports too large
+        to hold in memory.
+        :param start_week: First week to collect data, in 'yyyy-ww' format
+        :param end_week: Last week to collect data, in 'yyyy-ww' format.
+        :param person_id: The person to summarize. Defaults to the single user
+        of a one-person database.
+        :return: Iterator of tuples, where each tuple has the first date of the
                 week, the last date of the week, and the number of days in the
                 office for that week. Each tuple is (week number, week start
-                date, week end date, office count)
+                date, week end date, office count). Rows are read from the
+                database as the iterator is consumed.
         """
 
         # noinspection SqlNoDataSourceInspection
-        res = self.cur.execute(
+        return self._iterate(
             """
             SELECT 
                 w.week_number, 
-                w.week_start, 
-                w.week_end, 
-                COUNT(
-                        CASE
-                            WHEN wd.location = 'office' THEN 1
-                            ELSE NULL	
-                        END
-                    ) as office_count
+                date(w.week_start), 
+                date(w.week_end), 
+                COALESCE(ws.day_count, 0) AS office_count
             FROM 
                 Week AS w 
-                LEFT OUTER JOIN WorkDay AS wd ON w.week_number = wd.week_number
+                LEFT OUTER JOIN WeekSummary AS ws 
+                    ON ws.person_id = ? AND
+                    ws.week_id = w.week_id AND 
+                    ws.location_id = ?
             WHERE 
-                w.week_number >= ? AND 
-                w.week_number <= ? 
-            GROUP BY w.week_number
-           """, (start_week, end_week)
+                w.week_id >= ? AND 
+                w.week_id <= ? 
+            ORDER BY w.week_id
+           """, (person_id, self._office_id(),
+                 work_calendar.week_id(start_week), work_calendar.week_id(end_week))
         )
-        weeks = res.fetchall()
-        return weeks
 
-    def get_recent_days(self, num_of_days: int = 15) -> list[tuple[str, str]]:
+    def get_recent_days(self, num_of_days: int = 15,
+                        person_id: int = DEFAULT_PERSON_ID) -> list[tuple[str, str]]:
         """
         Queries the database and returns the location data about the most
         recent work days. The number of days is determined by the num_of_days
         parameter. It defaults to 15 days, (approximately 3 weeks of data).
         Returns a list of tuples. Each tuple is of the form (work_date, location)
         :param num_of_days: The number of days to return. The default value is 15.
+        :param person_id: The person whose days are returned.
         :return: A list of tuples, where tuple is of the form (work_date, location).
         """
         # noinspection SqlNoDataSourceInspection
-        res = self.cur.execute(
+        res = self._fetchall(
             """
-            SELECT work_date, location
-            FROM WorkDay
-            ORDER BY work_date DESC
+            SELECT date(wd.day), l.name
+            FROM 
+                WorkDay AS wd
+                JOIN Location AS l ON l.location_id = wd.location_id
+            WHERE wd.person_id = ?
+            ORDER BY wd.day DESC
             Limit ?;
-            """, (num_of_days,)
+            """, (person_id, num_of_days)
         )
-        return res.fetchall()
+        return res
 
-    def set_location(self, work_date: str, new_location: str) -> None:
+    def get_days_before(self, work_date: str, num_of_days: int = 15,
+                        person_id: int = DEFAULT_PERSON_ID) -> list[tuple[str, str]]:
+        """
+        Returns a page of work days older than work_date, newest first. Used
+        with get_days_after to page through the history by key instead of by
+        offset, so every page costs the same however far back it is.
+        :param work_date: Exclusive upper bound, yyyy-mm-dd. If None, the most
+        recent days are returned, as for get_recent_days.
+        :param num_of_days: The number of days to return.
+        :param person_id: The person whose days are returned.
+        :return: A list of tuples of the form (work_date, location).
+        """
+        if work_date is None:
+            return self.get_recent_days(num_of_days, person_id)
+
+        # noinspection SqlNoDataSourceInspection
+        return self._fetchall(
+            """
+            SELECT date(wd.day), l.name
+            FROM 
+                WorkDay AS wd
+                JOIN Location AS l ON l.location_id = wd.location_id
+            WHERE wd.person_id = ? AND wd.day < ?
+            ORDER BY wd.day DESC
+            LIMIT ?
+            """, (person_id, work_calendar.day_number(work_date), num_of_days)
+        )
+
+    def get_days_after(self, work_date: str, num_of_days: int = 15,
+                       person_id: int = DEFAULT_PERSON_ID) -> list[tuple[str, str]]:
+        """
+        Returns a page of work days newer than work_date, oldest first.
+        :param work_date: Exclusive lower bound, yyyy-mm-dd.
+        :param num_of_days: The number of days to return.
+        :param person_id: The person whose days are returned.
+        :return: A list of tuples of the form (work_date, location).
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        return self._fetchall(
+            """
+            SELECT date(wd.day), l.name
+            FROM 
+                WorkDay AS wd
+                JOIN Location AS l ON l.location_id = wd.location_id
+            WHERE wd.person_id = ? AND wd.day > ?
+            ORDER BY wd.day
+            LIMIT ?
+            """, (person_id, work_calendar.day_number(work_date), num_of_days)
+        )
+
+    def get_weeks_before(self, week_number: str, num_of_weeks: int = 15,
+                         person_id: int = DEFAULT_PERSON_ID) -> list[tuple]:
+        """
+        Returns a page of the weekly summary for the weeks before week_number,
+        newest first. See get_weekly_summary for the shape of the rows.
+        :param week_number: Exclusive upper bound, in the format yyyy-ww
+        :param num_of_weeks: The number of weeks to return.
+        :param person_id: The person to summarize.
+        :return: List of tuples of the form (week number, week start date,
+        week end date, office count)
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        return self._fetchall(
+            """
+            SELECT 
+                w.week_number, 
+                date(w.week_start), 
+                date(w.week_end), 
+                COALESCE(ws.day_count, 0) AS office_count
+            FROM 
+                Week AS w 
+                LEFT OUTER JOIN WeekSummary AS ws 
+                    ON ws.person_id = ? AND
+                    ws.week_id = w.week_id AND 
+                    ws.location_id = ?
+            WHERE w.week_id < ?
+            ORDER BY w.week_id DESC
+            LIMIT ?
+            """, (person_id, self._office_id(), work_calendar.week_id(week_number), num_of_weeks)
+        )
+
+    def get_weeks_after(self, week_number: str, num_of_weeks: int = 15,
+                        person_id: int = DEFAULT_PERSON_ID) -> list[tuple]:
+        """
+        Returns a page of the weekly summary for the weeks after week_number,
+        oldest first. See get_weekly_summary for the shape of the rows.
+        :param week_number: Exclusive lower bound, in the format yyyy-ww
+        :param num_of_weeks: The number of weeks to return.
+        :param person_id: The person to summarize.
+        :return: List of tuples of the form (week number, week start date,
+        week end date, office count)
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        return self._fetchall(
+            """
+            SELECT 
+                w.week_number, 
+                date(w.week_start), 
+                date(w.week_end), 
+                COALESCE(ws.day_count, 0) AS office_count
+            FROM 
+                Week AS w 
+                LEFT OUTER JOIN WeekSummary AS ws 
+                    ON ws.person_id = ? AND
+                    ws.week_id = w.week_id AND 
+                    ws.location_id = ?
+            WHERE w.week_id > ?
+            ORDER BY w.week_id
+            LIMIT ?
+            """, (person_id, self._office_id(), work_calendar.week_id(week_number), num_of_weeks)
+        )
+
+    def set_location(self, work_date: str, new_location: str,
+                     person_id: int = DEFAULT_PERSON_ID) -> None:
         """
         Sets the location of the provided work_date. If work_date is not a date
         that is already in the database, nothing will happen.
         :param work_date: The work date that will be revised
         :param new_location: The new location to set
+        :param person_id: The person whose work day is revised.
         :raises IntegrityError: If new_location is not in the Location table
+        :raises ValueError: If work_date is not in the format yyyy-mm-dd
         """
+        day = work_calendar.day_number(work_date)
+        audited = logger.isEnabledFor(logging.INFO)
         try:
+            old_location = self._location_of(person_id, day) if audited else None
         # noinspection SqlNoDataSourceInspection
-            self.cur.execute(
+            self._execute(
                 """
                 UPDATE WorkDay
-                SET location = ?
-                WHERE work_date = ?
-                """, (new_location, work_date)
+                SET location_id = (SELECT location_id FROM Location WHERE name = ?)
+                WHERE person_id = ? AND day = ?
+                """, (new_location, person_id, day)
             )
         except (sqlite3.IntegrityError, sqlite3.DatabaseError) as err:
-            logger.error(f"{err=}. work_date={work_date} new_location={new_location}")
+            logger.error(f"{err=}. person_id={person_id} work_date={work_date} "
+                         f"new_location={new_location}")
+            self.con.rollback()
             raise
+        updated = self.cur.rowcount == 1
         self.con.commit()
-        logger.info(f"work_date={work_date} new_location={new_location}")
+        self.pool.write_version += 1
+        if not audited:
+            return
+        if updated:
+            logger.info("Set location", extra=audit.fields('set_location', person_id, work_date,
+                                                           old_location, new_location))
+        else:
+            logger.info(f"No work day to set. person_id={person_id} work_date={work_date}")
 
-    def get_work_day(self, work_date: str) -> tuple[str, str, str]:
+    def get_work_day(self, work_date: str,
+                     person_id: int = DEFAULT_PERSON_ID) -> tuple[str, str, str]:
         """
         Gets the work day information of the provided work_date
         :param work_date: ISO formatted date string, yyyy-mm-dd
+        :param person_id: The person whose work day is returned.
         :return: Returns a tuple of the WorkDay table, (work_date, week_number, location),
         if the work_date is present in the database. Otherwise, returns None.
+        :raises ValueError: If work_date is not in the format yyyy-mm-dd
         """
         # noinspection SqlNoDataSourceInspection
-        res = self.cur.execute(
+        res = self._fetchone(
             """
             SELECT 
-                work_date, 
-                week_number, 
-                location
-            FROM WorkDay
-            WHERE work_date = ?
-            """, (work_date,)
+                date(wd.day), 
+                w.week_number, 
+                l.name
+            FROM 
+                WorkDay AS wd
+                JOIN Week AS w ON w.week_id = wd.week_id
+                JOIN Location AS l ON l.location_id = wd.location_id
+            WHERE wd.person_id = ? AND wd.day = ?
+            """, (person_id, work_calendar.day_number(work_date))
         )
-        return res.fetchone()
+        return res
 
     def get_locations(self) -> list[str]:
         """
-        Gets the locations from the location table.
-        :return: List of allowed locations
+        Gets the locations from the location table. The table is read once
+        and cached, see clear_lookup_cache().
+        :return: List of allowed locations, in location_id order
         """
 
-        # noinspection SqlNoDataSourceInspection
-        res = self.cur.execute(
-            """
-            SELECT location
-            FROM Location
-            """
-        )
-        locations = []
-        for location in res.fetchall():
-            locations.append(location[0])
-        return locations
+        return list(self._cached_locations())
 
-    def new_work_day(self, work_date: str, week_number: str, location: str) -> None:
+    def new_work_day(self, work_date: str, week_number: str, location: str,
+                     person_id: int = DEFAULT_PERSON_ID) -> None:
         """
         Sets the work day information of the provided work_date
         :param work_date: A date string in the format yyyy-mm-dd
         :param week_number: Week number string in the format yyyy-ww
         :param location: Location string. Needs to match one of the existing
         locations in the Location table.
-        :raises IntegrityError: If work_date already exists or if week_number
-        or location are not in the Week or Location tables.
+        :param person_id: The person the work day belongs to.
+        :raises IntegrityError: If work_date already exists for the person or
+        if person_id, week_number or location are not in the Person, Week or
+        Location tables. The Week table is extended first if week_number is
+        in a year it does not cover yet.
+        :raises ValueError: If work_date is not in the format yyyy-mm-dd, or
+        week_number is not a valid week within reach of the Week table, see
+        ensure_week.
         """
+        day = work_calendar.day_number(work_date)
+        self.ensure_week(week_number)
         try:
         # noinspection SqlNoDataSourceInspection
-            self.cur.execute(
+            self._execute(
                 """
-                INSERT INTO WorkDay
-                VALUES (?, ?, ?)
-                """,(work_date, week_number, location)
+                INSERT INTO WorkDay (person_id, day, week_id, location_id)
+                VALUES (
+                    ?, 
+                    ?, 
+                    (SELECT week_id FROM Week WHERE week_number = ?), 
+                    (SELECT location_id FROM Location WHERE name = ?)
+                )
+                """,(person_id, day, week_number, location)
             )
         except(sqlite3.IntegrityError, sqlite3.DatabaseError) as err:
-            logger.error(f"{err=}. work_date={work_date} week_number={week_number} location={location}")
+            logger.error(f"{err=}. person_id={person_id} work_date={work_date} "
+                         f"week_number={week_number} location={location}")
+            self.con.rollback()
             raise
 
         self.con.commit()
-        logger.info(f"work_date={work_date} week_number={week_number} location={location}")
+        self.pool.write_version += 1
+        logger.info("New work day", extra=audit.fields(
+            'new_work_day', person_id, work_date, new_location=location, week_number=week_number))
+
+    def add_work_day(self, work_date: str, week_number: str, location: str,
+                     person_id: int = DEFAULT_PERSON_ID) -> bool:
+        """
+        Adds a work day unless the person already has one for work_date, in a
+        single statement. This replaces calling get_work_day before
+        new_work_day. The location and week ids come from the cached lookup
+        tables, so the insert is the only query.
+        :param work_date: A date string in the format yyyy-mm-dd
+        :param week_number: Week number string in the format yyyy-ww
+        :param location: Location string. Needs to match one of the existing
+        locations in the Location table.
+        :param person_id: The person the work day belongs to.
+        :return: True if the work day was added, False if one was already
+        recorded for work_date. The existing work day is left unchanged.
+        :raises IntegrityError: If person_id, week_number or location are not
+        in the Person, Week or Location tables.
+        :raises ValueError: If work_date is not in the format yyyy-mm-dd, or
+        week_number is not a valid week within reach of the Week table, see
+        ensure_week.
+        """
+        day = work_calendar.day_number(work_date)
+        self.ensure_week(week_number)
+        location_id = self._lookup(self._cached_locations, location)
+        week_id = self._lookup(self._cached_weeks, week_number)
+        try:
+            # noinspection SqlNoDataSourceInspection
+            self._execute(
+                """
+                INSERT INTO WorkDay (person_id, day, week_id, location_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (person_id, day) DO NOTHING
+                """, (person_id, day, week_id, location_id)
+            )
+        except (sqlite3.IntegrityError, sqlite3.DatabaseError) as err:
+            logger.error(f"{err=}. person_id={person_id} work_date={work_date} "
+                         f"week_number={week_number} location={location}")
+            self.con.rollback()
+            raise
+        created = self.cur.rowcount == 1
+        self.con.commit()
+        if not created:
+            logger.info(f"Already recorded. person_id={person_id} work_date={work_date}")
+            return False
+        self.pool.write_version += 1
+        logger.info("New work day", extra=audit.fields(
+            'add_work_day', person_id, work_date, new_location=location, week_number=week_number))
+        return True
+
+    def bulk_new_work_days(self, rows: Iterable[tuple[str, str, str]],
+                           person_id: int = DEFAULT_PERSON_ID) -> list[str]:
+        """
+        Adds many work days, with an audit record for each work day added.
+        Each row is checked against the Location and Week tables as it is
+        reached. Rejected rows are skipped; accepted rows are written in one
+        transaction. The Week table is first extended to cover the years of
+        the rows if needed, in a transaction of its own that is kept even if
+        the batch is rolled back.
+        :param rows: Tuples of the form (work_date, week_number, location),
+        as for new_work_day.
+        :param person_id: The person the work days belong to.
+        :return: A result for each row, in order: 'inserted', 'duplicate' if
+        the person already has that work_date, 'invalid date', 'unknown
+        location' or 'unknown week'. Rejected rows are not written.
+        :raises DatabaseError: If the transaction fails. No rows are written.
+        """
+        rows = list(rows)
+        for week_number in {row[1] for row in rows}:
+            try:
+                self.ensure_week(week_number)
+            except ValueError:
+                # Its rows are rejected below as 'unknown week'
+                pass
+        locations = self._cached_locations()
+        weeks = self._cached_weeks()
 
-    def get_ytd_average(self, year: int, end_week: str) -> float :
+        results = []
+        added = []
+        try:
+            with self.con:
+                for work_date, week_number, location in rows:
+                    try:
+                        day = work_calendar.day_number(work_date)
+                    except ValueError:
+                        results.append('invalid date')
+                        continue
+                    if location not in locations:
+                        results.append('unknown location')
+                        continue
+                    if week_number not in weeks:
+                        results.append('unknown week')
+                        continue
+                    # noinspection SqlNoDataSourceInspection
+                    self._execute(
+                        """
+                        INSERT OR IGNORE INTO WorkDay (person_id, day, week_id, location_id)
+                        VALUES (?, ?, ?, ?)
+                        """, (person_id, day, weeks[week_number], locations[location])
+                    )
+                    if self.cur.rowcount:
+                        results.append('inserted')
+                        added.append((work_date, week_number, location))
+                    else:
+                        results.append('duplicate')
+        except (sqlite3.IntegrityError, sqlite3.DatabaseError) as err:
+            logger.error(f"{err=}. person_id={person_id} rows={len(rows)}")
+            raise
+
+        self.pool.write_version += 1
+        for work_date, week_number, location in added:
+            logger.info("New work day", extra=audit.fields(
+                'bulk_new_work_days', person_id, work_date, new_location=location,
+                week_number=week_number))
+        logger.info(f"person_id={person_id} rows={len(rows)} {self._count_results(results)}")
+        return results
+
+    def bulk_set_locations(self, changes: Iterable[tuple[str, str]],
+                           person_id: int = DEFAULT_PERSON_ID) -> list[str]:
+        """
+        Sets the location of many work days, with an audit record for each
+        work day changed. Each change is checked against the Location table as
+        it is reached. Rejected changes are skipped; accepted changes are
+        written in one transaction.
+        :param changes: Tuples of the form (work_date, new_location).
+        :param person_id: The person whose work days are revised.
+        :return: A result for each change, in order: 'updated', 'not found' if
+        the person has no such work_date, 'invalid date' or 'unknown
+        location', as for bulk_new_work_days.
+        :raises DatabaseError: If the transaction fails. No changes are written.
+        """
+        changes = list(changes)
+        locations = self._cached_locations()
+        audited = logger.isEnabledFor(logging.INFO)
+
+        results = []
+        updated = []
+        try:
+            with self.con:
+                for work_date, new_location in changes:
+                    try:
+                        day = work_calendar.day_number(work_date)
+                    except ValueError:
+                        results.append('invalid date')
+                        continue
+                    if new_location not in locations:
+                        results.append('unknown location')
+                        continue
+                    old_location = self._location_of(person_id, day) if audited else None
+                    # noinspection SqlNoDataSourceInspection
+                    self._execute(
+                        """
+                        UPDATE WorkDay
+                        SET location_id = ?
+                        WHERE person_id = ? AND day = ?
+                        """, (locations[new_location], person_id, day)
+                    )
+                    if self.cur.rowcount:
+                        results.append('updated')
+                        updated.append((work_date, old_location, new_location))
+                    else:
+                        results.append('not found')
+        except (sqlite3.IntegrityError, sqlite3.DatabaseError) as err:
+            logger.error(f"{err=}. person_id={person_id} changes={len(changes)}")
+            raise
+
+        self.pool.write_version += 1
+        for work_date, old_location, new_location in updated:
+            logger.info("Set location", extra=audit.fields(
+                'bulk_set_locations', person_id, work_date, old_location, new_location))
+        logger.info(f"person_id={person_id} changes={len(changes)} {self._count_results(results)}")
+        return results
+
+    def _location_of(self, person_id: int, day: int) -> str:
+        """
+        Reads the current location of a work day on the writer connection, for
+        the audit record of a change to it.
+        :return: The location name, or None if there is no such work day.
+        """
+        # noinspection SqlNoDataSourceInspection
+        row = self._execute(
+            """
+            SELECT l.name
+            FROM 
+                WorkDay AS wd
+                JOIN Location AS l ON l.location_id = wd.location_id
+            WHERE wd.person_id = ? AND wd.day = ?
+            """, (person_id, day)
+        ).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _count_results(results: list[str]) -> str:
+        """
+        Summarizes bulk results for the log, e.g. "inserted=5 duplicate=1".
+        """
+        counts = {}
+        for result in results:
+            counts[result] = counts.get(result, 0) + 1
+        return " ".join(f"{result.replace(' ', '_')}={count}" for result, count in counts.items())
+
+    def clear_lookup_cache(self) -> None:
+        """
+        Drops the cached copies of the Location and Week tables, so they are
+        read again on next use. ensure_week calls this after it extends the
+        Week table. Call it after changing the Location table from outside
+        this Database, e.g. with db_setup.py.
+        """
+        self._week_range = None
+        self._week_ids = None
+        self._location_ids = None
+
+    def _lookup(self, table: Callable[[], dict], key: str):
+        """
+        Looks up key in a cached lookup table. On a miss the cache is read
+        again once, in case the table was changed by another connection.
+        :param table: _cached_locations or _cached_weeks.
+        :param key: The location name or week number.
+        :return: The id of key, or None if it is not in the table.
+        """
+        value = table().get(key)
+        if value is None:
+            self.clear_lookup_cache()
+            value = table().get(key)
+        return value
+
+    def _cached_locations(self) -> dict[str, int]:
+        """
+        Returns a dict of location name to location_id, in location_id order,
+        read from the Location table once per Database.
+        """
+        if self._location_ids is None:
+            # noinspection SqlNoDataSourceInspection
+            self._location_ids = dict(self._execute(
+                "SELECT name, location_id FROM Location ORDER BY location_id").fetchall())
+        return self._location_ids
+
+    def _office_id(self) -> int:
+        """
+        Returns the location_id of the office, or None if there is no office
+        location.
+        """
+        return self._cached_locations().get('office')
+
+    def _cached_weeks(self) -> dict[str, int]:
+        """
+        Returns a dict of week number to week_id, read from the Week table
+        once per Database and again after ensure_week extends it.
+        """
+        if self._week_ids is None:
+            # noinspection SqlNoDataSourceInspection
+            self._week_ids = dict(self._execute("SELECT week_number, week_id FROM Week").fetchall())
+        return self._week_ids
+
+    def get_ytd_average(self, year: int, end_week: str,
+                        person_id: int = DEFAULT_PERSON_ID) -> float :
         """Get the weekly average for the given year, through the current date.
         If the year is complete, the average will be for the full year.
         A week is determined to be in a given year based on the year of ISO
@@ -179,56 +768,403 @@ class Database:
         :param year: The four-digit year to calculate the average for
         :param end_week: The last week to include in the calculation, in ISO
         week format: yyyy-ww
+        :param person_id: The person to average.
         :return: The weekly average for the given year. If the year is not in
         the database, None is returned. If there is no data for the given range,
         None is returned. If the end_week is before the provided year, None is
         returned.
         """
-        start_week = str(year) + "-01"
+        start_week = work_calendar.first_week(year)
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._fetchone(
+            """
+            SELECT AVG(COALESCE(ws.day_count, 0))
+            FROM 
+                Week AS w 
+                LEFT OUTER JOIN WeekSummary AS ws 
+                    ON ws.person_id = ? AND
+                    ws.week_id = w.week_id AND 
+                    ws.location_id = ?
+            WHERE 
+                w.week_id BETWEEN ? AND ?
+           """, (person_id, self._office_id(),
+                 work_calendar.week_id(start_week), work_calendar.week_id(end_week))
+        )
+        return res[0]
+
+    def get_weekly_summary_as_of(self, start_week: str, end_week: str, as_of: datetime,
+                                 person_id: int = DEFAULT_PERSON_ID) -> list[tuple]:
+        """
+        Returns the weekly summary as it was at the time as_of, rebuilt from
+        the change log. See get_weekly_summary and db_setup.create_change_log.
+        :param start_week: First week to collect data, in 'yyyy-ww' format
+        :param end_week: Last week to collect data, in 'yyyy-ww' format.
+        :param as_of: The time to look back to. A naive datetime is local time.
+        :param person_id: The person to summarize.
+        :return: List of tuples of the form (week number, week start date,
+        week end date, office count)
+        :raises ValueError: If as_of is before the change log of the person
+        starts.
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        return self._office_counts_as_of(
+            """
+            SELECT 
+                w.week_number, 
+                date(w.week_start), 
+                date(w.week_end), 
+                COALESCE(c.day_count, 0)
+            FROM 
+                Week AS w 
+                LEFT OUTER JOIN counts AS c ON c.week_id = w.week_id
+            WHERE w.week_id BETWEEN :start_week_id AND :end_week_id
+            ORDER BY w.week_id
+            """, start_week, end_week, as_of, person_id)
+
+    def get_ytd_average_as_of(self, year: int, end_week: str, as_of: datetime,
+                              person_id: int = DEFAULT_PERSON_ID) -> float:
+        """
+        Returns the weekly average as it was at the time as_of, rebuilt from
+        the change log. See get_ytd_average and db_setup.create_change_log.
+        :param year: The four-digit year to calculate the average for
+        :param end_week: The last week to include in the calculation, in ISO
+        week format: yyyy-ww
+        :param as_of: The time to look back to. A naive datetime is local time.
+        :param person_id: The person to average.
+        :return: The weekly average, or None if there are no weeks in the range.
+        :raises ValueError: If as_of is before the change log of the person
+        starts.
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._office_counts_as_of(
+            """
+            SELECT AVG(COALESCE(c.day_count, 0))
+            FROM 
+                Week AS w 
+                LEFT OUTER JOIN counts AS c ON c.week_id = w.week_id
+            WHERE w.week_id BETWEEN :start_week_id AND :end_week_id
+            """, work_calendar.first_week(year), end_week, as_of, person_id)
+        return res[0][0]
+
+    def _office_counts_as_of(self, select: str, start_week: str, end_week: str,
+                             as_of: datetime, person_id: int) -> list[tuple]:
+        """
+        Runs select with a counts(week_id, day_count) table of the person's
+        office days per week at the time as_of. The counts are the newest
+        checkpoint taken by as_of plus the events recorded after it, up to
+        as_of; there are never more than CHECKPOINT_INTERVAL of those, however
+        long the history is.
+        :param select: The query to run on counts. It can use the parameters
+        :start_week_id and :end_week_id.
+        :return: All the rows of the result.
+        :raises ValueError: If as_of is before the change log of the person
+        starts.
+        """
+        # The change log records times in UTC, to the millisecond
+        recorded_at = as_of.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+        # noinspection SqlNoDataSourceInspection
+        seq, baseline_at = self._fetchone(
+            """
+            SELECT
+                (SELECT seq FROM SummaryCheckpoint 
+                 WHERE person_id = ? AND taken_at <= ?
+                 ORDER BY taken_at DESC, seq DESC
+                 LIMIT 1),
+                (SELECT taken_at FROM SummaryCheckpoint 
+                 WHERE person_id = ? AND seq = 0)
+            """, (person_id, recorded_at, person_id)
+        )
+        if seq is None:
+            if baseline_at is not None:
+                raise ValueError(f"The change log of person {person_id} starts at {baseline_at} UTC")
+            # The person's history is all in the change log
+            seq = 0
+
+        # noinspection SqlNoDataSourceInspection
+        return self._fetchall(
+            """
+            WITH delta (week_id, day_count) AS (
+                SELECT week_id, day_count
+                FROM CheckpointCount
+                WHERE person_id = :person_id AND seq = :seq AND location_id = :office_id
+                    AND week_id BETWEEN :start_week_id AND :end_week_id
+                UNION ALL
+                SELECT old_week_id, -1
+                FROM WorkDayEvent
+                WHERE person_id = :person_id AND seq > :seq AND seq <= :last_seq
+                    AND recorded_at <= :recorded_at AND old_location_id = :office_id
+                    AND old_week_id BETWEEN :start_week_id AND :end_week_id
+                UNION ALL
+                SELECT new_week_id, 1
+                FROM WorkDayEvent
+                WHERE person_id = :person_id AND seq > :seq AND seq <= :last_seq
+                    AND recorded_at <= :recorded_at AND new_location_id = :office_id
+                    AND new_week_id BETWEEN :start_week_id AND :end_week_id
+            ), 
+            counts (week_id, day_count) AS (
+                SELECT week_id, SUM(day_count)
+                FROM delta
+                GROUP BY week_id
+            )
+            """ + select,
+            {'person_id': person_id, 'seq': seq, 'last_seq': seq + CHECKPOINT_INTERVAL,
+             'recorded_at': recorded_at, 'office_id': self._office_id(),
+             'start_week_id': work_calendar.week_id(start_week),
+             'end_week_id': work_calendar.week_id(end_week)}
+        )
+
+    def get_rolling_averages(self, end_week: str, windows: Iterable[int] = (4, 52),
+                             person_id: int = DEFAULT_PERSON_ID) -> dict[int, float]:
+        """
+        Returns the rolling weekly office averages ending with end_week for
+        several window sizes. All the windows come from one query of the
+        longest window and one pass over it, and the result is cached until
+        the data version changes.
+        :param end_week: The last week in every window, in the format yyyy-ww
+        :param windows: Window sizes in weeks. Defaults to 4 and 52 weeks.
+        :param person_id: The person to average.
+        :return: Dict of window size to average. If the Week table has fewer
+        weeks than a window, the average is over the weeks it has. None if
+        there are no weeks up to end_week.
+        """
+        windows = tuple(sorted(set(windows)))
+        key = ('rolling_averages', end_week, windows, person_id)
+        version = self.data_version()
+        cached = self._analytics_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
 
         # noinspection SqlNoDataSourceInspection
-        res = self.cur.execute(
+        res = self._fetchall(
             """
-            SELECT AVG(office_count)
-            FROM (
-                SELECT 
-                    w.week_number,
-                    COUNT(
-                        CASE
-                            WHEN wd.location = 'office' THEN 1
-                            ELSE NULL	
-                        END
-                    ) as office_count                    
-                FROM Week as w LEFT OUTER JOIN WorkDay as wd on w.week_number = wd.week_number
-                WHERE 
-                    w.week_number BETWEEN ? AND ?
-                GROUP BY w.week_number
-            )            
-           """, (start_week, end_week)
+            SELECT COALESCE(ws.day_count, 0)
+            FROM 
+                Week AS w 
+                LEFT OUTER JOIN WeekSummary AS ws 
+                    ON ws.person_id = ? AND
+                    ws.week_id = w.week_id AND 
+                    ws.location_id = ?
+            WHERE w.week_id <= ?
+            ORDER BY w.week_id DESC
+            LIMIT ?
+            """, (person_id, self._office_id(), work_calendar.week_id(end_week), windows[-1])
         )
-        return res.fetchone()[0]
+        averages = analytics.rolling_averages([row[0] for row in res], windows)
+        self._analytics_cache[key] = (version, averages)
+        return averages
 
-    def get_weekly_count(self, week_number: str) -> int :
+    def get_team_rolling_averages(self, end_week: str,
+                                  windows: Iterable[int] = (4, 52)) -> list[tuple[int, str, dict[int, float]]]:
+        """
+        Returns the rolling weekly office averages of every person, from one
+        query over WeekSummary. See get_rolling_averages. The result is cached
+        until the data version changes.
+        :param end_week: The last week in every window, in the format yyyy-ww
+        :param windows: Window sizes in weeks. Defaults to 4 and 52 weeks.
+        :return: List of tuples of the form (person_id, name, averages),
+        ordered by person_id, where averages is a dict of window size to
+        average.
+        """
+        windows = tuple(sorted(set(windows)))
+        key = ('team_rolling_averages', end_week, windows)
+        version = self.data_version()
+        cached = self._analytics_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._fetchall(
+            """
+            WITH recent AS (
+                SELECT week_id
+                FROM Week
+                WHERE week_id <= ?
+                ORDER BY week_id DESC
+                LIMIT ?
+            )
+            SELECT 
+                p.person_id,
+                p.name,
+                COALESCE(ws.day_count, 0)
+            FROM 
+                Person AS p
+                CROSS JOIN recent AS w
+                LEFT OUTER JOIN WeekSummary AS ws
+                    ON ws.person_id = p.person_id AND
+                    ws.week_id = w.week_id AND
+                    ws.location_id = ?
+            ORDER BY p.person_id, w.week_id DESC
+            """, (work_calendar.week_id(end_week), windows[-1], self._office_id())
+        )
+        team = []
+        counts = []
+        for index, (person_id, name, count) in enumerate(res):
+            counts.append(count)
+            if index + 1 == len(res) or res[index + 1][0] != person_id:
+                team.append((person_id, name, analytics.rolling_averages(counts, windows)))
+                counts = []
+        self._analytics_cache[key] = (version, team)
+        return team
+
+    def get_weekly_count(self, week_number: str,
+                         person_id: int = DEFAULT_PERSON_ID) -> int :
         """Returns the count of office days for the provided week.
         :param week_number: The week to get the count of. The week is in the
         format yyyy-ww
+        :param person_id: The person to count.
         :return: The count of office days for the given week
         """
 
         # noinspection SqlNoDataSourceInspection
-        res = self.cur.execute(
+        res = self._fetchone(
+            """
+            SELECT COALESCE(SUM(day_count), 0)
+            FROM WeekSummary
+            WHERE 
+                person_id = ? AND
+                week_id = ? AND
+                location_id = ?
+            """, (person_id, work_calendar.week_id(week_number), self._office_id())
+        )
+        return res[0]
+
+    def add_person(self, name: str) -> int:
+        """
+        Adds a person to the Person table.
+        :param name: The name of the person. Names are unique.
+        :return: The person_id of the new person.
+        :raises IntegrityError: If a person with the same name already exists.
+        """
+        try:
+            # noinspection SqlNoDataSourceInspection
+            self._execute(
+                """
+                INSERT INTO Person (name)
+                VALUES (?)
+                """, (name,)
+            )
+        except (sqlite3.IntegrityError, sqlite3.DatabaseError) as err:
+            logger.error(f"{err=}. name={name}")
+            self.con.rollback()
+            raise
+        self.con.commit()
+        self.pool.write_version += 1
+        logger.info("Added person",
+                    extra=audit.fields('add_person', self.cur.lastrowid, name=name))
+        return self.cur.lastrowid
+
+    def get_location_history(self, work_date: str, person_id: int = DEFAULT_PERSON_ID
+                             ) -> list[tuple[str, str, str, str]]:
+        """
+        Reconstructs the history of a work day from the AuditLog table. Only
+        changes made while audit.configure() was given the database are
+        recorded, and changes still queued are not seen; call audit.flush()
+        first to include them.
+        :param work_date: ISO formatted date string, yyyy-mm-dd
+        :param person_id: The person whose work day is returned.
+        :return: List of tuples of the form (logged_at, operation,
+        old_location, new_location), oldest first. old_location is None for
+        the change that added the work day.
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._fetchall(
             """
-            SELECT COUNT(work_date)
-            FROM WorkDay
+            SELECT logged_at, operation, old_location, new_location
+            FROM AuditLog
+            WHERE person_id = ? AND work_date = ?
+            ORDER BY audit_id
+            """, (person_id, work_date)
+        )
+        return res
+
+    def get_persons(self) -> list[tuple[int, str]]:
+        """
+        Gets the people in the Person table.
+        :return: List of tuples of the form (person_id, name), ordered by
+        person_id.
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._fetchall(
+            """
+            SELECT person_id, name
+            FROM Person
+            ORDER BY person_id
+            """
+        )
+        return res
+
+    def get_team_weekly_counts(self, week_number: str) -> list[tuple[int, str, int]]:
+        """
+        Returns the count of office days for every person for the provided
+        week, in one query.
+        :param week_number: The week to count, in the format yyyy-ww
+        :return: List of tuples of the form (person_id, name, office count),
+        ordered by person_id. People with no office days have a count of 0.
+        """
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._fetchall(
+            """
+            SELECT 
+                p.person_id,
+                p.name,
+                COALESCE(ws.day_count, 0)
+            FROM 
+                Person AS p
+                LEFT OUTER JOIN WeekSummary AS ws
+                    ON ws.person_id = p.person_id AND
+                    ws.week_id = ? AND
+                    ws.location_id = ?
+            ORDER BY p.person_id
+            """, (work_calendar.week_id(week_number), self._office_id())
+        )
+        return res
+
+    def get_team_ytd_averages(self, year: int, end_week: str) -> list[tuple[int, str, float]]:
+        """
+        Returns the weekly office average of every person for the given year,
+        through end_week, in one query. See get_ytd_average for the rules of
+        the calculation.
+        :param year: The four-digit ISO year to calculate the averages for
+        :param end_week: The last week to include, in the format yyyy-ww
+        :return: List of tuples of the form (person_id, name, average), ordered
+        by person_id. The average is None if there are no weeks in the range.
+        """
+        start_week = work_calendar.first_week(year)
+
+        # noinspection SqlNoDataSourceInspection
+        res = self._fetchall(
+            """
+            SELECT 
+                p.person_id,
+                p.name,
+                AVG(COALESCE(ws.day_count, 0))
+            FROM 
+                Person AS p
+                CROSS JOIN Week AS w
+                LEFT OUTER JOIN WeekSummary AS ws
+                    ON ws.person_id = p.person_id AND
+                    ws.week_id = w.week_id AND
+                    ws.location_id = ?
             WHERE 
-                week_number = ? AND
-                location = 'office'
-            """, (week_number,)
+                w.week_id BETWEEN ? AND ?
+            GROUP BY p.person_id
+            ORDER BY p.person_id
+            """, (self._office_id(), work_calendar.week_id(start_week), work_calendar.week_id(end_week))
         )
-        return res.fetchone()[0]
+        return res
 
     def close(self) -> None:
         """
-        Closes the connection to the database.
+        Releases the connection to the database. The pooled connections are
+        closed once no other Database is using them.
         """
-        self.con.close()
+        if self.read_pool is not self.pool:
+            self.read_pool.detach()
+            self.read_pool = self.pool
+        self.pool.detach()
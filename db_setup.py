@@ -1,60 +1,846 @@
 import csv
 import sqlite3
+import sys
+import time
 from datetime import date
-from datetime import timedelta
+from pathlib import Path
+from typing import Callable
+from typing import Iterator
+from typing import NamedTuple
 
-def create_tables() -> None:
+import work_calendar
+
+DEFAULT_DB_PATH = './Data/worklocation.db'
+DEFAULT_PERSON_ID = 1
+DEFAULT_PERSON_NAME = 'default'
+# A person's week summary is checkpointed after every this many changes to
+# their work days. The triggers hold the value, so changing it needs a
+# migration.
+CHECKPOINT_INTERVAL = 500
+# The Week table is only extended to years this close to today or to the
+# years it already covers, so a mistyped year does not add centuries
+MAX_WEEK_EXTENSION_YEARS = 5
+
+def create_tables(db_path: str = DEFAULT_DB_PATH) -> None:
     """
     Creates the tables in the database. If the database file doesn't exist, it
     will be created.
+    :param db_path: Path to the database file.
     """
 
-    con = sqlite3.connect('./Data/worklocation.db')
+    con = sqlite3.connect(db_path)
     con.execute('PRAGMA foreign_keys = ON')
-    cur = con.cursor()
+    # An existing database is upgraded first, so the new tables match it
+    ensure_schema(con)
+
+    create_week_table(con)
+    create_location_table(con)
+    create_person_table(con)
+    create_work_day_table(con)
+    create_week_summary(con)
+    create_compat_views(con)
+    create_audit_table(con)
+    create_change_log(con)
+    con.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    con.commit()
+    con.close()
+
+def create_week_table(con: sqlite3.Connection, table_name: str = 'Week') -> None:
+    """
+    Creates the Week table. Weeks are keyed on an integer week id of the form
+    yyyyww and keep their yyyy-ww week number as a label. The first and last
+    day of the week are Julian day numbers.
+    :param con: An open connection to the database.
+    :param table_name: Name for the table. Only used when migrating.
+    """
 
     # noinspection SqlNoDataSourceInspection
-    cur.execute(
-        """
-         CREATE TABLE IF NOT EXISTS Week (
-            week_number TEXT NOT NULL, 
-            week_start TEXT NOT NULL, 
-            week_end TEXT NOT NULL,
-            PRIMARY KEY (week_number)
+    con.execute(
+        f"""
+         CREATE TABLE IF NOT EXISTS {table_name} (
+            week_id INTEGER PRIMARY KEY,
+            week_number TEXT NOT NULL UNIQUE, 
+            week_start INTEGER NOT NULL, 
+            week_end INTEGER NOT NULL
         );   
         """)
 
+def create_location_table(con: sqlite3.Connection, table_name: str = 'Location') -> None:
+    """
+    Creates the Location table, which gives each location name an integer id.
+    :param con: An open connection to the database.
+    :param table_name: Name for the table. Only used when migrating.
+    """
+
     # noinspection SqlNoDataSourceInspection
-    cur.execute(
-        """
-         CREATE TABLE IF NOT EXISTS Location (
-            location TEXT NOT NULL PRIMARY KEY
+    con.execute(
+        f"""
+         CREATE TABLE IF NOT EXISTS {table_name} (
+            location_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
         );   
         """)
 
+def create_person_table(con: sqlite3.Connection) -> None:
+    """
+    Creates the Person table and the default person that single-user databases
+    record their work days against.
+    :param con: An open connection to the database.
+    """
+
     # noinspection SqlNoDataSourceInspection
-    cur.execute(
+    con.execute(
         """
-         CREATE TABLE IF NOT EXISTS WorkDay (
-            work_date TEXT NOT NULL,
-            week_number TEXT NOT NULL,
-            location TEXT NOT NULL,
-            PRIMARY KEY (work_date),
-            FOREIGN KEY (week_number) REFERENCES Week (week_number),
-            FOREIGN KEY (location) REFERENCES Location (location)
+         CREATE TABLE IF NOT EXISTS Person (
+            person_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
         );   
         """)
+    # noinspection SqlNoDataSourceInspection
+    con.execute(
+        """
+        INSERT OR IGNORE INTO
+            Person(person_id, name)
+            VALUES (?, ?)
+        """, (DEFAULT_PERSON_ID, DEFAULT_PERSON_NAME)
+    )
 
-    con.close()
+def create_work_day_table(con: sqlite3.Connection, table_name: str = 'WorkDay') -> None:
+    """
+    Creates the WorkDay table, keyed on person and day, and its covering
+    index for the per-person weekly queries. Every column is an integer: the
+    day is a Julian day number and the week and location are ids in the Week
+    and Location tables. The WorkDayText view shows the same rows as text.
+    :param con: An open connection to the database.
+    :param table_name: Name for the table. Only used when migrating.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    con.execute(
+        f"""
+         CREATE TABLE IF NOT EXISTS {table_name} (
+            person_id INTEGER NOT NULL DEFAULT {DEFAULT_PERSON_ID},
+            day INTEGER NOT NULL,
+            week_id INTEGER NOT NULL,
+            location_id INTEGER NOT NULL,
+            PRIMARY KEY (person_id, day),
+            FOREIGN KEY (person_id) REFERENCES Person (person_id),
+            FOREIGN KEY (week_id) REFERENCES Week (week_id),
+            FOREIGN KEY (location_id) REFERENCES Location (location_id)
+        ) WITHOUT ROWID;   
+        """)
+    if table_name == 'WorkDay':
+        create_work_day_indexes(con)
+
+def create_work_day_indexes(con: sqlite3.Connection, table_name: str = 'WorkDay') -> None:
+    """
+    Creates the index used by the per-person weekly queries on WorkDay.
+    :param con: An open connection to the database.
+    :param table_name: The table to index. Only used when migrating; the
+    index keeps its name when the table is renamed to WorkDay.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    con.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS WorkDay_person_week_location
+        ON {table_name} (person_id, week_id, location_id)
+        """)
+
+def create_week_summary(con: sqlite3.Connection) -> None:
+    """
+    Creates the WeekSummary rollup table and the triggers that keep it in step
+    with WorkDay. WeekSummary holds the number of days per person, week and
+    location, so the weekly queries read one row per week instead of
+    aggregating WorkDay.
+    :param con: An open connection to the database.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    for statement in (
+        """
+        CREATE TABLE IF NOT EXISTS WeekSummary (
+            person_id INTEGER NOT NULL,
+            week_id INTEGER NOT NULL,
+            location_id INTEGER NOT NULL,
+            day_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (person_id, week_id, location_id),
+            FOREIGN KEY (person_id) REFERENCES Person (person_id),
+            FOREIGN KEY (week_id) REFERENCES Week (week_id),
+            FOREIGN KEY (location_id) REFERENCES Location (location_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS WeekSummary_week_location
+        ON WeekSummary (week_id, location_id)
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS WorkDay_summary_insert
+        AFTER INSERT ON WorkDay
+        BEGIN
+            INSERT INTO WeekSummary (person_id, week_id, location_id, day_count)
+            VALUES (NEW.person_id, NEW.week_id, NEW.location_id, 1)
+            ON CONFLICT (person_id, week_id, location_id)
+            DO UPDATE SET day_count = day_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS WorkDay_summary_delete
+        AFTER DELETE ON WorkDay
+        BEGIN
+            UPDATE WeekSummary
+            SET day_count = day_count - 1
+            WHERE person_id = OLD.person_id
+                AND week_id = OLD.week_id
+                AND location_id = OLD.location_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS WorkDay_summary_update
+        AFTER UPDATE OF person_id, week_id, location_id ON WorkDay
+        WHEN OLD.person_id IS NOT NEW.person_id
+            OR OLD.week_id IS NOT NEW.week_id
+            OR OLD.location_id IS NOT NEW.location_id
+        BEGIN
+            UPDATE WeekSummary
+            SET day_count = day_count - 1
+            WHERE person_id = OLD.person_id
+                AND week_id = OLD.week_id
+                AND location_id = OLD.location_id;
 
-def fill_week_table(start_year: int, end_year: int) -> None:
+            INSERT INTO WeekSummary (person_id, week_id, location_id, day_count)
+            VALUES (NEW.person_id, NEW.week_id, NEW.location_id, 1)
+            ON CONFLICT (person_id, week_id, location_id)
+            DO UPDATE SET day_count = day_count + 1;
+        END
+        """):
+        con.execute(statement)
+
+def create_compat_views(con: sqlite3.Connection) -> None:
+    """
+    Creates the WorkDayText and WeekSummaryText views, which show WorkDay and
+    WeekSummary with text dates, week numbers and location names, in the
+    shape the tables had before they were integer encoded. The views are for
+    reports and ad hoc queries; the app itself queries the tables.
+    :param con: An open connection to the database.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    for statement in (
+        """
+        CREATE VIEW IF NOT EXISTS WorkDayText AS
+        SELECT 
+            wd.person_id, 
+            date(wd.day) AS work_date, 
+            w.week_number, 
+            l.name AS location
+        FROM 
+            WorkDay AS wd
+            JOIN Week AS w ON w.week_id = wd.week_id
+            JOIN Location AS l ON l.location_id = wd.location_id
+        """,
+        """
+        CREATE VIEW IF NOT EXISTS WeekSummaryText AS
+        SELECT 
+            ws.person_id, 
+            w.week_number, 
+            l.name AS location, 
+            ws.day_count
+        FROM 
+            WeekSummary AS ws
+            JOIN Week AS w ON w.week_id = ws.week_id
+            JOIN Location AS l ON l.location_id = ws.location_id
+        """):
+        con.execute(statement)
+
+def table_columns(con: sqlite3.Connection, table_name: str) -> list[str]:
+    """
+    Gets the column names of a table.
+    :param con: An open connection to the database.
+    :param table_name: The table to inspect.
+    :return: List of column names. Empty if the table does not exist.
+    """
+
+    res = con.execute(f"PRAGMA table_info({table_name})")
+    return [column[1] for column in res.fetchall()]
+
+class Migration(NamedTuple):
+    """
+    One step in the history of the schema. PRAGMA user_version holds the
+    version of the last step applied to a database.
+    """
+    version: int
+    description: str
+    # Changes the schema. Runs in one transaction with the version bump.
+    apply: Callable[[sqlite3.Connection], None]
+    # Copies data ahead of apply, one chunk per transaction, so a large copy
+    # never holds the write lock for long. Called as backfill(con, chunk_size)
+    # until it returns 0 rows copied. It must pick up where an interrupted
+    # run stopped.
+    backfill: Callable[[sqlite3.Connection, int], int] = None
+
+def schema_version(con: sqlite3.Connection) -> int:
+    """
+    Reads the schema version of a database.
+    :param con: An open connection to the database.
+    :return: The PRAGMA user_version of the database.
+    """
+    return con.execute('PRAGMA user_version').fetchone()[0]
+
+def detect_version(con: sqlite3.Connection) -> int:
+    """
+    Works out the schema version of a database from before versions were
+    recorded, from the tables and columns it has.
+    :param con: An open connection to the database.
+    :return: The version of the last migration the database already has, or
+    None if it has not been set up with create_tables().
+    """
+    work_day_columns = table_columns(con, 'WorkDay')
+    if not work_day_columns:
+        return None
+    if 'day' not in work_day_columns:
+        return 1 if table_columns(con, 'Person') else 0
+    if 'location_id' not in table_columns(con, 'WeekSummary'):
+        return 2
+    if not table_columns(con, 'AuditLog'):
+        return 3
+    if not table_columns(con, 'WorkDayEvent'):
+        return 4
+    return 5
+
+def ensure_schema(con: sqlite3.Connection, chunk_size: int = 10000,
+                  show_progress: bool = False) -> None:
+    """
+    Brings a database up to the current schema by applying, in order, every
+    migration newer than its recorded version. Each migration and its
+    version bump commit together, so an interrupted upgrade resumes from the
+    last completed migration, and a backfill resumes from its last chunk.
+    When the database is current this costs one PRAGMA read. Does nothing to
+    a database that has not been set up with create_tables().
+    :param con: An open connection to the database.
+    :param chunk_size: Rows copied per transaction by backfills.
+    :param show_progress: Print each migration and the rows backfilled.
+    :raises DatabaseError: If the database has a newer schema than this
+    module knows about, or if a migration fails. The failed migration is
+    rolled back.
+    """
+    version = schema_version(con)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"Database schema version {version} is newer than {SCHEMA_VERSION}")
+    if version == 0:
+        version = detect_version(con)
+        if version is None:
+            return
+        if version:
+            con.commit()
+            con.execute(f'PRAGMA user_version = {version}')
+            if version == SCHEMA_VERSION:
+                return
+
+    con.commit()
+    foreign_keys = con.execute('PRAGMA foreign_keys').fetchone()[0]
+    # Migrations rebuild tables that others refer to, which foreign key
+    # checks would stop part way. They cannot be switched inside a transaction.
+    con.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            if show_progress:
+                print(f"Migration {migration.version}: {migration.description}", file=sys.stderr)
+            copied = 0
+            while migration.backfill:
+                rows = _in_transaction(con, migration, lambda: migration.backfill(con, chunk_size))
+                if not rows:
+                    break
+                copied += rows
+                if show_progress:
+                    print(f"\r{copied} rows copied", end='', file=sys.stderr, flush=True)
+            if show_progress and copied:
+                print(file=sys.stderr)
+            _in_transaction(con, migration, lambda: _apply(con, migration))
+    finally:
+        con.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+
+def _in_transaction(con: sqlite3.Connection, migration: Migration, step: Callable[[], int]) -> int:
+    """
+    Runs one step of a migration in a write transaction. The step is skipped
+    if another connection has applied the migration in the meantime.
+    :return: The result of the step, or 0 if it was skipped.
+    """
+    con.execute('BEGIN IMMEDIATE')
+    try:
+        result = step() if schema_version(con) < migration.version else 0
+    except (sqlite3.DatabaseError, ValueError):
+        con.rollback()
+        raise
+    con.commit()
+    return result
+
+def _apply(con: sqlite3.Connection, migration: Migration) -> int:
+    """
+    Applies a migration and records its version. Must be called inside a
+    transaction.
+    """
+    migration.apply(con)
+    con.execute(f'PRAGMA user_version = {migration.version}')
+    return 0
+
+def backfill_integer_tables(con: sqlite3.Connection, chunk_size: int) -> int:
+    """
+    Copies the next chunk of the text WorkDay table into WorkDay_new as
+    integers. The first call creates Week_new and Location_new, which are
+    small, in full, and moves the WorkDay index to WorkDay_new. Each call
+    continues after the last person and date already in WorkDay_new, so an
+    interrupted backfill resumes where it stopped. Rows that cannot be
+    converted fail the chunk.
+    :param con: An open connection to the database, in a transaction.
+    :param chunk_size: The number of rows to copy.
+    :return: The number of rows copied. 0 once every row has been copied.
+    """
+    work_day_columns = table_columns(con, 'WorkDay')
+    if 'work_date' not in work_day_columns:
+        return 0
+    if not table_columns(con, 'WorkDay_new'):
+        # noinspection SqlNoDataSourceInspection
+        for statement in ("DROP TABLE IF EXISTS Week_new", "DROP TABLE IF EXISTS Location_new"):
+            con.execute(statement)
+        create_week_table(con, table_name='Week_new')
+        create_location_table(con, table_name='Location_new')
+        create_work_day_table(con, table_name='WorkDay_new')
+        # Index the new table up front, so each chunk updates the index
+        # instead of the swap building it over every row at once
+        # noinspection SqlNoDataSourceInspection
+        con.execute("DROP INDEX IF EXISTS WorkDay_person_week_location")
+        create_work_day_indexes(con, table_name='WorkDay_new')
+        # noinspection SqlNoDataSourceInspection
+        con.execute(
+            """
+            INSERT INTO Week_new (week_id, week_number, week_start, week_end)
+            SELECT 
+                CAST(substr(week_number, 1, 4) AS INTEGER) * 100 + CAST(substr(week_number, 6) AS INTEGER),
+                week_number,
+                CAST(julianday(week_start) + 0.5 AS INTEGER),
+                CAST(julianday(week_end) + 0.5 AS INTEGER)
+            FROM Week
+            """)
+        # noinspection SqlNoDataSourceInspection
+        con.execute(
+            """
+            INSERT INTO Location_new (name)
+            SELECT location FROM Location ORDER BY rowid
+            """)
+
+    # noinspection SqlNoDataSourceInspection
+    last_person_id, last_date = con.execute(
+        """
+        SELECT person_id, date(day)
+        FROM WorkDay_new
+        ORDER BY person_id DESC, day DESC
+        LIMIT 1
+        """).fetchone() or (0, '')
+    if 'person_id' in work_day_columns:
+        person_id = 'wd.person_id'
+        after = "(wd.person_id, wd.work_date) > (?, ?)"
+        order = "wd.person_id, wd.work_date"
+        params = (last_person_id, last_date, chunk_size)
+    else:
+        # A WorkDay from before people were added belongs to the default
+        # person. Keyed on work_date alone, so each chunk seeks the
+        # work_date index instead of scanning and sorting the whole table.
+        person_id = str(DEFAULT_PERSON_ID)
+        after = "wd.work_date > ?"
+        order = "wd.work_date"
+        params = (last_date, chunk_size)
+    # noinspection SqlNoDataSourceInspection
+    cur = con.execute(
+        f"""
+        INSERT INTO WorkDay_new (person_id, day, week_id, location_id)
+        SELECT 
+            {person_id}, 
+            CAST(julianday(wd.work_date) + 0.5 AS INTEGER), 
+            w.week_id, 
+            l.location_id
+        FROM 
+            WorkDay AS wd
+            LEFT OUTER JOIN Week_new AS w ON w.week_number = wd.week_number
+            LEFT OUTER JOIN Location_new AS l ON l.name = wd.location
+        WHERE {after}
+        ORDER BY {order}
+        LIMIT ?
+        """, params)
+    return cur.rowcount
+
+def swap_integer_tables(con: sqlite3.Connection) -> None:
+    """
+    Replaces the text WorkDay, Week and Location tables with the integer
+    tables filled by backfill_integer_tables. The WeekSummary rollup and its
+    triggers are dropped, to be rebuilt by the next migration.
+    :param con: An open connection to the database, in a transaction, with
+    foreign keys off.
+    """
+    # noinspection SqlNoDataSourceInspection
+    for statement in (
+            "DROP VIEW IF EXISTS WorkDayText",
+            "DROP VIEW IF EXISTS WeekSummaryText",
+            "DROP TRIGGER IF EXISTS WorkDay_summary_insert",
+            "DROP TRIGGER IF EXISTS WorkDay_summary_delete",
+            "DROP TRIGGER IF EXISTS WorkDay_summary_update",
+            "DROP TABLE IF EXISTS WeekSummary",
+            "DROP TABLE WorkDay",
+            "DROP TABLE Location",
+            "DROP TABLE Week",
+            "ALTER TABLE Week_new RENAME TO Week",
+            "ALTER TABLE Location_new RENAME TO Location",
+            "ALTER TABLE WorkDay_new RENAME TO WorkDay"):
+        con.execute(statement)
+    create_work_day_indexes(con)
+
+def rebuild_summary_and_views(con: sqlite3.Connection) -> None:
+    """
+    Replaces the WeekSummary rollup and its triggers with the current ones,
+    fills it from WorkDay and creates the text views.
+    :param con: An open connection to the database, in a transaction.
+    """
+    # noinspection SqlNoDataSourceInspection
+    for statement in (
+            "DROP TRIGGER IF EXISTS WorkDay_summary_insert",
+            "DROP TRIGGER IF EXISTS WorkDay_summary_delete",
+            "DROP TRIGGER IF EXISTS WorkDay_summary_update",
+            "DROP TABLE IF EXISTS WeekSummary"):
+        con.execute(statement)
+    create_week_summary(con)
+    fill_week_summary(con)
+    create_compat_views(con)
+
+def create_audit_table(con: sqlite3.Connection) -> None:
+    """
+    Creates the AuditLog table that audit.py writes a row to for every change
+    to a work day. Dates and locations are stored as text, as they were
+    logged, so the history stays readable if a location is renamed.
+    :param con: An open connection to the database.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS AuditLog (
+            audit_id INTEGER PRIMARY KEY,
+            logged_at TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            person_id INTEGER,
+            work_date TEXT,
+            old_location TEXT,
+            new_location TEXT,
+            detail TEXT
+        );
+        """)
+    # noinspection SqlNoDataSourceInspection
+    con.execute(
+        """
+        CREATE INDEX IF NOT EXISTS AuditLog_person_date
+        ON AuditLog (person_id, work_date, audit_id);
+        """)
+
+def create_change_log(con: sqlite3.Connection) -> None:
+    """
+    Creates the append-only change log of WorkDay and its checkpoints, for
+    point-in-time queries. Triggers on WorkDay add a WorkDayEvent row, with
+    the time in UTC and the old and new week and location, for every insert,
+    delete and change of week or location. Each person's events are numbered
+    by seq. Every CHECKPOINT_INTERVAL events, a SummaryCheckpoint of that
+    person's day counts per week and location is stored in CheckpointCount,
+    built from the previous checkpoint and the events since. The state at
+    any time is a checkpoint plus at most CHECKPOINT_INTERVAL events.
+
+    People who already have work days and no events get a baseline
+    checkpoint with seq 0 from WeekSummary, so their history starts now.
+    :param con: An open connection to the database.
+    """
+    now = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    next_seq = "(SELECT COALESCE(MAX(seq), 0) + 1 FROM WorkDayEvent WHERE person_id = {}.person_id)"
+
+    # noinspection SqlNoDataSourceInspection
+    for statement in (
+        """
+        CREATE TABLE IF NOT EXISTS WorkDayEvent (
+            person_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            recorded_at TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            old_week_id INTEGER,
+            old_location_id INTEGER,
+            new_week_id INTEGER,
+            new_location_id INTEGER,
+            PRIMARY KEY (person_id, seq)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS SummaryCheckpoint (
+            person_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            taken_at TEXT NOT NULL,
+            PRIMARY KEY (person_id, seq)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS SummaryCheckpoint_taken_at
+        ON SummaryCheckpoint (person_id, taken_at)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS CheckpointCount (
+            person_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            location_id INTEGER NOT NULL,
+            week_id INTEGER NOT NULL,
+            day_count INTEGER NOT NULL,
+            PRIMARY KEY (person_id, seq, location_id, week_id)
+        ) WITHOUT ROWID
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS WorkDay_event_insert
+        AFTER INSERT ON WorkDay
+        BEGIN
+            INSERT INTO WorkDayEvent (person_id, seq, recorded_at, day, new_week_id, new_location_id)
+            VALUES (NEW.person_id, {next_seq.format('NEW')}, {now}, NEW.day, NEW.week_id, NEW.location_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS WorkDay_event_delete
+        AFTER DELETE ON WorkDay
+        BEGIN
+            INSERT INTO WorkDayEvent (person_id, seq, recorded_at, day, old_week_id, old_location_id)
+            VALUES (OLD.person_id, {next_seq.format('OLD')}, {now}, OLD.day, OLD.week_id, OLD.location_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS WorkDay_event_update
+        AFTER UPDATE OF week_id, location_id ON WorkDay
+        WHEN OLD.person_id = NEW.person_id AND (
+            OLD.week_id IS NOT NEW.week_id
+            OR OLD.location_id IS NOT NEW.location_id)
+        BEGIN
+            INSERT INTO WorkDayEvent (person_id, seq, recorded_at, day, old_week_id, old_location_id,
+                                      new_week_id, new_location_id)
+            VALUES (NEW.person_id, {next_seq.format('NEW')}, {now}, NEW.day, OLD.week_id, OLD.location_id,
+                    NEW.week_id, NEW.location_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS WorkDay_event_move
+        AFTER UPDATE OF person_id ON WorkDay
+        WHEN OLD.person_id IS NOT NEW.person_id
+        BEGIN
+            INSERT INTO WorkDayEvent (person_id, seq, recorded_at, day, old_week_id, old_location_id)
+            VALUES (OLD.person_id, {next_seq.format('OLD')}, {now}, OLD.day, OLD.week_id, OLD.location_id);
+            INSERT INTO WorkDayEvent (person_id, seq, recorded_at, day, new_week_id, new_location_id)
+            VALUES (NEW.person_id, {next_seq.format('NEW')}, {now}, NEW.day, NEW.week_id, NEW.location_id);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS WorkDayEvent_checkpoint
+        AFTER INSERT ON WorkDayEvent
+        WHEN NEW.seq % {CHECKPOINT_INTERVAL} = 0
+        BEGIN
+            INSERT INTO SummaryCheckpoint (person_id, seq, taken_at)
+            VALUES (NEW.person_id, NEW.seq, NEW.recorded_at);
+            INSERT INTO CheckpointCount (person_id, seq, location_id, week_id, day_count)
+            SELECT NEW.person_id, NEW.seq, location_id, week_id, SUM(day_count)
+            FROM (
+                SELECT location_id, week_id, day_count
+                FROM CheckpointCount
+                WHERE person_id = NEW.person_id AND seq = NEW.seq - {CHECKPOINT_INTERVAL}
+                UNION ALL
+                SELECT old_location_id, old_week_id, -1
+                FROM WorkDayEvent
+                WHERE person_id = NEW.person_id AND seq > NEW.seq - {CHECKPOINT_INTERVAL}
+                    AND old_location_id IS NOT NULL
+                UNION ALL
+                SELECT new_location_id, new_week_id, 1
+                FROM WorkDayEvent
+                WHERE person_id = NEW.person_id AND seq > NEW.seq - {CHECKPOINT_INTERVAL}
+                    AND new_location_id IS NOT NULL
+            )
+            GROUP BY location_id, week_id
+            HAVING SUM(day_count) != 0;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS WorkDayEvent_no_update
+        BEFORE UPDATE ON WorkDayEvent
+        BEGIN
+            SELECT RAISE(ABORT, 'WorkDayEvent is append-only');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS WorkDayEvent_no_delete
+        BEFORE DELETE ON WorkDayEvent
+        BEGIN
+            SELECT RAISE(ABORT, 'WorkDayEvent is append-only');
+        END
+        """,
+        f"""
+        INSERT INTO SummaryCheckpoint (person_id, seq, taken_at)
+        SELECT DISTINCT wd.person_id, 0, {now}
+        FROM WorkDay AS wd
+        WHERE NOT EXISTS (SELECT 1 FROM WorkDayEvent AS e WHERE e.person_id = wd.person_id)
+            AND NOT EXISTS (SELECT 1 FROM SummaryCheckpoint AS c WHERE c.person_id = wd.person_id)
+        """,
+        """
+        INSERT OR IGNORE INTO CheckpointCount (person_id, seq, location_id, week_id, day_count)
+        SELECT ws.person_id, 0, ws.location_id, ws.week_id, ws.day_count
+        FROM 
+            WeekSummary AS ws
+            JOIN SummaryCheckpoint AS c ON c.person_id = ws.person_id AND c.seq = 0
+        WHERE ws.day_count != 0
+            AND NOT EXISTS (SELECT 1 FROM WorkDayEvent AS e WHERE e.person_id = ws.person_id)
+        """):
+        con.execute(statement)
+
+# The schema history, oldest first. Add new migrations to the end with the
+# next version number; never change one that has been released.
+MIGRATIONS = (
+    Migration(1, "Add the Person table", create_person_table),
+    Migration(2, "Store dates, weeks and locations as integers",
+              swap_integer_tables, backfill_integer_tables),
+    Migration(3, "Rebuild the WeekSummary rollup and add the text views",
+              rebuild_summary_and_views),
+    Migration(4, "Add the AuditLog table", create_audit_table),
+    Migration(5, "Add the WorkDay change log and its checkpoints", create_change_log),
+)
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+def rebuild_week_summary(con: sqlite3.Connection) -> None:
+    """
+    Recomputes the WeekSummary table from the WorkDay table in one transaction.
+    :param con: An open connection to the database.
+    """
+
+    with con:
+        fill_week_summary(con)
+
+def fill_week_summary(con: sqlite3.Connection) -> None:
+    """
+    Replaces the contents of the WeekSummary table with a fresh aggregation
+    of WorkDay, in the caller's transaction.
+    :param con: An open connection to the database.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    con.execute("DELETE FROM WeekSummary")
+    # noinspection SqlNoDataSourceInspection
+    con.execute(
+        """
+        INSERT INTO WeekSummary (person_id, week_id, location_id, day_count)
+        SELECT person_id, week_id, location_id, COUNT(*)
+        FROM WorkDay
+        GROUP BY person_id, week_id, location_id
+        """)
+
+def verify_week_summary(con: sqlite3.Connection) -> list[tuple]:
+    """
+    Compares the WeekSummary table with a fresh aggregation of WorkDay.
+    :param con: An open connection to the database.
+    :return: List of tuples for every person, week and location that disagree.
+    Each tuple is (person_id, week_number, location, expected count, stored
+    count). An empty list means the rollup is correct.
+    """
+
+    # noinspection SqlNoDataSourceInspection
+    res = con.execute(
+        """
+        WITH actual AS (
+            SELECT person_id, week_id, location_id, COUNT(*) AS day_count
+            FROM WorkDay
+            GROUP BY person_id, week_id, location_id
+        ), 
+        mismatch AS (
+            SELECT a.person_id, a.week_id, a.location_id, a.day_count AS expected, 
+                COALESCE(ws.day_count, 0) AS stored
+            FROM actual AS a
+                LEFT OUTER JOIN WeekSummary AS ws
+                    ON ws.person_id = a.person_id
+                    AND ws.week_id = a.week_id
+                    AND ws.location_id = a.location_id
+            WHERE a.day_count IS NOT COALESCE(ws.day_count, 0)
+            UNION ALL
+            SELECT ws.person_id, ws.week_id, ws.location_id, 0, ws.day_count
+            FROM WeekSummary AS ws
+                LEFT OUTER JOIN actual AS a
+                    ON a.person_id = ws.person_id
+                    AND a.week_id = ws.week_id
+                    AND a.location_id = ws.location_id
+            WHERE a.week_id IS NULL AND ws.day_count != 0
+        )
+        SELECT m.person_id, w.week_number, l.name, m.expected, m.stored
+        FROM mismatch AS m
+            LEFT OUTER JOIN Week AS w ON w.week_id = m.week_id
+            LEFT OUTER JOIN Location AS l ON l.location_id = m.location_id
+        ORDER BY m.person_id, m.week_id, m.location_id
+        """)
+    return res.fetchall()
+
+def encode_week_rows(weeks: list[tuple[str, str, str]]) -> list[tuple[int, str, int, int]]:
+    """
+    Converts week rows from work_calendar to rows for the Week table.
+    :param weeks: List of (week_number, week_start, week_end) tuples, with
+    ISO formatted date strings.
+    :return: List of (week_id, week_number, week_start, week_end) tuples,
+    with the dates as Julian day numbers.
+    """
+    return [(work_calendar.week_id(week_number), week_number,
+             work_calendar.day_number(week_start), work_calendar.day_number(week_end))
+            for week_number, week_start, week_end in weeks]
+
+def weeks_to_add(week_number: str, first_week_id: int | None, last_week_id: int | None,
+                 today: date = None) -> list[tuple[int, str, int, int]]:
+    """
+    Returns the rows the Week table needs to cover the year of week_number.
+    Whole years are added, from the edge of the current range up to the
+    needed year, so the table never has gaps.
+    :param week_number: Week number string in the format yyyy-ww
+    :param first_week_id: The smallest week_id in the Week table, None if
+    the table is empty.
+    :param last_week_id: The largest week_id in the Week table, None if the
+    table is empty.
+    :param today: The date the extension limit is counted from. Defaults to
+    today.
+    :return: List of (week_id, week_number, week_start, week_end) tuples for
+    the Week table. Empty if the table already covers week_number.
+    :raises ValueError: If week_number is not a week of an ISO year, or its
+    year is more than MAX_WEEK_EXTENSION_YEARS years from both the current
+    year and the years already in the Week table.
+    """
+    year, number = work_calendar.parse_week(week_number)
+    week_id = year * 100 + number
+    if first_week_id is not None and first_week_id <= week_id <= last_week_id:
+        return []
+
+    this_year = work_calendar.iso_year(today or date.today())
+    first_year = this_year if first_week_id is None else min(this_year, first_week_id // 100)
+    last_year = this_year if last_week_id is None else max(this_year, last_week_id // 100)
+    if not first_year - MAX_WEEK_EXTENSION_YEARS <= year <= last_year + MAX_WEEK_EXTENSION_YEARS:
+        raise ValueError(f"Week {week_number} is more than {MAX_WEEK_EXTENSION_YEARS} years "
+                         f"from {first_year}-{last_year}, not adding it to the Week table")
+    if first_week_id is None:
+        start_year, end_year = year, year + 1
+    elif week_id > last_week_id:
+        start_year, end_year = last_week_id // 100 + 1, year + 1
+    else:
+        start_year, end_year = year, first_week_id // 100
+    return encode_week_rows(work_calendar.week_rows(start_year, end_year))
+
+def fill_week_table(start_year: int, end_year: int, db_path: str = DEFAULT_DB_PATH) -> None:
     """
     Initialize the Week table with data from the years 2023 - 2025.
     """
 
-    data = generate_week_data(start_year, end_year)
+    data = encode_week_rows(generate_week_data(start_year, end_year))
 
-    con = sqlite3.connect('./Data/worklocation.db')
+    con = sqlite3.connect(db_path)
     con.execute('PRAGMA foreign_keys = ON')
     cur = con.cursor()
 
@@ -62,8 +848,8 @@ def fill_week_table(start_year: int, end_year: int) -> None:
     cur.executemany(
         """
         INSERT OR IGNORE INTO
-            Week(week_number, week_start, week_end)
-            VALUES (?, ?, ?)
+            Week(week_id, week_number, week_start, week_end)
+            VALUES (?, ?, ?, ?)
         """, data
     )
     con.commit()
@@ -79,32 +865,18 @@ def generate_week_data(start_year: int, end_year: int) -> list:
     previous calendar year.
     :param end_year: Four digit year. The end_year is not inclusive.
     :return: List of week tuples, where each tuple is (week_number, week_start, week_end).
-    The week number is in the format yyyy-ww. The week_start and week_end are Python dates.
+    The week number is in the format yyyy-ww. The week_start and week_end are
+    ISO formatted date strings.
     """
+    return work_calendar.week_rows(start_year, end_year)
 
-    start_date = date.fromisocalendar(year=start_year, week=1, day=1)
-    working_date = start_date
-    data = []
-    while working_date.isocalendar().year < end_year:
-        iso_year = str(working_date.isocalendar().year)
-        iso_week = str(working_date.isocalendar().week)
-        iso_week = f"{iso_week:>02}"
-        week_number = f"{iso_year}-{iso_week}"
-        week_start = working_date
-        week_end = working_date + timedelta(days=6)
-        week = (week_number, week_start.isoformat(), week_end.isoformat())
-        data.append(week)
-
-        working_date += timedelta(days=7)
-    return data
-
-def fill_location_table() -> None:
+def fill_location_table(db_path: str = DEFAULT_DB_PATH) -> None:
     """
     Initialize the Location table
     """
     locations = [('office',), ('remote',)]
 
-    con = sqlite3.connect('./Data/worklocation.db')
+    con = sqlite3.connect(db_path)
     con.execute('PRAGMA foreign_keys = ON')
     cur = con.cursor()
 
@@ -112,57 +884,238 @@ def fill_location_table() -> None:
     cur.executemany(
         """
         INSERT OR IGNORE INTO 
-            Location(location) 
+            Location(name) 
             VALUES(?)
         """, locations
     )
     con.commit()
     con.close()
 
-def import_data() -> None:
+class ImportSummary(NamedTuple):
+    """Counts reported by import_data."""
+    rows_read: int
+    inserted: int
+    duplicates: int
+    rejected: int
+    seconds: float
+
+def read_location_csv(csv_path: str) -> Iterator[tuple[int, dict]]:
     """
-    Initialize the WorkDay table by importing from the data in the location.csv
-    file. It assumes the data is in the format "Year,Month,Day,Location" and
-    contains a header row.
+    Streams the rows of a location csv file one at a time.
+    :param csv_path: Path to the csv file.
+    :return: Iterator of (line number, row) tuples, where row is a dict keyed
+    on the header row.
     """
-    data = []
-    with open('Data/location.csv', "r") as f:
+    with open(csv_path, "r", newline='') as f:
         reader = csv.DictReader(f)
         for row in reader:
-            year = int(row["Year"])
-            month = int(row["Month"])
-            day = int(row["Day"])
-            work_date = date(year, month, day)
-
-            iso_year = str(work_date.isocalendar().year)
-            iso_week = str(work_date.isocalendar().week)
-            iso_week = f"{iso_week:>02}"
-            week_number = f"{iso_year}-{iso_week}"
-
-            work_date = work_date.isoformat()
-            location = row["Location"]
-            work_day = (work_date, week_number, location)
-            data.append(work_day)
-
-    con = sqlite3.connect('./Data/worklocation.db')
+            yield reader.line_num, row
+
+def import_data(db_path: str = DEFAULT_DB_PATH,
+                csv_path: str = 'Data/location.csv',
+                batch_size: int = 5000,
+                rejects_path: str = None,
+                dry_run: bool = False,
+                show_progress: bool = False) -> ImportSummary:
+    """
+    Imports work days from a csv file into the WorkDay table. It assumes the
+    data is in the format "Year,Month,Day,Location" and contains a header
+    row. An optional "Person" column holds the name of the person the day
+    belongs to; people not yet in the Person table are added. Rows without a
+    Person column belong to the default person.
+
+    The file is streamed and inserted in batches, each batch in its own
+    transaction. Week numbers come from the cached work_calendar helpers.
+    The Week table is extended to cover the year of each new week before the
+    batch holding it is inserted, see weeks_to_add. Rows with an invalid
+    date, an unknown location or a week the Week table cannot be extended
+    to are not inserted. They are written, with the reason, to the rejects
+    file. Days that are already in the database are left unchanged and
+    counted as duplicates.
+    :param db_path: Path to the database file.
+    :param csv_path: Path to the csv file to import.
+    :param batch_size: Number of rows inserted per transaction.
+    :param rejects_path: Path of the csv file for rejected rows. Defaults to
+    the csv_path with a .rejects.csv suffix. Only created if a row is rejected.
+    :param dry_run: Validate the file without writing to the database.
+    :param show_progress: Print a rows per second readout after each batch.
+    :return: An ImportSummary with the counts for the import.
+    """
+    if rejects_path is None:
+        rejects_path = str(Path(csv_path).with_suffix('.rejects.csv'))
+
+    con = sqlite3.connect(db_path, isolation_level=None)
     con.execute('PRAGMA foreign_keys = ON')
-    cur = con.cursor()
+    if not dry_run:
+        ensure_schema(con)
 
     # noinspection SqlNoDataSourceInspection
-    cur.executemany(
-        """
-        INSERT OR IGNORE INTO 
-            WorkDay(work_date, week_number, location) 
-            VALUES (?, ?, ?)
-        """, data
-    )
-    con.commit()
+    locations = dict(con.execute("SELECT name, location_id FROM Location"))
+    # noinspection SqlNoDataSourceInspection
+    weeks = dict(con.execute("SELECT week_number, week_id FROM Week"))
+    persons = {DEFAULT_PERSON_NAME: DEFAULT_PERSON_ID}
+    if table_columns(con, 'Person'):
+        # noinspection SqlNoDataSourceInspection
+        persons.update(con.execute("SELECT name, person_id FROM Person"))
+
+    rows_read = inserted = rejected = 0
+    batch = []
+    rejects_file = None
+    rejects_writer = None
+    start = time.perf_counter()
+
+    def add_weeks(week_number: str) -> bool:
+        try:
+            new_weeks = weeks_to_add(week_number, min(weeks.values(), default=None),
+                                     max(weeks.values(), default=None))
+        except ValueError:
+            return False
+        if not dry_run and new_weeks:
+            con.execute('BEGIN')
+            try:
+                # noinspection SqlNoDataSourceInspection
+                con.executemany(
+                    """
+                    INSERT OR IGNORE INTO
+                        Week(week_id, week_number, week_start, week_end)
+                        VALUES (?, ?, ?, ?)
+                    """, new_weeks
+                )
+            except sqlite3.DatabaseError:
+                con.execute('ROLLBACK')
+                raise
+            con.execute('COMMIT')
+        weeks.update((label, week_id) for week_id, label, _, _ in new_weeks)
+        return week_number in weeks
+
+    def flush() -> None:
+        nonlocal inserted
+        if not dry_run and batch:
+            con.execute('BEGIN')
+            try:
+                # noinspection SqlNoDataSourceInspection
+                cur = con.executemany(
+                    """
+                    INSERT OR IGNORE INTO 
+                        WorkDay(person_id, day, week_id, location_id) 
+                        VALUES (?, ?, ?, ?)
+                    """, batch
+                )
+            except sqlite3.DatabaseError:
+                con.execute('ROLLBACK')
+                raise
+            con.execute('COMMIT')
+            inserted += cur.rowcount
+        batch.clear()
+        if show_progress:
+            elapsed = time.perf_counter() - start
+            print(f"\r{rows_read} rows, {rows_read / max(elapsed, 1e-9):,.0f} rows/s",
+                  end='', file=sys.stderr, flush=True)
+
+    try:
+        for line_number, row in read_location_csv(csv_path):
+            rows_read += 1
+            reason = None
+            try:
+                work_date = date(int(row["Year"]), int(row["Month"]), int(row["Day"]))
+            except (KeyError, TypeError, ValueError):
+                reason = "invalid date"
+            else:
+                week_number = work_calendar.week_number(work_date)
+                location = row.get("Location")
+                if location not in locations:
+                    reason = "unknown location"
+                elif week_number not in weeks and not add_weeks(week_number):
+                    reason = "missing week"
+
+            if reason:
+                rejected += 1
+                if rejects_writer is None:
+                    rejects_file = open(rejects_path, "w", newline='')
+                    rejects_writer = csv.writer(rejects_file)
+                    rejects_writer.writerow(["Line", "Reason", *row.keys()])
+                rejects_writer.writerow([line_number, reason, *row.values()])
+                continue
+
+            name = row.get("Person") or DEFAULT_PERSON_NAME
+            if name not in persons:
+                if dry_run:
+                    persons[name] = -len(persons)
+                else:
+                    # noinspection SqlNoDataSourceInspection
+                    persons[name] = con.execute(
+                        "INSERT INTO Person (name) VALUES (?)", (name,)).lastrowid
+            batch.append((persons[name], work_calendar.day_number(work_date),
+                          weeks[week_number], locations[location]))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if rejects_file:
+            rejects_file.close()
+        con.close()
+        if show_progress:
+            print(file=sys.stderr)
+
+    duplicates = 0 if dry_run else rows_read - rejected - inserted
+    return ImportSummary(rows_read, inserted, duplicates, rejected, time.perf_counter() - start)
+
+def main() -> None:
+    """
+    Command line entry point. With no command, a new database is set up and
+    the location.csv data is imported. The import command imports a csv file
+    into an existing database. The migrate command upgrades an existing
+    database to the current schema. The rebuild-summary and verify-summary
+    commands maintain the WeekSummary rollup of an existing database.
+    """
+    # Imported here, since the app imports this module only for the schema
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Set up and maintain the work location database.")
+    parser.add_argument('command', nargs='?', default='setup',
+                        choices=['setup', 'import', 'migrate', 'rebuild-summary', 'verify-summary'])
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="Path to the database file.")
+    parser.add_argument('--csv', default='Data/location.csv', help="Path to the csv file to import.")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Rows inserted per transaction.")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Rows copied per transaction by migrations.")
+    parser.add_argument('--rejects', default=None, help="Path of the csv file for rejected rows.")
+    parser.add_argument('--dry-run', action='store_true', help="Validate the csv file without importing it.")
+    args = parser.parse_args()
+
+    if args.command in ('setup', 'import'):
+        if args.command == 'setup':
+            create_tables(args.db)
+            fill_week_table(start_year=2023, end_year=2027, db_path=args.db)
+            fill_location_table(args.db)
+        summary = import_data(args.db, csv_path=args.csv, batch_size=args.batch_size,
+                              rejects_path=args.rejects, dry_run=args.dry_run,
+                              show_progress=True)
+        print(f"{summary.rows_read} rows read, {summary.inserted} inserted, "
+              f"{summary.duplicates} duplicates, {summary.rejected} rejected "
+              f"in {summary.seconds:.2f}s")
+        return
+
+    con = sqlite3.connect(args.db)
+    con.execute('PRAGMA foreign_keys = ON')
+    if args.command == 'migrate':
+        ensure_schema(con, chunk_size=args.chunk_size, show_progress=True)
+        print(f"Schema version {schema_version(con)}.")
+        con.close()
+        return
+    if args.command == 'rebuild-summary':
+        ensure_schema(con)
+        create_week_summary(con)
+        rebuild_week_summary(con)
+        print("WeekSummary rebuilt.")
+    mismatches = verify_week_summary(con)
     con.close()
+    for person_id, week_number, location, expected, stored in mismatches:
+        print(f"person {person_id} {week_number} {location}: expected {expected}, stored {stored}")
+    if mismatches:
+        raise SystemExit(f"WeekSummary has {len(mismatches)} mismatched rows.")
+    print("WeekSummary matches WorkDay.")
 
 if __name__ == '__main__':
-    create_tables()
-    fill_week_table(start_year=2023, end_year=2027)
-    fill_location_table()
-    import_data()
+    main()
 
 
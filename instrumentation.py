@@ -0,0 +1,244 @@
+"""
+Opt-in timing of the Database layer. enable() wraps every public Database
+method and the statement helpers (_fetchall, _fetchone, _iterate, _execute
+and _executemany), so each call and each SQL statement is timed. Counts and
+latency histograms are kept in memory. Statements slower than a threshold
+are logged with their EXPLAIN QUERY PLAN. disable() puts the original
+methods back, so instrumentation costs nothing while it is off.
+
+Enable it for a run of the app by setting the WORK_LOCATION_PROFILE
+environment variable; the summary is written to the log when the app exits.
+"""
+import atexit
+import functools
+import logging
+import re
+import threading
+import time
+import types
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+STATEMENT_METHODS = ('_fetchall', '_fetchone', '_iterate', '_execute', '_executemany')
+
+
+class Timing:
+    """
+    The count, total, maximum and latency histogram of one method or
+    statement.
+    """
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, elapsed_ms: float) -> None:
+        """
+        Records one call.
+        :param elapsed_ms: The duration of the call, in milliseconds.
+        """
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for index, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimates a percentile from the histogram.
+        :param fraction: Between 0 and 1, e.g. 0.95 for the 95th percentile.
+        :return: The upper bound of the bucket holding the percentile, in
+        milliseconds, capped at the slowest call.
+        """
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+
+class Instrumentation:
+    """
+    Wraps the methods of a class to time them, and keeps the timings.
+    """
+    def __init__(self, slow_ms: float = 100.0, explain: bool = True) -> None:
+        """
+        :param slow_ms: Statements slower than this are logged, in
+        milliseconds.
+        :param explain: Log the EXPLAIN QUERY PLAN of slow statements.
+        """
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.methods = {}
+        self.statements = {}
+        self._originals = {}
+        self._lock = threading.Lock()
+
+    def install(self, cls: type) -> None:
+        """
+        Wraps the public methods and statement helpers of cls.
+        :param cls: The class to instrument, e.g. Database.
+        """
+        for name, func in list(vars(cls).items()):
+            # Static methods and properties are left alone
+            if not isinstance(func, types.FunctionType) or (name.startswith('_') and name not in STATEMENT_METHODS):
+                continue
+            self._originals[(cls, name)] = func
+            if name in STATEMENT_METHODS:
+                wrapper = self._wrap_statement(func, generator=name == '_iterate')
+            else:
+                wrapper = self._wrap_method(f"{cls.__name__}.{name}", func)
+            setattr(cls, name, wrapper)
+
+    def uninstall(self) -> None:
+        """
+        Puts back the original methods of every instrumented class.
+        """
+        for (cls, name), func in self._originals.items():
+            setattr(cls, name, func)
+        self._originals.clear()
+
+    def record(self, table: dict, key: str, elapsed_ms: float) -> None:
+        """
+        Adds a call to the timing of key in table.
+        """
+        with self._lock:
+            timing = table.get(key)
+            if timing is None:
+                timing = table[key] = Timing()
+            timing.add(elapsed_ms)
+
+    def _wrap_method(self, key: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(self.methods, key, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+    def _wrap_statement(self, func: Callable, generator: bool = False) -> Callable:
+        if generator:
+            @functools.wraps(func)
+            def wrapper(db, sql, params=()):
+                # The time of a streamed query is the time to read all its rows
+                start = time.perf_counter()
+                try:
+                    yield from func(db, sql, params)
+                finally:
+                    self._statement_done(db, sql, params, start)
+        else:
+            @functools.wraps(func)
+            def wrapper(db, sql, params=()):
+                start = time.perf_counter()
+                try:
+                    return func(db, sql, params)
+                finally:
+                    self._statement_done(db, sql, params, start)
+        return wrapper
+
+    def _statement_done(self, db, sql: str, params, start: float) -> None:
+        """
+        Records a statement and logs it if it was slow.
+        """
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        key = normalize_sql(sql)
+        self.record(self.statements, key, elapsed_ms)
+        if elapsed_ms < self.slow_ms:
+            return
+        message = f"Slow statement {elapsed_ms:.1f} ms: {key}"
+        if self.explain:
+            # executemany passes a list of parameter rows; explain the first
+            if params and isinstance(params, list):
+                params = params[0]
+            try:
+                plan = db.con.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            except Exception as err:
+                message += f"\n    (no query plan: {err})"
+            else:
+                message += "".join(f"\n    {row[-1]}" for row in plan)
+        logger.warning(message)
+
+    def summary(self) -> str:
+        """
+        Formats the timings as a table, slowest total first.
+        :return: The summary text.
+        """
+        lines = []
+        for title, table in (("Methods", self.methods), ("Statements", self.statements)):
+            lines.append(f"{title:<60}{'calls':>8}{'total ms':>11}{'mean':>9}"
+                         f"{'p50':>9}{'p95':>9}{'max':>9}")
+            with self._lock:
+                rows = sorted(table.items(), key=lambda item: item[1].total_ms, reverse=True)
+            for key, timing in rows:
+                lines.append(f"{key[:58]:<60}{timing.count:>8}{timing.total_ms:>11.2f}"
+                             f"{timing.total_ms / timing.count:>9.3f}{timing.percentile(0.5):>9.3f}"
+                             f"{timing.percentile(0.95):>9.3f}{timing.max_ms:>9.3f}")
+        return "\n".join(lines)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapses the whitespace of a statement, so the same statement is always
+    counted under the same key.
+    """
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+# The active Instrumentation, or None while it is disabled
+active = None
+_exit_hook_registered = False
+
+
+def enable(slow_ms: float = 100.0, explain: bool = True,
+           dump_on_exit: bool = False) -> Instrumentation:
+    """
+    Starts timing the Database methods and statements. Does nothing if
+    instrumentation is already enabled.
+    :param slow_ms: Statements slower than this are logged with their query
+    plan, in milliseconds.
+    :param explain: Log the EXPLAIN QUERY PLAN of slow statements.
+    :param dump_on_exit: Log the summary when the program exits.
+    :return: The active Instrumentation, which holds the timings.
+    """
+    global active, _exit_hook_registered
+    if active is not None:
+        return active
+    # Imported here so that importing this module does not pull in Database
+    from database import Database
+    active = Instrumentation(slow_ms=slow_ms, explain=explain)
+    active.install(Database)
+    if dump_on_exit and not _exit_hook_registered:
+        atexit.register(dump)
+        _exit_hook_registered = True
+    return active
+
+
+def disable() -> Instrumentation:
+    """
+    Stops timing and puts back the original Database methods.
+    :return: The Instrumentation that was active, with its timings, or None.
+    """
+    global active
+    instrumentation, active = active, None
+    if instrumentation is not None:
+        instrumentation.uninstall()
+    return instrumentation
+
+
+def dump() -> None:
+    """
+    Logs the summary of the active Instrumentation, if there is one.
+    """
+    if active is not None and (active.methods or active.statements):
+        logger.info(f"Database timings\n{active.summary()}")
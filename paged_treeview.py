@@ -0,0 +1,139 @@
+import tkinter as tk
+from tkinter import ttk
+from typing import Callable
+
+
+class PagedTreeview(tk.Frame):
+    """
+    A Treeview that only holds one page of rows. Rows are fetched from the
+    database with keyset pagination on the first column (a date or week
+    number), so scrolling back through years of history never loads more
+    than a page. Older and Newer buttons, or scrolling past either end of
+    the list, move one page at a time. Refreshing updates only the rows that
+    changed.
+    """
+    def __init__(self, parent, columns: list[tuple[str, str]], page_size: int,
+                 fetch_before: Callable[[str, int], list[tuple]],
+                 fetch_after: Callable[[str, int], list[tuple]],
+                 newest_first: bool = True, *args, **kwargs):
+        """
+        :param parent: The parent widget.
+        :param columns: List of (column id, heading) tuples. The first column
+        holds the key used for paging.
+        :param page_size: The number of rows shown at once.
+        :param fetch_before: Called as fetch_before(key, n). Returns up to n
+        rows with a key older than key, newest first. A key of None means the
+        newest rows.
+        :param fetch_after: Called as fetch_after(key, n). Returns up to n
+        rows with a key newer than key, oldest first.
+        :param newest_first: Show the newest row at the top. If False, the
+        newest row is at the bottom.
+        """
+        super().__init__(parent, *args, **kwargs)
+        self.page_size = page_size
+        self.fetch_before = fetch_before
+        self.fetch_after = fetch_after
+        self.newest_first = newest_first
+        # Exclusive upper bound of the page. None means the newest page.
+        self.upper_key = None
+        # The rows of the current page, newest first
+        self.rows = []
+
+        self.treeview = ttk.Treeview(self, show='headings', height=page_size, selectmode='browse')
+        self.treeview['columns'] = [column_id for column_id, _ in columns]
+        for column_id, heading in columns:
+            self.treeview.heading(column_id, text=heading)
+            self.treeview.column(column_id, width=100, anchor='center')
+        self.treeview.pack()
+
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.treeview.bind(sequence, self.on_scroll, add='+')
+
+        nav = tk.Frame(self)
+        self.older_btn = ttk.Button(nav, text="Older", command=self.show_older)
+        self.newer_btn = ttk.Button(nav, text="Newer", command=self.show_newer)
+        if self.newest_first:
+            self.newer_btn.grid(column=1, row=1)
+            self.older_btn.grid(column=2, row=1)
+        else:
+            self.older_btn.grid(column=1, row=1)
+            self.newer_btn.grid(column=2, row=1)
+        nav.pack()
+
+    def refresh(self) -> None:
+        """
+        Reloads the current page from the database and updates the rows that
+        changed.
+        """
+        self.show_rows(self.fetch_before(self.upper_key, self.page_size))
+
+    def show_older(self) -> None:
+        """
+        Moves one page back in time. Does nothing on the oldest page.
+        """
+        if len(self.rows) < self.page_size:
+            return
+        rows = self.fetch_before(self.rows[-1][0], self.page_size)
+        if rows:
+            self.upper_key = self.rows[-1][0]
+            self.show_rows(rows)
+
+    def show_newer(self) -> None:
+        """
+        Moves one page forward in time. Does nothing on the newest page.
+        """
+        if self.upper_key is None or not self.rows:
+            return
+        newer = self.fetch_after(self.rows[0][0], self.page_size + 1)
+        if len(newer) > self.page_size:
+            self.upper_key = newer[self.page_size][0]
+        else:
+            self.upper_key = None
+        self.refresh()
+
+    def on_scroll(self, event) -> None:
+        """
+        Loads the next page when the user scrolls past the end of the list.
+        """
+        down = event.num == 5 or event.delta < 0
+        top, bottom = self.treeview.yview()
+        if down and bottom >= 1.0:
+            toward_older = self.newest_first
+        elif not down and top <= 0.0:
+            toward_older = not self.newest_first
+        else:
+            return
+        if toward_older:
+            self.show_older()
+        else:
+            self.show_newer()
+
+    def show_rows(self, rows: list[tuple]) -> None:
+        """
+        Updates the Treeview to show rows. Rows that are already shown with
+        the same values are left alone; changed rows are updated in place,
+        new rows are inserted and rows no longer on the page are deleted.
+        :param rows: The rows of the page, newest first.
+        """
+        self.rows = list(rows)
+        ordered = self.rows if self.newest_first else self.rows[::-1]
+        wanted = {str(row[0]) for row in ordered}
+
+        for item_id in self.treeview.get_children():
+            if item_id not in wanted:
+                self.treeview.delete(item_id)
+
+        for index, row in enumerate(ordered):
+            item_id = str(row[0])
+            values = tuple(str(value) for value in row)
+            if self.treeview.exists(item_id):
+                shown = tuple(str(value) for value in self.treeview.item(item_id, 'values'))
+                if shown != values:
+                    self.treeview.item(item_id, values=values)
+                if self.treeview.index(item_id) != index:
+                    self.treeview.move(item_id, '', index)
+            else:
+                self.treeview.insert('', index, iid=item_id, values=values)
+
+        self.newer_btn.state(['disabled'] if self.upper_key is None else ['!disabled'])
+        self.older_btn.state(['disabled'] if len(self.rows) < self.page_size else ['!disabled'])
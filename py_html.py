@@ -1,6 +1,24 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterable
+from typing import Iterator
+from typing import TextIO
+
+
 class PyHTML:
-    def __init__(self, title: str, stylesheet: str = None) -> None:
+    def __init__(self, title: str, stylesheet: str = None, stream: TextIO = None) -> None:
+        """
+        Starts a new HTML document. By default the document is kept in memory
+        until render() is called. If a stream is given, each section is
+        written to it as soon as it is added and nothing is kept in memory;
+        call close() to end the document.
+        :param title: The title of the document.
+        :param stylesheet: URL of the stylesheet. Defaults to classless.css.
+        :param stream: Any object with a write() method, such as an open file.
+        """
         self.doc = []
+        self.stream = stream
         if stylesheet is None:
             stylesheet = "https://classless.de/classless.css"
         head =f"""
@@ -11,48 +29,93 @@ class PyHTML:
           <meta name="viewport" content="width=device-width, initial-scale=1.0">
           <link rel="stylesheet" href="{stylesheet}">
           <title>{title}</title>
-        </head>        
+        </head>
+        """
+        self._write(head)
+        self._write("<body>\n")
+
+    @classmethod
+    @contextmanager
+    def stream_to(cls, filename: str, title: str, stylesheet: str = None) -> Iterator["PyHTML"]:
+        """
+        Context manager that streams a document to filename. Sections are
+        written to a temporary file in the same folder as they are added, and
+        the temporary file replaces filename when the block exits without an
+        error.
+        :param filename: The name of the HTML file that will be written
+        :param title: The title of the document.
+        :param stylesheet: URL of the stylesheet. Defaults to classless.css.
         """
-        self.doc.append(head)
-        self.doc.append("<body>\n")
-        self.doc.append("</body>\n</html>")
+        folder = os.path.dirname(os.path.abspath(filename))
+        fd, temp_name = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                html = cls(title, stylesheet, stream=f)
+                yield html
+                html.close()
+            os.replace(temp_name, filename)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+    def _write(self, content: str) -> None:
+        if self.stream is None:
+            self.doc.append(content)
+        else:
+            self.stream.write(content)
 
     def h1(self, content: str) -> None:
-        self.doc.insert(-1, f"<h1>{content}</h1>")
+        self._write(f"<h1>{content}</h1>\n")
 
     def h2(self, content: str) -> None:
-        self.doc.insert(-1, f"<h2>{content}</h2>")
+        self._write(f"<h2>{content}</h2>\n")
 
     def h3(self, content: str) -> None:
-        self.doc.insert(-1, f"<h3>{content}</h3>")
+        self._write(f"<h3>{content}</h3>\n")
 
     def p(self, content: str) -> None:
-        self.doc.insert(-1, f"<p>{content}</p>")
-
-    def table(self, headers: list, rows: list[tuple]) -> None:
-        tbl = []
-        tbl.append(f"<table>")
-        tbl.append(f"<tr>")
-        for col in headers:
-            tbl.append(f"<th>{col}</th>")
-        tbl.append(f"</tr>")
+        self._write(f"<p>{content}</p>\n")
+
+    def table(self, headers: list, rows: Iterable[tuple]) -> None:
+        """
+        Adds a table. Rows are consumed one at a time, so rows can be any
+        iterable, such as a generator or a live database cursor.
+        :param headers: The column headers.
+        :param rows: The rows of the table. Each row is a tuple of cells.
+        """
+        header_cells = "".join(f"<th>{col}</th>" for col in headers)
+        self._write(f"<table>\n<tr>{header_cells}</tr>\n")
         for row in rows:
-            tbl.append(f"<tr>")
-            for col in row:
-                tbl.append(f"<td>{col}</td>")
-            tbl.append(f"</tr>")
-        tbl.append(f"</table>")
-        self.doc.insert(-1, "\n".join(tbl))
+            cells = "".join(f"<td>{col}</td>" for col in row)
+            self._write(f"<tr>{cells}</tr>\n")
+        self._write("</table>\n")
+
+    def close(self) -> None:
+        """
+        Ends the document by writing the closing body and html tags to the
+        stream. Only used in streaming mode; render() closes in-memory
+        documents.
+        """
+        self.stream.write("</body>\n</html>")
 
     def render(self, filename: str) -> None:
         """
         Writes the HTML file to the file specified in the filename parameter.
+        The document is written to a temporary file in the same folder, which
+        then replaces filename, so readers never see a half-written report.
         :param filename: The name of the HTML file that will be written
         :return: None
         """
-        f = open(filename, "w")
-        f.writelines(self.doc)
-        f.close()
+        folder = os.path.dirname(os.path.abspath(filename))
+        fd, temp_name = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.writelines(self.doc)
+                f.write("</body>\n</html>")
+            os.replace(temp_name, filename)
+        except BaseException:
+            os.remove(temp_name)
+            raise
 
 if __name__ == "__main__":
     test_html = PyHTML("Test")
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class ReportScheduler:
+    """
+    Regenerate the HTML report on a background thread. Requests made within
+    the delay of each other are coalesced into a single render, so correcting
+    several days in a row writes the report once instead of on every click.
+    The worker thread opens one Database on its first render and keeps it
+    for every render until stop().
+    """
+    def __init__(self, render: Callable[[Database], None] = None,
+                 delay: float = 1.0,
+                 open_database: Callable[[], Database] = Database) -> None:
+        """
+        Creates the scheduler. The worker thread is started by the first
+        request.
+        :param render: The function that writes the report, given the
+        worker thread's Database. Defaults to generate_report().
+        :param delay: Seconds to wait after the latest request before
+        rendering.
+        :param open_database: Opens the Database for the worker thread.
+        Defaults to the Database for the default path.
+        """
+        self.render = render or generate_report
+        self.delay = delay
+        self.open_database = open_database
+        self._condition = threading.Condition()
+        self._due = None
+        self._rendering = False
+        self._stopping = False
+        self._thread = None
+
+    def request(self) -> None:
+        """
+        Asks for the report to be regenerated. Returns immediately. The render
+        happens once no further request has arrived for the delay.
+        """
+        with self._condition:
+            self._due = time.monotonic() + self.delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="report-scheduler",
+                                                daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> None:
+        """
+        Renders any pending request now and waits for it to finish. Call
+        before the application exits, since the worker is a daemon thread.
+        :param timeout: The most seconds to wait, or None to wait until done.
+        """
+        with self._condition:
+            if self._due is not None:
+                self._due = time.monotonic()
+                self._condition.notify_all()
+            self._condition.wait_for(lambda: self._due is None and not self._rendering,
+                                     timeout=timeout)
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Renders any pending request, then stops the worker thread, which
+        closes its Database. A later request starts a new worker thread.
+        :param timeout: The most seconds to wait, or None to wait until done.
+        """
+        with self._condition:
+            thread = self._thread
+            if thread is None:
+                return
+            if self._due is not None:
+                self._due = time.monotonic()
+            self._stopping = True
+            self._condition.notify_all()
+        thread.join(timeout)
+        with self._condition:
+            if not thread.is_alive():
+                self._thread = None
+                self._stopping = False
+
+    def _run(self) -> None:
+        """
+        Worker loop. Sleeps until the latest request is due, then renders.
+        The Database is opened here, so its connections belong to this thread.
+        """
+        db = None
+        try:
+            while True:
+                with self._condition:
+                    while self._due is None or time.monotonic() < self._due:
+                        if self._stopping and self._due is None:
+                            return
+                        wait = None if self._due is None else self._due - time.monotonic()
+                        self._condition.wait(timeout=wait)
+                    self._due = None
+                    self._rendering = True
+                try:
+                    if db is None:
+                        db = self.open_database()
+                    self.render(db)
+                except Exception:
+                    logger.exception("Report generation failed")
+                finally:
+                    with self._condition:
+                        self._rendering = False
+                        self._condition.notify_all()
+        finally:
+            if db is not None:
+                db.close()
+
+
+def generate_report(db: Database) -> None:
+    """
+    Writes the YTD report. ytd_html_report is imported on the first render
+    instead of at startup, since the daily input widget only needs it after
+    a click.
+    :param db: The database to report on.
+    """
+    import ytd_html_report
+    ytd_html_report.generate_report(db=db)
+
+
+_scheduler = ReportScheduler()
+
+
+def request_report() -> None:
+    """
+    Asks the shared scheduler to regenerate the YTD report in the background.
+    """
+    _scheduler.request()
+
+
+def flush(timeout: float = None) -> None:
+    """
+    Writes any pending report from the shared scheduler before returning.
+    :param timeout: The most seconds to wait, or None to wait until done.
+    """
+    _scheduler.flush(timeout)
+
+
+def stop(timeout: float = None) -> None:
+    """
+    Writes any pending report from the shared scheduler, then stops its
+    worker thread and closes the worker's Database. Call when the
+    application exits.
+    :param timeout: The most seconds to wait, or None to wait until done.
+    """
+    _scheduler.stop(timeout)
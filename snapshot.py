@@ -0,0 +1,165 @@
+"""
+Read-only snapshots of the database for reporting. A snapshot is a copy made
+with SQLite's online backup API, so it is consistent even while the app or
+the daily input widget is writing. It is then vacuumed and published under a
+new name. A published snapshot never changes, so readers open it with
+mode=ro&immutable=1 and SQLite skips all locking and change detection.
+Database(snapshot_dir=...) routes its read-only queries to the latest one.
+
+    python snapshot.py --db Data/worklocation.db --dir Data/snapshots
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = Path('Data/snapshots')
+
+
+def list_snapshots(db_path: Path, snapshot_dir: Path = DEFAULT_SNAPSHOT_DIR) -> list[Path]:
+    """
+    Lists the published snapshots of a database, oldest first.
+    :param db_path: Path of the live database.
+    :param snapshot_dir: The folder holding the snapshots.
+    :return: List of snapshot paths.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    if not snapshot_dir.is_dir():
+        return []
+    # The timestamp in the name sorts in the order the snapshots were made
+    return sorted(snapshot_dir.glob(f"{Path(db_path).stem}-*.db"))
+
+
+def latest_snapshot(db_path: Path, snapshot_dir: Path = DEFAULT_SNAPSHOT_DIR) -> Path:
+    """
+    Finds the newest published snapshot of a database.
+    :param db_path: Path of the live database.
+    :param snapshot_dir: The folder holding the snapshots.
+    :return: The path of the snapshot, or None if there is none.
+    """
+    snapshots = list_snapshots(db_path, snapshot_dir)
+    return snapshots[-1] if snapshots else None
+
+
+def create_snapshot(db_path: Path, snapshot_dir: Path = DEFAULT_SNAPSHOT_DIR,
+                    keep: int = 2) -> Path:
+    """
+    Copies the database to a new snapshot with the online backup API, then
+    compacts it with VACUUM and publishes it. Older snapshots beyond keep are
+    deleted.
+    :param db_path: Path of the live database.
+    :param snapshot_dir: The folder to write the snapshot to. Created if
+    needed.
+    :param keep: The number of snapshots to keep, including the new one.
+    :return: The path of the new snapshot.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    snapshot_path = snapshot_dir / f"{Path(db_path).stem}-{stamp}.db"
+    temp_path = snapshot_path.with_suffix('.tmp')
+
+    start = time.perf_counter()
+    source = sqlite3.connect(str(db_path))
+    target = sqlite3.connect(str(temp_path))
+    try:
+        source.backup(target)
+        # A snapshot is a single file: no WAL for immutable readers to miss
+        target.execute('PRAGMA journal_mode = delete')
+        target.execute('VACUUM')
+        target.close()
+        os.replace(temp_path, snapshot_path)
+    except BaseException:
+        target.close()
+        temp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        source.close()
+    logger.info(f"snapshot={snapshot_path} bytes={snapshot_path.stat().st_size} "
+                f"seconds={time.perf_counter() - start:.3f}")
+
+    for old in list_snapshots(db_path, snapshot_dir)[:-keep]:
+        try:
+            old.unlink()
+        except OSError as err:
+            # Still open by a reader on a system that does not allow that
+            logger.warning(f"Could not delete snapshot {old}: {err!r}")
+    return snapshot_path
+
+
+class SnapshotScheduler:
+    """
+    Makes a snapshot of the database on a background thread at a fixed
+    interval.
+    """
+    def __init__(self, db_path: Path, interval: float,
+                 snapshot_dir: Path = DEFAULT_SNAPSHOT_DIR, keep: int = 2) -> None:
+        """
+        Creates the scheduler. Call start() to begin.
+        :param db_path: Path of the live database.
+        :param interval: Seconds between snapshots.
+        :param snapshot_dir: The folder to write the snapshots to.
+        :param keep: The number of snapshots to keep.
+        """
+        self.db_path = db_path
+        self.interval = interval
+        self.snapshot_dir = snapshot_dir
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Makes the first snapshot right away on the worker thread and then
+        one every interval.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="snapshot-scheduler",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the worker thread, waiting for a snapshot in progress.
+        :param timeout: The most seconds to wait, or None to wait until done.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        """
+        Worker loop.
+        """
+        while not self._stop.is_set():
+            try:
+                create_snapshot(self.db_path, self.snapshot_dir, self.keep)
+            except Exception:
+                logger.exception("Snapshot failed")
+            self._stop.wait(self.interval)
+
+
+def main() -> None:
+    """
+    Command line entry point. Makes one snapshot, e.g. from a scheduled task.
+    """
+    # Imported here, since the app imports this module through database.py
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Make a read-only snapshot of the database.")
+    parser.add_argument('--db', default='Data/worklocation.db', help="Path to the database file.")
+    parser.add_argument('--dir', default=str(DEFAULT_SNAPSHOT_DIR), help="The folder for the snapshots.")
+    parser.add_argument('--keep', type=int, default=2, help="The number of snapshots to keep.")
+    args = parser.parse_args()
+    print(create_snapshot(Path(args.db), Path(args.dir), args.keep))
+
+
+if __name__ == '__main__':
+    main()
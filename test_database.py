@@ -1,12 +1,31 @@
 import unittest
 from pathlib import Path
+import sqlite3
 from sqlite3 import DatabaseError
 import shutil
 import os
 import logging
-
-
+import tempfile
+import threading
+from unittest import mock
+import time
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+
+from async_database import AsyncDatabase
+import audit
+import backup
+import batch_report
+from columnar_store import ColumnarStore
 from database import Database
+from report_scheduler import ReportScheduler
+import db_setup
+import instrumentation
+import snapshot
+import work_calendar
+import ytd_html_report
 
 
 class TestDatabase(unittest.TestCase):
@@ -23,6 +42,204 @@ class TestDatabase(unittest.TestCase):
         cls.db.close()
         os.remove(cls.dest_file)
 
+    def test_add_work_day(self):
+        self.assertTrue(self.db.add_work_day(work_date="2024-12-29", week_number="2024-52", location="remote"))
+        self.assertFalse(self.db.add_work_day(work_date="2024-12-29", week_number="2024-52", location="office"))
+        self.assertEqual(("2024-12-29", "2024-52", "remote"), self.db.get_work_day("2024-12-29"))
+        with self.assertRaises(DatabaseError):
+            self.db.add_work_day(work_date="2024-12-30", week_number="2025-01", location="New York")
+        self.assertIsNone(self.db.get_work_day("2024-12-30"))
+        self.assertIn("office", self.db.get_locations())
+
+    def test_async_database_coalesces_reads(self):
+        async_db = AsyncDatabase(lambda: Database(self.dest_file.resolve()))
+        try:
+            # Hold the worker so the reads below are still pending
+            release = threading.Event()
+            async_db.submit(lambda db: release.wait(), coalesce=False)
+            first = async_db.call('get_weekly_count', week_number="2024-50")
+            second = async_db.call('get_weekly_count', week_number="2024-50")
+            results = []
+            delivered = threading.Event()
+            third = async_db.call('get_weekly_count', week_number="2024-49",
+                                  callback=lambda count: (results.append(count), delivered.set()))
+            self.assertIs(first, second)
+            self.assertIsNot(first, third)
+            release.set()
+            self.assertEqual(self.db.get_weekly_count(week_number="2024-50"), first.result(timeout=5))
+            self.assertTrue(delivered.wait(timeout=5))
+            self.assertEqual([self.db.get_weekly_count(week_number="2024-49")], results)
+            with self.assertRaises(ValueError):
+                async_db.call('get_work_day', "not a date").result(timeout=5)
+        finally:
+            async_db.close()
+
+    def test_audit_log_records_history(self):
+        with tempfile.TemporaryDirectory() as folder:
+            log_path = Path(folder) / "log.txt"
+            audit.configure(log_path=log_path, audit_db=self.dest_file)
+            try:
+                self.db.new_work_day(work_date="2025-01-13", week_number="2025-03", location="remote")
+                self.db.set_location(work_date="2025-01-13", new_location="office")
+                self.db.bulk_set_locations([("2025-01-13", "remote")])
+                audit.flush()
+                history = self.db.get_location_history("2025-01-13")
+            finally:
+                audit.shutdown()
+            self.assertEqual([('new_work_day', None, 'remote'),
+                              ('set_location', 'remote', 'office'),
+                              ('bulk_set_locations', 'office', 'remote')],
+                             [row[1:] for row in history])
+            self.assertIn("old_location=remote new_location=office", log_path.read_text())
+        self.assertEqual([], self.db.get_location_history("2025-01-14"))
+
+    def test_backup_rotates_and_verifies(self):
+        with tempfile.TemporaryDirectory() as folder:
+            first = backup.create_backup(self.dest_file, folder, 'gzip', keep=2,
+                                         pages_per_step=1, sleep=0)
+            self.assertTrue(first.verified.result())
+            self.assertTrue(backup.create_backup(self.dest_file, folder, 'lzma', keep=2).verified.result())
+            latest = backup.create_backup(self.dest_file, folder, 'gzip', keep=2)
+            self.assertTrue(latest.verified.result())
+            self.assertNotIn(first.path, backup.list_backups(self.dest_file, folder))
+            self.assertEqual(2, len(backup.list_backups(self.dest_file, folder)))
+
+            with open(latest.path, 'r+b') as f:
+                f.truncate(f.seek(0, os.SEEK_END) // 2)
+            with self.assertLogs(backup.logger, level=logging.ERROR):
+                self.assertFalse(backup.verify_backup(latest.path))
+            self.assertEqual(1, len(backup.list_backups(self.dest_file, folder)))
+
+    def test_backup_is_verified_in_background(self):
+        verify_backup = backup.verify_backup
+        checking = threading.Event()
+        release = threading.Event()
+
+        def blocked_verify(backup_path):
+            checking.set()
+            release.wait(5)
+            return verify_backup(backup_path)
+
+        with tempfile.TemporaryDirectory() as folder:
+            old = backup.create_backup(self.dest_file, folder, keep=1)
+            self.assertTrue(old.verified.result())
+            with mock.patch('backup.verify_backup', blocked_verify):
+                new = backup.create_backup(self.dest_file, folder, keep=1)
+                # create_backup returned while the check is still running
+                self.assertTrue(checking.wait(5))
+                self.assertFalse(new.verified.done())
+                self.assertEqual([old.path, new.path], backup.list_backups(self.dest_file, folder))
+                release.set()
+                self.assertTrue(new.verified.result(5))
+            self.assertEqual([new.path], backup.list_backups(self.dest_file, folder))
+
+    def test_backup_that_fails_verification_keeps_old_backups(self):
+        copy_file = shutil.copyfileobj
+        copies = []
+
+        def truncate_first_copy(source, target, length=0):
+            # The first copy is the compression of the new backup
+            copies.append(target)
+            if len(copies) == 1:
+                data = source.read()
+                target.write(data[:len(data) // 2])
+            else:
+                copy_file(source, target, length)
+
+        with tempfile.TemporaryDirectory() as folder:
+            good = [backup.create_backup(self.dest_file, folder, keep=2) for _ in range(2)]
+            self.assertTrue(all(made.verified.result() for made in good))
+            with mock.patch('shutil.copyfileobj', truncate_first_copy):
+                with self.assertLogs(backup.logger, level=logging.ERROR):
+                    bad = backup.create_backup(self.dest_file, folder, keep=1)
+                    self.assertFalse(bad.verified.result())
+            self.assertEqual([made.path for made in good], backup.list_backups(self.dest_file, folder))
+            self.assertEqual(1, len(list(Path(folder).glob("*.corrupt"))))
+
+    def test_batch_report_renders_across_processes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            out_dir = Path(folder) / "reports"
+            argv = ["batch_report.py", "--db", str(self.dest_file), "--person", "1",
+                    "--year", "2023", "2024", "--out", str(out_dir), "--workers", "2"]
+            with mock.patch("sys.argv", argv), mock.patch("sys.stdout"):
+                with self.assertRaises(SystemExit) as cm:
+                    batch_report.main()
+            self.assertEqual(0, cm.exception.code)
+            reports = sorted(out_dir.iterdir())
+            self.assertEqual(["test_db_copy_person1_2023.html", "test_db_copy_person1_2024.html"],
+                             [report.name for report in reports])
+            html = reports[0].read_text()
+            self.assertIn("<h1>2023 Attendance Report</h1>", html)
+            self.assertIn("<td>2023-52</td>", html)
+
+    def test_bulk_new_work_days(self):
+        results = self.db.bulk_new_work_days([("2025-01-06", "2025-02", "office"),
+                                              ("2025-01-07", "2025-02", "New York"),
+                                              ("2024-11-19", "2024-47", "office"),
+                                              ("2025-01-08", "2025-02", "office")])
+        self.assertEqual(['inserted', 'unknown location', 'duplicate', 'inserted'], results)
+        self.assertEqual(2, self.db.get_weekly_count(week_number="2025-02"))
+
+    def test_bulk_set_locations(self):
+        results = self.db.bulk_set_locations([("2024-12-09", "remote"),
+                                              ("2024-12-10", "Paris"),
+                                              ("2024-12-14", "office"),
+                                              ("2024-12-32", "office")])
+        self.assertEqual(['updated', 'unknown location', 'not found', 'invalid date'], results)
+        self.assertEqual("remote", self.db.get_work_day("2024-12-09")[2])
+        self.db.bulk_set_locations([("2024-12-09", "office")])
+        self.assertEqual(3, self.db.get_weekly_count(week_number="2024-50"))
+
+    def test_data_version(self):
+        version = self.db.data_version()
+        self.assertEqual(version, self.db.data_version())
+
+        self.db.set_location(work_date="2024-11-25",
+                             new_location=self.db.get_work_day("2024-11-25")[2])
+        self.assertNotEqual(version, self.db.data_version())
+
+        # A commit from another connection, as from the daily input widget
+        version = self.db.data_version()
+        con = sqlite3.connect(self.dest_file)
+        con.execute("UPDATE Person SET name = name WHERE person_id = 1")
+        con.commit()
+        con.close()
+        self.assertNotEqual(version, self.db.data_version())
+
+    def test_databases_share_pooled_connections(self):
+        other = Database(self.dest_file.resolve())
+        self.assertIs(self.db.con, other.con)
+        other.close()
+        self.assertIsNotNone(self.db.get_work_day("2024-11-25"))
+
+    def test_default_open_profile_uses_wal(self):
+        journal_mode = self.db.con.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', journal_mode)
+
+    def test_generate_report_for_past_year(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "report.html")
+            ytd_html_report.generate_report(db=self.db, year=2023, filename=filename)
+            with open(filename) as f:
+                html = f.read()
+            self.assertEqual([filename], [os.path.join(folder, name) for name in os.listdir(folder)])
+        self.assertIn("<p>YTD average: 0.15</p>", html)
+        self.assertIn("<td>2023-52</td>", html)
+        self.assertNotIn("<td>2024-01</td>", html)
+
+    def test_get_days_before_and_after(self):
+        recent = self.db.get_recent_days(30)
+        self.assertEqual(recent[:15], self.db.get_days_before(None, 15))
+        self.assertEqual(recent[15:30], self.db.get_days_before(recent[14][0], 15))
+        self.assertEqual(recent[5:15][::-1], self.db.get_days_after(recent[15][0], 10))
+
+    def test_get_weeks_before_and_after(self):
+        weeks = self.db.get_weeks_before("2024-51", 3)
+        self.assertEqual(['2024-50', '2024-49', '2024-48'], [week[0] for week in weeks])
+        self.assertEqual(3, weeks[0][-1])
+        weeks = self.db.get_weeks_after("2024-49", 2)
+        self.assertEqual(['2024-50', '2024-51'], [week[0] for week in weeks])
+
     def test_get_most_recent_days_default(self):
         days = self.db.get_recent_days()
         expected = 15
@@ -42,6 +259,128 @@ class TestDatabase(unittest.TestCase):
         work_day = self.db.get_work_day("2024-12-25")
         self.assertIsNone(work_day)
 
+    @staticmethod
+    def _import_files(folder: str) -> tuple[str, str]:
+        """
+        Creates an empty database covering 2024 and a csv file with five new
+        days, a repeated day, an invalid date and an unknown location.
+        """
+        db_path = str(Path(folder) / "import.db")
+        db_setup.create_tables(db_path)
+        db_setup.fill_week_table(start_year=2024, end_year=2025, db_path=db_path)
+        db_setup.fill_location_table(db_path)
+        csv_path = str(Path(folder) / "location.csv")
+        with open(csv_path, "w", newline="") as f:
+            f.write("Year,Month,Day,Location\n"
+                    "2024,3,4,office\n2024,3,5,remote\n2024,3,6,office\n"
+                    "2024,3,4,remote\n2024,2,30,office\n"
+                    "2024,3,7,New York\n2024,3,8,office\n2024,3,11,remote\n")
+        return db_path, csv_path
+
+    def test_import_data_batches_and_rejects(self):
+        with tempfile.TemporaryDirectory() as folder:
+            db_path, csv_path = self._import_files(folder)
+            summary = db_setup.import_data(db_path, csv_path, batch_size=2)
+            self.assertEqual((8, 5, 1, 2), summary[:4])
+            con = sqlite3.connect(db_path)
+            try:
+                rows = con.execute("SELECT work_date, location FROM WorkDayText ORDER BY work_date").fetchall()
+            finally:
+                con.close()
+            self.assertEqual([("2024-03-04", "office"), ("2024-03-05", "remote"), ("2024-03-06", "office"),
+                              ("2024-03-08", "office"), ("2024-03-11", "remote")], rows)
+            with open(Path(csv_path).with_suffix(".rejects.csv")) as f:
+                rejects = [line.split(",")[:2] for line in f.read().splitlines()[1:]]
+            self.assertEqual([["6", "invalid date"], ["7", "unknown location"]], rejects)
+
+    def test_import_data_dry_run_writes_nothing(self):
+        with tempfile.TemporaryDirectory() as folder:
+            db_path, csv_path = self._import_files(folder)
+            summary = db_setup.import_data(db_path, csv_path, batch_size=2, dry_run=True)
+            self.assertEqual((8, 0, 0, 2), summary[:4])
+            con = sqlite3.connect(db_path)
+            try:
+                self.assertEqual(0, con.execute("SELECT COUNT(*) FROM WorkDay").fetchone()[0])
+            finally:
+                con.close()
+
+    def test_import_data_extends_week_table(self):
+        with tempfile.TemporaryDirectory() as folder:
+            db_path, csv_path = self._import_files(folder)
+            with open(csv_path, "w", newline="") as f:
+                f.write("Year,Month,Day,Location\n2026,6,1,office\n2200,6,2,office\n")
+            summary = db_setup.import_data(db_path, csv_path)
+            self.assertEqual((2, 1, 0, 1), summary[:4])
+            con = sqlite3.connect(db_path)
+            try:
+                rows = con.execute("SELECT work_date, week_number FROM WorkDayText").fetchall()
+                years = con.execute("SELECT DISTINCT week_id / 100 FROM Week ORDER BY 1").fetchall()
+            finally:
+                con.close()
+            self.assertEqual([("2026-06-01", "2026-23")], rows)
+            self.assertEqual([(2024,), (2025,), (2026,)], years)
+            with open(Path(csv_path).with_suffix(".rejects.csv")) as f:
+                rejects = [line.split(",")[:2] for line in f.read().splitlines()[1:]]
+            self.assertEqual([["3", "missing week"]], rejects)
+
+    def test_instrumentation_times_calls(self):
+        original = Database.get_work_day
+        timings = instrumentation.enable(slow_ms=0)
+        try:
+            with self.assertLogs(instrumentation.logger, level=logging.WARNING) as cm:
+                self.db.get_work_day("2024-11-25")
+        finally:
+            instrumentation.disable()
+        self.assertEqual(1, timings.methods["Database.get_work_day"].count)
+        self.assertEqual(1, sum(timing.count for timing in timings.statements.values()))
+        self.assertIn("USING PRIMARY KEY", cm.output[0])
+        self.assertIn("Database.get_work_day", timings.summary())
+        self.assertIs(original, Database.get_work_day)
+
+    def test_snapshot_reads_lag_until_next_snapshot(self):
+        with tempfile.TemporaryDirectory() as folder:
+            snapshot.create_snapshot(self.dest_file, folder)
+            reports_db = Database(self.dest_file.resolve(), snapshot_dir=folder)
+            try:
+                self.assertTrue(reports_db.read_pool.immutable)
+                self.assertEqual(self.db.get_work_day("2024-11-25"), reports_db.get_work_day("2024-11-25"))
+                version = reports_db.data_version()
+
+                self.db.add_work_day(work_date="2024-12-31", week_number="2025-01", location="remote")
+                self.assertIsNone(reports_db.get_work_day("2024-12-31"))
+
+                snapshot.create_snapshot(self.dest_file, folder, keep=1)
+                self.assertNotEqual(version, reports_db.data_version())
+                self.assertEqual("remote", reports_db.get_work_day("2024-12-31")[2])
+                self.assertEqual(1, len(snapshot.list_snapshots(self.dest_file, folder)))
+            finally:
+                reports_db.close()
+
+    def test_summary_as_of_replays_change_log(self):
+        person_id = self.db.add_person("History Person")
+        days = [date(2022, 1, 3) + timedelta(days=offset) for offset in range(800)]
+        rows = [(day.isoformat(), work_calendar.week_number(day), ("office", "remote")[day.day % 2])
+                for day in days if day.weekday() < 5][:db_setup.CHECKPOINT_INTERVAL + 20]
+        self.db.bulk_new_work_days(rows, person_id=person_id)
+        start_week, end_week = rows[0][1], rows[-1][1]
+        before = self.db.get_weekly_summary(start_week, end_week, person_id)
+        before_average = self.db.get_ytd_average(2023, "2023-52", person_id)
+        time.sleep(0.01)
+        as_of = datetime.now()
+        time.sleep(0.01)
+        self.db.bulk_set_locations([(work_date, "office") for work_date, _, _ in rows[::3]], person_id)
+
+        self.assertEqual(before, self.db.get_weekly_summary_as_of(start_week, end_week, as_of, person_id))
+        self.assertEqual(before_average, self.db.get_ytd_average_as_of(2023, "2023-52", as_of, person_id))
+        self.assertEqual(self.db.get_weekly_summary(start_week, end_week, person_id),
+                         self.db.get_weekly_summary_as_of(start_week, end_week, datetime.now(), person_id))
+        self.assertNotEqual(before, self.db.get_weekly_summary(start_week, end_week, person_id))
+        self.assertEqual({0}, {row[3] for row in self.db.get_weekly_summary_as_of(
+            start_week, end_week, datetime(2000, 1, 1), person_id)})
+        # The default person's work days are older than the change log
+        with self.assertRaises(ValueError):
+            self.db.get_weekly_summary_as_of("2024-48", "2024-48", datetime(2000, 1, 1))
+
     def test_set_location_same_location(self):
         work_day = self.db.get_work_day("2024-11-25")
         current_location = work_day[2]
@@ -85,6 +424,49 @@ class TestDatabase(unittest.TestCase):
                              new_location='office')
         self.assertIsNone(self.db.get_work_day("2024-11-23"))
 
+    def test_report_scheduler_coalesces_and_reschedules(self):
+        with tempfile.TemporaryDirectory() as folder:
+            report = Path(folder) / "report.html"
+            rendered = threading.Semaphore(0)
+            renders = []
+            databases = []
+
+            def open_database():
+                databases.append(Database(self.dest_file.resolve()))
+                return databases[-1]
+
+            def render(db):
+                ytd_html_report.generate_report(db=db, year=2024, filename=str(report),
+                                                today=date(2024, 12, 31))
+                renders.append((db, threading.get_ident(), report.read_text()))
+                rendered.release()
+
+            scheduler = ReportScheduler(render, delay=0.05, open_database=open_database)
+            scheduler.request()
+            scheduler.request()
+            self.assertTrue(rendered.acquire(timeout=5))
+            self.assertIn("2024-52", renders[0][2])
+            report.unlink()
+            scheduler.request()
+            self.assertTrue(rendered.acquire(timeout=5))
+            scheduler.flush(timeout=5)
+            self.assertTrue(report.exists())
+            self.assertEqual(2, len(renders))
+            # One Database, opened on the worker thread, for every render
+            self.assertEqual(1, len(databases))
+            self.assertEqual({(databases[0], renders[0][1])}, {render[:2] for render in renders})
+            self.assertNotEqual(threading.get_ident(), renders[0][1])
+
+            report.unlink()
+            scheduler.request()
+            scheduler.stop(timeout=5)
+            self.assertTrue(report.exists())
+            self.assertEqual(3, len(renders))
+            self.assertEqual(0, databases[0].pool.users)
+
+    def test_schema_version_is_current(self):
+        self.assertEqual(db_setup.SCHEMA_VERSION, db_setup.schema_version(self.db.con))
+
     def test_set_location_error_logging(self):
         work_day = self.db.get_work_day("2024-11-25")
         self.assertEqual('office', work_day[2])
@@ -123,6 +505,24 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(3, len(self.db.get_work_day("2025-01-01")))
         self.assertEqual("remote", self.db.get_work_day("2025-01-01")[2])
 
+    def test_new_work_day_extends_week_table(self):
+        self.assertEqual([], self.db.get_weekly_summary(start_week="2028-01", end_week="2028-53"))
+        self.db.new_work_day(work_date="2029-03-05",
+                             week_number="2029-10",
+                             location="office")
+        self.assertEqual(1, self.db.get_weekly_count(week_number="2029-10"))
+        self.assertEqual(52, len(self.db.get_weekly_summary(start_week="2028-01", end_week="2028-53")))
+
+    def test_new_work_day_rejects_bad_week(self):
+        weeks = self.db._fetchone("SELECT COUNT(*) FROM Week")
+        for week_number in ("2249-01", "0001-01", "2024-54", "24-01"):
+            with self.assertRaises(ValueError):
+                self.db.new_work_day(work_date="2022-06-06", week_number=week_number, location="office")
+        self.assertEqual(weeks, self.db._fetchone("SELECT COUNT(*) FROM Week"))
+        self.assertIsNone(self.db.get_work_day("2022-06-06"))
+        self.assertEqual(['unknown week'],
+                         self.db.bulk_new_work_days([("2022-06-06", "2249-01", "office")]))
+
     def test_new_work_day_duplicate_day(self):
         self.assertIsNotNone(self.db.get_work_day("2024-11-19"))
         with self.assertRaises(DatabaseError):
@@ -148,12 +548,101 @@ class TestDatabase(unittest.TestCase):
         self.assertAlmostEqual(.15, self.db.get_ytd_average(year=2023, end_week="2023-52"), delta=.01)
         self.assertIsNone(self.db.get_ytd_average(year=2024, end_week="2023-50"))
 
+    def test_columnar_store_matches_database(self):
+        store = ColumnarStore(self.db)
+        self.assertEqual(self.db.get_weekly_summary("2024-40", "2024-52"),
+                         store.get_weekly_summary("2024-40", "2024-52"))
+        self.assertEqual(self.db.get_weekly_count("2024-48"), store.get_weekly_count("2024-48"))
+        self.assertAlmostEqual(self.db.get_ytd_average(2024, "2024-52"),
+                               store.get_ytd_average(2024, "2024-52"))
+        self.assertEqual(self.db.get_rolling_averages("2024-50", (4, 52)),
+                         store.get_rolling_averages("2024-50", (4, 52)))
+        self.assertEqual(self.db.get_recent_days(5), store.get_recent_days(5))
+
+        self.db.new_work_day(work_date="2024-12-28", week_number="2024-52", location="remote")
+        self.assertIn(("2024-12-28", "remote"), store.get_recent_days(30))
+
+    def test_get_rolling_averages(self):
+        averages = self.db.get_rolling_averages(end_week="2024-51", windows=(4, 52))
+        self.assertAlmostEqual(3.0, averages[4])
+        self.assertAlmostEqual(145 / 52, averages[52], delta=.01)
+
+        team = self.db.get_team_rolling_averages(end_week="2024-51", windows=(4, 52))
+        self.assertEqual(averages, team[0][2])
+
     def test_get_weekly_summary(self):
         weeks = self.db.get_weekly_summary(start_week="2024-48", end_week="2024-52")
         self.assertEqual(5, len(weeks))
         self.assertEqual('2024-52', weeks[-1][0])
         self.assertEqual(0, weeks[-1][-1])
 
+    def test_iter_weekly_summary(self):
+        weeks = self.db.iter_weekly_summary(start_week="2024-48", end_week="2024-52")
+        self.assertEqual(self.db.get_weekly_summary(start_week="2024-48", end_week="2024-52"),
+                         list(weeks))
+
+    def test_migration_resumes_backfill(self):
+        migrate_file = Path("./Data") / "test_db_migrate.db"
+        shutil.copy(Path("./Data") / "test_db.db", migrate_file)
+        con = sqlite3.connect(migrate_file)
+        try:
+            row_count = con.execute("SELECT COUNT(*) FROM WorkDay").fetchone()[0]
+            # An upgrade interrupted after the first chunk of the backfill
+            con.execute("BEGIN IMMEDIATE")
+            self.assertEqual(100, db_setup.backfill_integer_tables(con, 100))
+            con.commit()
+
+            db_setup.ensure_schema(con, chunk_size=100)
+            self.assertEqual(db_setup.SCHEMA_VERSION, db_setup.schema_version(con))
+            self.assertEqual(row_count, con.execute("SELECT COUNT(*) FROM WorkDay").fetchone()[0])
+            self.assertEqual([], db_setup.verify_week_summary(con))
+            self.assertEqual([], con.execute("PRAGMA foreign_key_check").fetchall())
+        finally:
+            con.close()
+            os.remove(migrate_file)
+
+    def test_person_work_days_are_separate(self):
+        person_id = self.db.add_person("Second Person")
+        self.assertIsNone(self.db.get_work_day("2024-11-26", person_id=person_id))
+        self.db.new_work_day(work_date="2024-11-26",
+                             week_number="2024-48",
+                             location="office",
+                             person_id=person_id)
+        self.assertEqual("office", self.db.get_work_day("2024-11-26", person_id=person_id)[2])
+        self.assertEqual(1, self.db.get_weekly_count(week_number="2024-48", person_id=person_id))
+        self.assertEqual(3, self.db.get_weekly_count(week_number="2024-48"))
+
+        counts = {row[0]: row[2] for row in self.db.get_team_weekly_counts(week_number="2024-48")}
+        self.assertEqual({1: 3, person_id: 1}, counts)
+
+    def test_text_views_match_tables(self):
+        row = self.db.con.execute(
+            "SELECT work_date, week_number, location FROM WorkDayText "
+            "WHERE person_id = 1 AND work_date = '2024-11-25'").fetchone()
+        self.assertEqual(self.db.get_work_day("2024-11-25"), row)
+        count = self.db.con.execute(
+            "SELECT day_count FROM WeekSummaryText "
+            "WHERE person_id = 1 AND week_number = '2024-48' AND location = 'office'").fetchone()[0]
+        self.assertEqual(self.db.get_weekly_count("2024-48"), count)
+
+    def test_week_number_uses_iso_year(self):
+        self.assertEqual("2020-53", work_calendar.week_number(date(2020, 12, 31)))
+        self.assertEqual("2020-53", work_calendar.week_number(date(2021, 1, 3)))
+        self.assertEqual("2021-01", work_calendar.week_number(date(2021, 1, 4)))
+        self.assertEqual(["2020-53", "2020-53", "2021-01"],
+                         work_calendar.week_numbers([date(2020, 12, 31), date(2021, 1, 3), date(2021, 1, 4)]))
+        self.assertEqual(53, len(work_calendar.weeks_of_year(2020)))
+        self.assertEqual("0999-01", work_calendar.weeks_of_year(999)[0][0])
+
+    def test_week_summary_follows_work_day(self):
+        self.db.new_work_day(work_date="2024-12-27",
+                             week_number="2024-52",
+                             location="office")
+        self.assertEqual(1, self.db.get_weekly_count(week_number="2024-52"))
+        self.db.set_location(work_date="2024-12-27", new_location="remote")
+        self.assertEqual(0, self.db.get_weekly_count(week_number="2024-52"))
+        self.assertEqual([], db_setup.verify_week_summary(self.db.con))
+
 
 
 
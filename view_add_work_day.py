@@ -6,7 +6,8 @@ from datetime import timedelta
 
 import constants
 from database import Database
-import ytd_html_report
+import report_scheduler
+import work_calendar
 
 class AddWorkDay(tk.Frame):
     """
@@ -98,20 +99,17 @@ class AddWorkDay(tk.Frame):
             return
 
         work_date = self.working_date.isoformat()
-        iso_year = str(self.working_date.isocalendar().year)
-        iso_week = self.working_date.isocalendar().week
-        week_number = f'{iso_year}-{iso_week:>02}'
-        if not self.db.get_work_day(work_date=work_date):
-            self.db.new_work_day(work_date=work_date,
-                                 week_number=week_number,
-                                 location=location)
+        week_number = work_calendar.week_number(self.working_date)
+        if self.db.add_work_day(work_date=work_date,
+                                week_number=week_number,
+                                location=location):
             messagebox.showinfo(
                 message=f"Date: {self.working_date}\nLocation: {location.title()}\nAdded to the database")
             self.refresh()
         else:
             messagebox.showerror(message=f"A location for {work_date} was already recorded.",)
 
-        ytd_html_report.generate_report()
+        report_scheduler.request_report()
 
     def on_close(self):
         self.db.close()
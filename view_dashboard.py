@@ -2,20 +2,24 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from datetime import date
-from datetime import timedelta
 
+from async_database import AsyncDatabase
 import constants
-from database import Database
+from columnar_store import open_database
+import work_calendar
 
 
 class DashboardView(tk.Frame):
     """
-    Show a dashboard with summary data: YTD average weekly attendance and the
-    days in the office for the current week.
+    Show a dashboard with summary data: YTD average weekly attendance, the
+    days in the office for the current week, the rolling 4-week and 52-week
+    averages and the target average.
     """
     def __init__(self, parent, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
-        self.db = Database()
+        # The queries run on a worker thread, so a slow database does not
+        # freeze the window
+        self.db = AsyncDatabase(lambda: open_database(constants.analytics_backend), widget=self)
 
         title_label = ttk.Label(self,
                                 text="Dashboard",
@@ -32,27 +36,101 @@ class DashboardView(tk.Frame):
                                     font=("TkDefaultFont", constants.label_size))
         curr_week_label.grid(row=2, column=0, padx=10, pady=10)
 
+        rolling_4_label = ttk.Label(self,
+                                    text="Rolling 4 weeks:",
+                                    font=("TkDefaultFont", constants.label_size))
+        rolling_4_label.grid(row=3, column=0, padx=10, pady=10)
+
+        rolling_52_label = ttk.Label(self,
+                                     text="Rolling 52 weeks:",
+                                     font=("TkDefaultFont", constants.label_size))
+        rolling_52_label.grid(row=4, column=0, padx=10, pady=10)
+
+        target_label = ttk.Label(self,
+                                 text="Target average:",
+                                 font=("TkDefaultFont", constants.label_size))
+        target_label.grid(row=5, column=0, padx=10, pady=10)
+
+        self.ytd_data_label = ttk.Label(self,
+                                        font=("TkDefaultFont", constants.label_size))
+        self.ytd_data_label.grid(row=1, column=1, padx=10, pady=10)
+
+        self.curr_week_data_label = ttk.Label(self,
+                                              font=("TkDefaultFont", constants.label_size))
+        self.curr_week_data_label.grid(row=2, column=1, padx=10, pady=10)
+
+        self.rolling_4_data_label = ttk.Label(self,
+                                              font=("TkDefaultFont", constants.label_size))
+        self.rolling_4_data_label.grid(row=3, column=1, padx=10, pady=10)
+
+        self.rolling_52_data_label = ttk.Label(self,
+                                               font=("TkDefaultFont", constants.label_size))
+        self.rolling_52_data_label.grid(row=4, column=1, padx=10, pady=10)
+
+        target_data_label = ttk.Label(self,
+                                      text=f"{constants.target_average:.2f}",
+                                      font=("TkDefaultFont", constants.label_size))
+        target_data_label.grid(row=5, column=1, padx=10, pady=10)
+
+        self.rendered_version = None
         self.refresh()
 
     def refresh(self):
-        iso_year = date.today().isocalendar().year
-        previous_iso_week = (date.today() - timedelta(weeks=1)).isocalendar().week
-        previous_week_number = f"{iso_year}-{previous_iso_week:>02}"
-        current_iso_week = date.today().isocalendar().week
-        current_week_number = f"{iso_year}-{current_iso_week:>02}"
-
-        ytd_average = self.db.get_ytd_average(year=iso_year,
-                                              end_week=previous_week_number)
-        current_week_count = self.db.get_weekly_count(week_number=current_week_number)
-
-        ytd_data_label = ttk.Label(self,
-                                   text=f"{ytd_average:.2f}",
-                                   font=("TkDefaultFont", constants.label_size))
-        ytd_data_label.grid(row=1, column=1, padx=10, pady=10)
-
-        curr_week_data_label = ttk.Label(self, text=f"{current_week_count}",
-                                         font=("TkDefaultFont", constants.label_size))
-        curr_week_data_label.grid(row=2, column=1, padx=10, pady=10)
+        """
+        Asks the worker thread for the dashboard numbers. The labels are
+        updated in place when they arrive. Skipped if neither the data nor
+        the date has changed since the last refresh.
+        """
+        self.db.submit(self.load_numbers, date.today(), self.rendered_version,
+                       callback=self.show_numbers)
+
+    @staticmethod
+    def load_numbers(db, today: date, rendered_version: tuple) -> tuple:
+        """
+        Runs the dashboard queries. Called on the worker thread of the
+        AsyncDatabase, with its database.
+        :param db: A Database or ColumnarStore.
+        :param today: The date to show the numbers for.
+        :param rendered_version: The version of the numbers on screen.
+        :return: A tuple of the form (version, ytd average, current week
+        count, rolling averages), or None if the version has not changed.
+        """
+        version = (db.data_version(), today)
+        if version == rendered_version:
+            return None
+
+        iso_year = work_calendar.iso_year(today)
+        previous_week_number = work_calendar.previous_week(today)
+        current_week_number = work_calendar.current_week(today)
+
+        # In the first week of the year there is no completed week to average
+        ytd_average = db.get_ytd_average(year=iso_year,
+                                         end_week=previous_week_number)
+        current_week_count = db.get_weekly_count(week_number=current_week_number)
+        rolling = db.get_rolling_averages(end_week=previous_week_number,
+                                          windows=(4, 52))
+        return version, ytd_average, current_week_count, rolling
+
+    def show_numbers(self, numbers: tuple) -> None:
+        """
+        Updates the labels with the numbers from load_numbers. Called on the
+        Tk thread.
+        """
+        if numbers is None:
+            return
+        self.rendered_version, ytd_average, current_week_count, rolling = numbers
+
+        self.ytd_data_label.configure(text=self.format_average(ytd_average))
+        self.curr_week_data_label.configure(text=f"{current_week_count}")
+        self.rolling_4_data_label.configure(text=self.format_average(rolling[4]))
+        self.rolling_52_data_label.configure(text=self.format_average(rolling[52]))
+
+    @staticmethod
+    def format_average(average: float) -> str:
+        """
+        Formats an average for display, or '-' if there is none.
+        """
+        return "-" if average is None else f"{average:.2f}"
 
     def on_close(self):
         self.db.close()
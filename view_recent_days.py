@@ -5,14 +5,15 @@ from sqlite3 import IntegrityError
 
 import constants
 from database import Database
-import ytd_html_report
+from paged_treeview import PagedTreeview
+import report_scheduler
 
 class RecentDaysView(tk.Frame):
     """
     Display a frame that shows location history for the most recent 15 days
-    that were recorded. Can update the location from office to remote using
-    the provided button. When toggled, the database is updated immediately
-    with the revised information.
+    that were recorded, with paging back through older days. Can update the
+    location from office to remote using the provided button. When toggled,
+    the database is updated immediately with the revised information.
     """
     def __init__(self, parent, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
@@ -24,19 +25,19 @@ class RecentDaysView(tk.Frame):
         self.header_label.pack()
 
         self.db = Database()
-        days = self.db.get_recent_days()
-
-        self.treeview = ttk.Treeview(self, show='headings', height=15, selectmode='browse')
-        self.treeview['columns'] = ('date', 'location')
-        self.treeview.heading('date', text="Date")
-        self.treeview.heading('location', text="Location")
-        self.treeview.column('date', width=100, anchor='center')
-        self.treeview.column('location', width=100, anchor='center')
+
+        self.days = PagedTreeview(self,
+                                  columns=[('date', "Date"), ('location', "Location")],
+                                  page_size=15,
+                                  fetch_before=lambda key, n: self.db.get_days_before(key, n),
+                                  fetch_after=lambda key, n: self.db.get_days_after(key, n))
+        self.treeview = self.days.treeview
+        self.rendered_version = None
         self.refresh()
 
         style = ttk.Style()
         style.configure("Treeview", font=("TkDefaultFont", constants.treeview_size))
-        self.treeview.pack()
+        self.days.pack()
 
         btn_style = ttk.Style()
         btn_style.configure("btn.TButton", padding=(10, 5))
@@ -48,11 +49,15 @@ class RecentDaysView(tk.Frame):
         self.btn.pack(pady=10)
 
     def refresh(self):
-        for i in self.treeview.get_children():
-            self.treeview.delete(i)
-        days = self.db.get_recent_days()
-        for day in days:
-            self.treeview.insert("", "end", values=day)
+        """
+        Reloads the current page. Skipped if the data has not
+        changed since the last refresh.
+        """
+        version = self.db.data_version()
+        if version == self.rendered_version:
+            return
+        self.rendered_version = version
+        self.days.refresh()
 
     def get_selected_item_id(self) -> str:
         """
@@ -88,7 +93,7 @@ class RecentDaysView(tk.Frame):
             location = workday[2]
             self.treeview.item(item_id, values=(work_date, location))
 
-            ytd_html_report.generate_report()
+            report_scheduler.request_report()
 
     def on_close(self):
         self.db.close()
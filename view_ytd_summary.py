@@ -3,13 +3,17 @@ from tkinter import ttk
 from tkinter import messagebox
 from sqlite3 import IntegrityError
 from datetime import date
+from datetime import timedelta
 
 import constants
 from database import Database
+from paged_treeview import PagedTreeview
+import work_calendar
 
 class YTDSummary(tk.Frame):
     """
-    Create a frame that shows a YTD summary of the weekly data
+    Create a frame that shows a summary of the weekly data, a page of weeks
+    at a time ending with the current week
     """
     def __init__(self, parent, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
@@ -22,30 +26,51 @@ class YTDSummary(tk.Frame):
 
         self.db = Database()
 
-        self.treeview = ttk.Treeview(self, show='headings', height=15, selectmode='browse')
-        self.treeview['columns'] = ('week_number', 'week_start', 'week_end', 'office_count')
-        self.treeview.heading('week_number', text="Week Number")
-        self.treeview.heading('week_start', text="Start Date")
-        self.treeview.heading('week_end', text="End Date")
-        self.treeview.heading('office_count', text="Count")
-        self.treeview.column('week_number', width=100, anchor='center')
-        self.treeview.column('week_start', width=100, anchor='center')
-        self.treeview.column('week_end', width=100, anchor='center')
-        self.treeview.column('office_count', width=100, anchor='center')
+        self.weeks = PagedTreeview(self,
+                                   columns=[('week_number', "Week Number"),
+                                            ('week_start', "Start Date"),
+                                            ('week_end', "End Date"),
+                                            ('office_count', "Count")],
+                                   page_size=15,
+                                   fetch_before=self.fetch_weeks_before,
+                                   fetch_after=self.fetch_weeks_after,
+                                   newest_first=False)
+        self.treeview = self.weeks.treeview
+        self.rendered_version = None
         self.refresh()
 
         style = ttk.Style()
         style.configure("Treeview", font=("TkDefaultFont", constants.treeview_size))
-        self.treeview.pack()
+        self.weeks.pack()
 
     def refresh(self):
-        start_week = str(date.today().year) + '-01'
-        end_week = str(date.today().year) + "-" + str(date.today().isocalendar().week).zfill(2)
-        for i in self.treeview.get_children():
-            self.treeview.delete(i)
-        weeks = self.db.get_weekly_summary(start_week=start_week, end_week=end_week)
-        for week in weeks:
-            self.treeview.insert("", "end", values=week)
+        """
+        Reloads the current page. Skipped if neither the data nor the current week has
+        changed since the last refresh.
+        """
+        version = (self.db.data_version(), work_calendar.current_week())
+        if version == self.rendered_version:
+            return
+        self.rendered_version = version
+        self.weeks.refresh()
+
+    def fetch_weeks_before(self, week_number: str, num_of_weeks: int) -> list[tuple]:
+        """
+        Fetches a page of weeks before week_number, newest first. A
+        week_number of None means the page ending with the current week.
+        """
+        if week_number is None:
+            week_number = work_calendar.week_number(date.today() + timedelta(weeks=1))
+        return self.db.get_weeks_before(week_number, num_of_weeks)
+
+    def fetch_weeks_after(self, week_number: str, num_of_weeks: int) -> list[tuple]:
+        """
+        Fetches a page of weeks after week_number, oldest first, stopping at
+        the current week.
+        """
+        current_week = work_calendar.current_week()
+        weeks = self.db.get_weeks_after(week_number, num_of_weeks)
+        return [week for week in weeks if week[0] <= current_week]
 
     def get_selected_item_id(self) -> str:
         """
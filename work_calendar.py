@@ -0,0 +1,172 @@
+"""
+ISO week helpers shared by the database setup, the views and the reports.
+Weeks are identified by week number strings in the format yyyy-ww, where
+yyyy is the ISO year. The ISO year differs from the calendar year for a few
+days around New Year, so always use these helpers rather than date.year.
+
+The database stores dates as Julian day numbers, which SQLite's date()
+function turns back into yyyy-mm-dd text, and weeks as integer ids of the
+form yyyyww. day_number() and week_id() convert to the stored form.
+"""
+from datetime import date
+from datetime import timedelta
+from functools import lru_cache
+from typing import Iterable
+
+# Julian day number minus the proleptic Gregorian ordinal of the same date
+JULIAN_DAY_OFFSET = 1721425
+
+
+@lru_cache(maxsize=4096)
+def week_number(day: date) -> str:
+    """
+    Converts a date to its ISO week number string. Cached, since callers tend
+    to ask for the same few days over and over.
+    :param day: The date to convert.
+    :return: Week number string in the format yyyy-ww
+    """
+    iso_year, iso_week, _ = day.isocalendar()
+    return f"{iso_year:04}-{iso_week:02}"
+
+
+def iso_year(day: date) -> int:
+    """
+    Returns the ISO year of a date, the year its ISO week belongs to.
+    :param day: The date.
+    :return: The four-digit ISO year.
+    """
+    return day.isocalendar().year
+
+
+def first_week(year: int) -> str:
+    """
+    Returns the first week number of an ISO year.
+    :param year: The four-digit ISO year.
+    :return: Week number string in the format yyyy-ww
+    """
+    return f"{year:04}-01"
+
+
+def current_week(today: date = None) -> str:
+    """
+    Returns the week number of today.
+    :param today: The date to treat as today. Defaults to date.today().
+    :return: Week number string in the format yyyy-ww
+    """
+    return week_number(today or date.today())
+
+
+def previous_week(today: date = None) -> str:
+    """
+    Returns the week number of the week before today. In the first week of a
+    year this is a week of the previous ISO year.
+    :param today: The date to treat as today. Defaults to date.today().
+    :return: Week number string in the format yyyy-ww
+    """
+    return week_number((today or date.today()) - timedelta(weeks=1))
+
+
+def day_number(day: date | str) -> int:
+    """
+    Converts a date to the Julian day number stored in the database.
+    :param day: A date, or an ISO formatted date string, yyyy-mm-dd.
+    :return: The Julian day number of the date.
+    :raises ValueError: If day is a string that is not an ISO date.
+    """
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.toordinal() + JULIAN_DAY_OFFSET
+
+
+def week_id(week_number: str) -> int:
+    """
+    Converts a week number string to the integer week id stored in the
+    database. Week ids sort in the same order as week number strings.
+    :param week_number: Week number string in the format yyyy-ww
+    :return: The week id, yyyy * 100 + ww, e.g. 202448 for 2024-48.
+    :raises ValueError: If week_number is not in the format yyyy-ww
+    """
+    year, number = week_number.split("-")
+    return int(year) * 100 + int(number)
+
+
+def parse_week(week_number: str) -> tuple[int, int]:
+    """
+    Splits a week number string into its ISO year and week, checking that the
+    year has that week.
+    :param week_number: Week number string in the format yyyy-ww
+    :return: Tuple of (year, week).
+    :raises ValueError: If week_number is not in the format yyyy-ww, or the
+    week is not one of the weeks of its year.
+    """
+    year, _, number = week_number.partition("-")
+    digits = year + number
+    if len(year) != 4 or len(number) != 2 or not (digits.isascii() and digits.isdigit()):
+        raise ValueError(f"Invalid week number {week_number!r}, expected yyyy-ww")
+    year, number = int(year), int(number)
+    # weeks_of_year needs the start of the following year
+    if not 1 <= year < 9999 or not 1 <= number <= len(weeks_of_year(year)):
+        raise ValueError(f"{week_number!r} is not a week of an ISO year")
+    return year, number
+
+
+@lru_cache(maxsize=None)
+def _year_start(year: int) -> int:
+    """Returns the ordinal of the first day of an ISO year."""
+    return date.fromisocalendar(year, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=None)
+def weeks_of_year(year: int) -> tuple[tuple[str, str, str], ...]:
+    """
+    Returns the precomputed week table of an ISO year.
+    :param year: The four-digit ISO year.
+    :return: Tuple of (week_number, week_start, week_end) tuples, one for each
+    week of the year. The start and end are ISO formatted date strings.
+    """
+    start = date.fromordinal(_year_start(year))
+    week_count = (_year_start(year + 1) - _year_start(year)) // 7
+    weeks = []
+    for index in range(week_count):
+        week_start = start + timedelta(weeks=index)
+        week_end = week_start + timedelta(days=6)
+        weeks.append((f"{year:04}-{index + 1:02}", week_start.isoformat(), week_end.isoformat()))
+    return tuple(weeks)
+
+
+def week_rows(start_year: int, end_year: int) -> list[tuple[str, str, str]]:
+    """
+    Returns the rows for the Week table from the first week of start_year up
+    to, but not including, end_year.
+    :param start_year: The first ISO year.
+    :param end_year: The ISO year to stop at. Not inclusive.
+    :return: List of (week_number, week_start, week_end) tuples.
+    """
+    rows = []
+    for year in range(start_year, end_year):
+        rows.extend(weeks_of_year(year))
+    return rows
+
+
+def week_numbers(days: Iterable[date]) -> list[str]:
+    """
+    Converts many dates to week number strings using the precomputed week
+    tables, which is faster than calling isocalendar() for each date.
+    :param days: The dates to convert.
+    :return: List of week number strings, in the same order as days.
+    """
+    numbers = []
+    start = end = 0
+    weeks = ()
+    for day in days:
+        ordinal = day.toordinal()
+        if not start <= ordinal < end:
+            year = day.year
+            if ordinal < _year_start(year):
+                year -= 1
+            elif ordinal >= _year_start(year + 1):
+                year += 1
+            start, end = _year_start(year), _year_start(year + 1)
+            weeks = weeks_of_year(year)
+        numbers.append(weeks[(ordinal - start) // 7][0])
+    return numbers
@@ -1,11 +1,21 @@
+import importlib
+import os
+from pathlib import Path
 import tkinter as tk
 from tkinter import ttk
 
+import audit
+import connection_pool
 import constants
-from view_recent_days import RecentDaysView
-from view_dashboard import DashboardView
-from view_add_work_day import AddWorkDay
-from view_ytd_summary import YTDSummary
+import report_scheduler
+
+# The module and class of each view. A view's module is imported and the view
+# is built the first time it is shown, so only the dashboard is built before
+# the window first appears.
+VIEWS = {'home': ('view_dashboard', 'DashboardView'),
+         'recent_days': ('view_recent_days', 'RecentDaysView'),
+         'add_day': ('view_add_work_day', 'AddWorkDay'),
+         'ytd_summary': ('view_ytd_summary', 'YTDSummary'), }
 
 
 class WorkLocation():
@@ -21,11 +31,8 @@ class WorkLocation():
         self.content_frame = tk.Frame(self.root)
         self.content_frame.grid(column=1, row=1, sticky='nsew')
 
-        self.frames = {'home': DashboardView(self.content_frame),
-                       'recent_days': RecentDaysView(self.content_frame),
-                       'add_day': AddWorkDay(self.content_frame),
-                       'ytd_summary': YTDSummary(self.content_frame), }
-        self.current_frame = self.frames['home']
+        self.frames = {}
+        self.current_frame = self.get_frame('home')
         self.current_frame.pack()
 
         self.nav_frame = tk.Frame(self.root)
@@ -72,33 +79,64 @@ class WorkLocation():
 
         nav_buttons.grid(column=1, row=2, sticky='nsew')
 
+    def get_frame(self, name: str) -> tk.Frame:
+        """
+        Returns the view with the given name, building it on first use.
+        :param name: A key of VIEWS.
+        :return: The view's frame.
+        """
+        if name not in self.frames:
+            module_name, class_name = VIEWS[name]
+            view_class = getattr(importlib.import_module(module_name), class_name)
+            self.frames[name] = view_class(self.content_frame)
+        return self.frames[name]
+
     def change_frame(self, frame: str) -> None:
         """
-        Updates the content frame to show the requested frame/view. Before the
-        new frame is displayed, the contents are refreshed.
+        Updates the content frame to show the requested frame/view. The view
+        is built the first time it is requested. Before the new frame is
+        displayed, the contents are refreshed.
         :param frame: The requested frame/view.
         :return: None
         """
         self.current_frame.pack_forget()
 
         if frame == 'home':
-            self.current_frame = self.frames['home']
+            self.current_frame = self.get_frame('home')
         elif frame == 'recent':
-            self.current_frame = self.frames['recent_days']
+            self.current_frame = self.get_frame('recent_days')
         elif frame == 'add_day':
-            self.current_frame = self.frames['add_day']
+            self.current_frame = self.get_frame('add_day')
         elif frame == 'ytd_summary':
-            self.current_frame = self.frames['ytd_summary']
+            self.current_frame = self.get_frame('ytd_summary')
 
         self.current_frame.refresh()
         self.current_frame.pack()
 
+    def on_close(self) -> None:
+        """
+        Writes any pending report, stops the report and dashboard workers,
+        closes the shared database connections and then closes the main
+        window.
+        :return: None
+        """
+        report_scheduler.stop()
+        # The dashboard's database lives on its own worker thread
+        self.frames['home'].db.close()
+        connection_pool.close_all()
+        self.root.destroy()
+
 
 if __name__ == '__main__':
+    audit.configure(audit_db=Path('Data/worklocation.db'))
+    if os.environ.get('WORK_LOCATION_PROFILE'):
+        import instrumentation
+        instrumentation.enable(slow_ms=constants.slow_query_ms, dump_on_exit=True)
     root = tk.Tk()
     root.title("Work Location")
     root.geometry("650x500")
     app = WorkLocation(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
 
     root.mainloop()
 
@@ -1,32 +1,65 @@
 from datetime import date
 
 from database import Database
+from db_setup import DEFAULT_PERSON_ID
 from py_html import PyHTML
+import work_calendar
 
-def generate_report():
+def generate_report(db: Database = None, year: int = None,
+                    person_id: int = DEFAULT_PERSON_ID,
+                    filename: str = "ytd_location_report.html",
+                    today: date = None) -> None:
     """
-    Generate an HTML report of YTD weekly attendance
+    Generate an HTML report of YTD weekly attendance. The report is written
+    to a temporary file that replaces filename once it is complete.
+    :param db: The database to report on. Defaults to a new Database for the
+    default path, which is closed when the report is written.
+    :param year: The ISO year of the report. Defaults to the current year.
+    For a past year the report covers the whole year.
+    :param person_id: The person to report on.
+    :param filename: The name of the HTML file to write.
+    :param today: The date to treat as today. Defaults to date.today().
     """
-    report = PyHTML("YTD Attendance Report")
-    db = Database()
+    own_db = db is None
+    if own_db:
+        db = Database()
+    try:
+        _write_report(db, year, person_id, filename, today)
+    finally:
+        if own_db:
+            db.close()
 
-    current_year: int = date.today().year
-    start_week: str = str(current_year) + '-01'
-    end_week: str = str(current_year) + "-" + str(date.today().isocalendar().week).zfill(2)
 
-    weeks: list[tuple] = db.get_weekly_summary(start_week=start_week, end_week=end_week)
-    ytd_average: float = db.get_ytd_average(year=current_year, end_week=end_week)
-    current_week_count: int = db.get_weekly_count(week_number=end_week)
-    db.close()
-
-    report.h1("YTD Attendance Report")
-    report.p(f"YTD average: {ytd_average:.2f}")
-    report.p(f"Current week count: {current_week_count}")
-    table_headers = ["Week #", "Start Date", "End Date", "Count"]
-    report.table(table_headers, weeks)
-    report.render("ytd_location_report.html")
+def _write_report(db: Database, year: int, person_id: int, filename: str,
+                  today: date) -> None:
+    """
+    Writes the report for generate_report() with an open database.
+    """
+    if today is None:
+        today = date.today()
+    current_year: int = work_calendar.iso_year(today)
+    if year is None:
+        year = current_year
+    start_week: str = work_calendar.first_week(year)
+    if year == current_year:
+        end_week: str = work_calendar.current_week(today)
+    else:
+        end_week: str = work_calendar.weeks_of_year(year)[-1][0]
 
+    ytd_average: float = db.get_ytd_average(year=year, end_week=end_week, person_id=person_id)
+    current_week_count: int = db.get_weekly_count(week_number=end_week, person_id=person_id)
 
+    title = "YTD Attendance Report" if year == current_year else f"{year} Attendance Report"
+    if person_id != DEFAULT_PERSON_ID:
+        name = dict(db.get_persons()).get(person_id, f"person {person_id}")
+        title = f"{title}, {name}"
+    with PyHTML.stream_to(filename, title) as report:
+        report.h1(title)
+        report.p(f"YTD average: {'-' if ytd_average is None else f'{ytd_average:.2f}'}")
+        report.p(f"{'Current' if year == current_year else 'Last'} week count: {current_week_count}")
+        table_headers = ["Week #", "Start Date", "End Date", "Count"]
+        weeks = db.iter_weekly_summary(start_week=start_week, end_week=end_week, person_id=person_id)
+        report.table(table_headers, weeks)
 
 if __name__ == "__main__":
     generate_report()